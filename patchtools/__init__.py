@@ -10,4 +10,4 @@ __version__ = '1.2'
 class PatchException(Exception):
     pass
 
-config = config.Config()
+config = config.LazyConfig()
@@ -0,0 +1,347 @@
+# vim: sw=4 ts=4 et si:
+"""
+How we read a repository: by running git, or in-process with pygit2
+
+Everything patchtools asks of a repository goes through a backend:
+resolving commit names, the patch text of a commit and the files it
+changes, the remote URL, config values, the commits only on the local
+branch, and the release tags and the commits each one adds.
+
+GitBackend, the default, runs git for all of it, through the sessions
+and one-off commands of gitsession. Pygit2Backend reads objects, refs
+and config directly with libgit2, so none of those cost a fork and exec
+of git. The patch text is still generated by 'git diff-tree': its
+stat, abbreviations, encodings and combined diffs are git's own, and
+the output has to match what git gives byte for byte. So are the files
+a commit changes, which need the same diff, and the walk that builds
+the tag index (see Pygit2Backend).
+
+The backend is chosen with 'backend' in the [repositories] section of
+patch.cfg. If pygit2 is asked for but can't be imported, or can't open
+a repository, git is used instead.
+"""
+
+import fnmatch
+import os
+import re
+import sys
+import threading
+from contextlib import suppress
+
+import patchtools
+from patchtools import gitsession, timings
+
+# Imported by Pygit2Backend, the first time one is used
+pygit2 = None
+
+DEFAULT_BACKEND = 'git'
+
+# The names of release tags
+RELEASE_TAGS = 'v[0-9]*'
+
+_backends = {}
+_backends_lock = threading.Lock()
+_warned = set()
+
+
+class GitBackend:
+    """Reads a repository by running git."""
+    name = 'git'
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.pool = gitsession.get_pool(repo)
+
+    def resolve(self, rev):
+        """Return the full hash of the commit 'rev' names, or None."""
+        with self.pool.session() as git:
+            return git.resolve(rev)
+
+    def commit_email(self, sha, paths=None):
+        """Return 'git diff-tree' output for the full hash 'sha', or a
+        largepatch.LargePatch of it if it's bigger than the 'large-patch'
+        size of patch.cfg. With 'paths', only for the files at or under
+        those paths.
+        """
+        limit = patchtools.config.large_patch_size
+        with self.pool.session() as git:
+            return git.diff_tree(sha, paths, limit)
+
+    def changed_files(self, sha):
+        """Return [(status, path)] for the files the commit 'sha' changes,
+        in the order its diff has them. Merges change none.
+        """
+        with self.pool.session() as git:
+            output = git.changed_files(sha)
+        files = []
+        for line in output.splitlines():
+            if line.startswith(':'):
+                (fields, path) = line.split('\t', 1)
+                files.append((fields.split()[-1][:1], path))
+        return files
+
+    def line_counts(self, sha, paths):
+        """Return {path: (added, deleted)} for the files at 'paths' that
+        the commit 'sha' changes. Binary files count as None.
+        """
+        output = self.pool.run('diff-tree', '--no-renames', '-r', '--numstat', sha, '--',
+                               *[ ':(top,literal)' + path for path in paths ])
+        counts = {}
+        for line in output.splitlines():
+            try:
+                (added, deleted, path) = line.split('\t', 2)
+            except ValueError:
+                continue
+            if added == '-':
+                counts[path] = None
+            else:
+                counts[path] = (int(added), int(deleted))
+        return counts
+
+    def remote_url(self):
+        """Return the URL of the 'origin' remote as 'git remote show'
+        gives it, which is "origin" if there's no such remote, or None
+        if this isn't a repository.
+        """
+        output = self.pool.run('remote', 'show', 'origin', '-n')
+        for line in output.split('\n'):
+            m = re.search(r'URL:\s+(\S+)', line)
+            if m:
+                return m.group(1)
+        return None
+
+    def config(self, var):
+        """Return the value of the config variable 'var', or ""."""
+        return self.pool.run('config', var).strip()
+
+    def local_commits(self):
+        """Return the set of commits on the current branch that aren't on
+        any remote (or only those of the branch's remote, if it has one).
+        """
+        branch = self.pool.run('symbolic-ref', '--short', 'HEAD').strip()
+        remote = self.pool.run('config', '--get', f'branch.{branch}.remote').split()
+        out = self.pool.run('rev-list', 'HEAD', '--not', '--remotes', *remote)
+        return frozenset(out.split())
+
+    def tag_names(self):
+        """Return the names of the release tags, in no particular order."""
+        return self.pool.run('tag', '-l', RELEASE_TAGS).split()
+
+    def release_tags(self):
+        """Return [(name, commit)] for the release tags that point at a
+        commit, directly or through one tag object, in no particular order.
+        """
+        output = self.pool.run('for-each-ref', 'refs/tags/' + RELEASE_TAGS,
+                               '--format=%(objectname) %(objecttype) %(*objectname) '
+                               '%(*objecttype) %(refname:strip=2)')
+        tags = []
+        for line in output.splitlines():
+            fields = line.split()
+            if fields[1:2] == ['tag']:
+                # What the tag object points at comes after it
+                fields = fields[2:]
+            if fields[1:2] == ['commit']:
+                tags.append((fields[-1], fields[0]))
+            # else tags of trees and blobs, like v2.6.11-tree
+        return tags
+
+    def new_commits(self, sha, previous):
+        """Return the commits in 'sha' that none of 'previous' contain.
+        Raise OSError or subprocess.CalledProcessError on failure.
+        """
+        lines = [ sha ] + [ '^' + p for p in previous ]
+        return self.pool.run('rev-list', '--stdin', input='\n'.join(lines) + '\n',
+                             check=True).split()
+
+    def name_rev(self, commit):
+        """Return 'git name-rev' output naming 'commit' after a release tag."""
+        return self.pool.run('name-rev', '--refs=refs/tags/' + RELEASE_TAGS, commit)
+
+
+class Pygit2Backend(GitBackend):
+    """Reads a repository in-process with pygit2, leaving to git what
+    libgit2 can't give exactly as git would, and new_commits(): walking
+    a whole release is several times faster with 'git rev-list', which
+    has the commit-graph, and the tag index only does it once per tag.
+    """
+    name = 'pygit2'
+
+    def __init__(self, repo):
+        super().__init__(repo)
+        # A libgit2 repository mustn't be used by two threads at once
+        self._lock = threading.Lock()
+        self._repository = None
+        self._opened = False
+
+    def _open(self):
+        """Return the pygit2 Repository, or None if there isn't one."""
+        if self.repo is None:
+            # git runs in the current directory, which may change
+            return self._discover(os.getcwd())
+        if not self._opened:
+            self._opened = True
+            self._repository = self._discover(self.repo)
+        return self._repository
+
+    @staticmethod
+    def _discover(path):
+        try:
+            path = pygit2.discover_repository(path)
+            if path is not None:
+                return pygit2.Repository(path)
+        except (pygit2.GitError, OSError, ValueError):
+            pass
+        return None
+
+    @staticmethod
+    def _commit(obj):
+        return obj.peel(pygit2.Commit)
+
+    def resolve(self, rev):
+        if not rev or '\n' in rev:
+            return None
+        started = timings.start()
+        with self._lock:
+            r = self._open()
+            if r is None:
+                sha = None
+            else:
+                try:
+                    sha = str(self._commit(r.revparse_single(rev)).id)
+                except (KeyError, ValueError, pygit2.GitError):
+                    sha = None
+        timings.command('pygit2 resolve', started)
+        return sha
+
+    def remote_url(self):
+        started = timings.start()
+        with self._lock:
+            r = self._open()
+            if r is None:
+                return None
+            try:
+                url = r.remotes['origin'].url
+            except KeyError:
+                # As 'git remote show -n' reports a remote it doesn't know
+                url = 'origin'
+        timings.command('pygit2 remote', started)
+        m = re.match(r'\s*(\S+)', url or '')
+        return m.group(1) if m else None
+
+    def config(self, var):
+        started = timings.start()
+        with self._lock:
+            r = self._open()
+            if r is None:
+                # git still reads the global and system config
+                return super().config(var)
+            try:
+                value = r.config[var]
+            except (KeyError, ValueError, pygit2.GitError):
+                value = ''
+        timings.command('pygit2 config', started)
+        return str(value).strip()
+
+    def local_commits(self):
+        started = timings.start()
+        with self._lock:
+            r = self._open()
+            if r is None or r.head_is_unborn:
+                return frozenset()
+            remote = None
+            if not r.head_is_detached:
+                try:
+                    remote = r.config[f'branch.{r.head.shorthand}.remote']
+                except (KeyError, ValueError, pygit2.GitError):
+                    remote = None
+
+            walker = r.walk(r.head.target)
+            for name in r.references:
+                if name.startswith('refs/remotes/'):
+                    with suppress(KeyError, ValueError, pygit2.GitError):
+                        walker.hide(self._commit(r.revparse_single(name)).id)
+            if remote:
+                try:
+                    walker.hide(self._commit(r.revparse_single(remote)).id)
+                except (KeyError, ValueError, pygit2.GitError):
+                    # 'git rev-list' fails, so nothing counts as local
+                    return frozenset()
+            commits = frozenset(str(commit.id) for commit in walker)
+        timings.command('pygit2 rev-list', started)
+        return commits
+
+    def _tag_refs(self, r):
+        """Yield (name, ref name) for the release tags."""
+        for refname in r.references:
+            if refname.startswith('refs/tags/'):
+                name = refname[len('refs/tags/'):]
+                if fnmatch.fnmatchcase(name, RELEASE_TAGS):
+                    yield (name, refname)
+
+    def tag_names(self):
+        started = timings.start()
+        with self._lock:
+            r = self._open()
+            if r is None:
+                return []
+            names = [ name for (name, refname) in self._tag_refs(r) ]
+        timings.command('pygit2 tag', started)
+        return names
+
+    def release_tags(self):
+        started = timings.start()
+        with self._lock:
+            r = self._open()
+            if r is None:
+                return []
+            tags = []
+            for (name, refname) in self._tag_refs(r):
+                if '/' in name:
+                    # for-each-ref's '*' doesn't match a '/'
+                    continue
+                try:
+                    obj = r[r.references[refname].target]
+                    # Like for-each-ref's %(*objectname), peel one tag only
+                    if isinstance(obj, pygit2.Tag):
+                        obj = r[obj.target]
+                except (KeyError, ValueError, pygit2.GitError):
+                    continue
+                if isinstance(obj, pygit2.Commit):
+                    tags.append((name, str(obj.id)))
+        timings.command('pygit2 for-each-ref', started)
+        return tags
+
+
+BACKENDS = { 'git' : GitBackend, 'pygit2' : Pygit2Backend }
+
+
+def _available(name):
+    """Return 'name' if that backend can be used, else the default."""
+    global pygit2  # noqa: PLW0603
+    if name == 'pygit2' and pygit2 is None:
+        with suppress(ImportError):
+            import pygit2  # noqa: PLC0415
+    if name in BACKENDS and (name != 'pygit2' or pygit2 is not None):
+        return name
+    if name not in _warned:
+        _warned.add(name)
+        print(f'The {name} git backend is not available; using {DEFAULT_BACKEND}', file=sys.stderr)
+    return DEFAULT_BACKEND
+
+
+def get_backend(repo, name=None):
+    """Return the backend for 'repo'. 'name' is the backend to use, by
+    default the one in patch.cfg.
+    """
+    if name is None:
+        # patchtools.config only becomes the loaded configuration once
+        # the package has been imported, so look it up now
+        name = patchtools.config.git_backend
+    if name != DEFAULT_BACKEND:
+        name = _available(name)
+    key = (repo, name)
+    with _backends_lock:
+        backend = _backends.get(key)
+        if backend is None:
+            backend = _backends[key] = BACKENDS[name](repo)
+        return backend
@@ -0,0 +1,16 @@
+# vim: sw=4 ts=4 et si:
+"""
+Benchmarks for patchtools
+
+These are not run as part of the test suite; run them by hand, e.g.
+
+    patchtools-bench --output results.json
+    python3 -m patchtools.bench.scaling
+    python3 -m patchtools.bench.startup
+    python3 -m patchtools.bench.endtoend
+    python3 -m patchtools.bench.backends
+
+patchtools.bench.kernelrepo builds the synthetic kernel repositories the
+end-to-end benchmark runs against; run it by hand to keep a set around
+and pass that to endtoend or backends with --repo.
+"""
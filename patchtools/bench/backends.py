@@ -0,0 +1,188 @@
+# vim: sw=4 ts=4 et si:
+"""
+Compare the latency of the git backends, operation by operation
+
+Times each operation of every backend that can be used here (git, and
+pygit2 if it's installed) on a repository, by default a small one built
+by patchtools.bench.kernelrepo:
+
+* resolve and commit_email, once per sampled commit;
+* remote_url, local_commits, tag_names and release_tags, which a run
+  asks once per repository;
+* new_commits, the walk the tag index makes for the latest release;
+* one_commit, everything a run exporting a single commit asks, from a
+  fresh backend and with no git processes running, which is the
+  latency a single exportpatch pays.
+
+The results, in microseconds per call, are written as JSON.
+"""
+
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from patchtools import backend, gitsession, patchops
+from patchtools.bench import kernelrepo
+from patchtools.modified_optparse import ModifiedOptionParser, OptionParsingError
+
+# Bump when the meaning of the results changes
+RESULTS_VERSION = 1
+
+
+def available_backends():
+    """Return the names of the backends that can be used here."""
+    names = [ backend.DEFAULT_BACKEND ]
+    names.extend(name for name in backend.BACKENDS
+                 if name != backend.DEFAULT_BACKEND and backend._available(name) == name)
+    return names
+
+
+def _fresh(name, repo):
+    """Return a new backend, with no git processes left from before."""
+    gitsession.close_sessions()
+    return backend.BACKENDS[name](repo)
+
+
+def _time(func, calls):
+    """Return the mean seconds per call of func() over 'calls' calls."""
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - start) / calls
+
+
+def _one_commit(name, repo, commit):
+    b = _fresh(name, repo)
+    sha = b.resolve(commit)
+    b.local_commits()
+    b.remote_url()
+    b.release_tags()
+    b.commit_email(sha)
+
+
+def measure(name, repo, commits, repeat=3):
+    """Return {operation: best seconds per call} for backend 'name'."""
+    results = {}
+
+    def best(operation, func, calls=1):
+        results[operation] = min(_time(func, calls) for i in range(repeat))
+
+    b = _fresh(name, repo)
+    queue = []
+
+    def resolve_next():
+        if not queue:
+            queue.extend(commit[:12] for commit in commits)
+        b.resolve(queue.pop())
+
+    best('resolve', resolve_next, len(commits))
+    emails = []
+
+    def email_next():
+        if not emails:
+            emails.extend(commits)
+        b.commit_email(emails.pop())
+
+    best('commit_email', email_next, len(commits))
+    best('remote_url', b.remote_url)
+    best('local_commits', b.local_commits)
+    best('tag_names', b.tag_names)
+    best('release_tags', b.release_tags)
+
+    tags = sorted(b.release_tags(), key=lambda tag: patchops.key_version(tag[0]))
+    if len(tags) > 1:
+        previous = [ sha for (tag, sha) in tags[:-1] ]
+        best('new_commits', lambda: b.new_commits(tags[-1][1], previous))
+
+    best('one_commit', lambda: _one_commit(name, repo, commits[0][:12]))
+    gitsession.close_sessions()
+    return results
+
+
+def report(results, repo, count, repeat):
+    """Return 'results', {backend: {operation: seconds}}, as a JSON-friendly dict."""
+    samples = []
+    for (name, operations) in results.items():
+        for (operation, seconds) in operations.items():
+            samples.append({ 'backend' : name, 'operation' : operation,
+                             'us_per_call' : seconds * 1e6 })
+    return {
+        'version' : RESULTS_VERSION,
+        'timestamp' : int(time.time()),
+        'python' : platform.python_version(),
+        'platform' : platform.platform(),
+        'repository' : repo,
+        'commits' : count,
+        'repeat' : repeat,
+        'results' : samples,
+    }
+
+
+def print_table(results, out):
+    names = list(results)
+    print(f'{"operation":<16s}' + ''.join(f'{n + " us":>14s}' for n in names), file=out)
+    for operation in results[names[0]]:
+        print(f'{operation:<16s}' +
+              ''.join(f'{results[n].get(operation, 0) * 1e6:14.1f}' for n in names),
+              file=out)
+
+
+def main():
+    """Run the backend benchmark and write the results. Return 0 for success."""
+    parser = ModifiedOptionParser(
+                usage='%prog [options] -- compare the latency of the git backends')
+    parser.add_option('--repo', action='store', default=None,
+                      help='the repository to read [default is a new synthetic one]')
+    parser.add_option('-c', '--commits', type='int', action='store', default=5000,
+                      help='mainline commits to build, without --repo [default is %default]')
+    parser.add_option('-n', '--count', type='int', action='store', default=200,
+                      help='commits to resolve and fetch [default is %default]')
+    parser.add_option('-r', '--repeat', type='int', action='store', default=3,
+                      help='take the best of this many runs [default is %default]')
+    parser.add_option('--output', action='store', default=None,
+                      help='write the results to this file instead of stdout')
+
+    try:
+        (options, _args) = parser.parse_args()
+    except OptionParsingError as e:
+        print(f'Option parsing error: {e.msg}', file=sys.stderr)
+        return 1
+
+    repeat = max(options.repeat, 1)
+    try:
+        with tempfile.TemporaryDirectory(prefix='patchtools-repo-') as built:
+            repo = options.repo
+            if repo is None:
+                shape = kernelrepo.Options(commits=options.commits, subsystems=0)
+                repo = kernelrepo.build(built, shape, sys.stderr)['mainline']
+            commits = subprocess.run([ 'git', 'rev-list', '--no-merges',  # noqa: S603, S607
+                                       f'--max-count={max(options.count, 1)}', 'HEAD' ],
+                                     cwd=repo, check=True, encoding='utf-8',
+                                     stdout=subprocess.PIPE).stdout.split()
+            results = { name : measure(name, repo, commits, repeat)
+                        for name in available_backends() }
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    print_table(results, sys.stderr)
+    results = report(results, options.repo, len(commits), repeat)
+    if options.output:
+        try:
+            with Path(options.output).open('w') as f:
+                json.dump(results, f, indent=1)
+                f.write('\n')
+        except OSError as e:
+            print(e, file=sys.stderr)
+            return 1
+    else:
+        json.dump(results, sys.stdout, indent=1)
+        print()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,247 @@
+# vim: sw=4 ts=4 et si:
+"""
+Time exportpatch and fixpatch from end to end on a kernel-like repository
+
+Builds the repositories with patchtools.bench.kernelrepo (or uses ones
+it built before, with --repo), picks commits spread across mainline's
+history, including merges, and some from each subsystem clone, and times
+the real commands on them:
+
+* exportpatch, writing every commit to a file;
+* exportpatch -x, keeping only one subsystem's files;
+* fixpatch, on copies of the exported files.
+
+Each command is run with an empty cache directory ("cold") and then
+again with the one the first run left behind ("warm"), the best of
+--repeat runs each, and the results are written as JSON. Nothing here
+needs the network.
+"""
+
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from patchtools.bench import kernelrepo
+from patchtools.bench.startup import environment
+from patchtools.modified_optparse import ModifiedOptionParser, OptionParsingError
+
+# Bump when the meaning of the results changes
+RESULTS_VERSION = 1
+
+COMMIT_LIST = 'commits.txt'
+
+# name -> (tool, arguments); PATCHES is replaced with the exported files
+PATCHES = '{patches}'
+COMMANDS = {
+    'exportpatch' : ('exportpatch', [ '-w', '-d', 'out', '--from-file', COMMIT_LIST ]),
+    'exportpatch-extract' : ('exportpatch', [ '-w', '-d', 'out', '-x', 'drivers/scsi/',
+                                              '--from-file', COMMIT_LIST ]),
+    'fixpatch' : ('fixpatch', [ PATCHES ]),
+}
+
+def _git(repo, *args):
+    return subprocess.run([ 'git', *args ], cwd=repo, check=True, encoding='utf-8',  # noqa: S603, S607
+                          stdout=subprocess.PIPE).stdout.split()
+
+def find_repos(path):
+    """Return {name: repository} for the repositories kernelrepo.build()
+    left in 'path'.
+    """
+    repos = { 'mainline' : os.path.join(path, 'linux') }
+    for name in kernelrepo.SUBSYSTEMS:
+        if os.path.isdir(os.path.join(path, name, '.git')):
+            repos[name] = os.path.join(path, name)
+    if not os.path.isdir(os.path.join(repos['mainline'], '.git')):
+        raise OSError(f'No repository in {repos["mainline"]}')
+    return repos
+
+def pick_commits(repos, count):
+    """Return about 'count' commits, evenly spread across mainline, and
+    a tenth as many again from each subsystem clone.
+    """
+    mainline = repos['mainline']
+    # The root commit has nothing to export
+    history = _git(mainline, 'rev-list', 'refs/remotes/origin/master')[:-1]
+    step = max(len(history) // max(count, 1), 1)
+    commits = history[::step][:count]
+    tip = history[0]
+    for (name, repo) in repos.items():
+        if name != 'mainline':
+            queued = _git(repo, 'rev-list', 'refs/remotes/origin/master', '^' + tip)
+            commits += queued[:max(count // 10, 1)]
+    return commits
+
+def _config(scratch, repos):
+    with Path(scratch, 'patch.cfg').open('w') as f:
+        print('[repositories]', file=f)
+        print(f'search: {" ".join(repos.values())}', file=f)
+        print('[contact]', file=f)
+        print('name: Bench User', file=f)
+        print('email: bench@example.com', file=f)
+
+def _run_once(tool, args, scratch, env):
+    """Run 'tool' in 'scratch'. Return the seconds it took."""
+    # exportpatch -d doesn't create the directory
+    shutil.rmtree(os.path.join(scratch, 'out'), ignore_errors=True)
+    os.mkdir(os.path.join(scratch, 'out'))
+    code = (f'import sys; sys.argv[0] = {tool!r}; from patchtools.client import run; '
+            f'sys.exit(run({tool!r}))')
+    start = time.perf_counter()
+    proc = subprocess.run([ sys.executable, '-c', code, *args ], cwd=scratch, env=env,  # noqa: S603
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=False)
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, [ tool, *args ],
+                                            stderr=proc.stderr)
+    if '-d' in args:
+        # Or every commit was skipped, and nothing was exported to time
+        outdir = os.path.join(scratch, args[args.index('-d') + 1])
+        if not os.listdir(outdir):
+            raise OSError(f'{" ".join([ tool, *args ])} wrote nothing to {outdir}')
+    return elapsed
+
+def _patch_copies(scratch, exported):
+    """Copy the exported patches somewhere fixpatch can rewrite them.
+    Return their names.
+    """
+    fixed = os.path.join(scratch, 'fixed')
+    shutil.rmtree(fixed, ignore_errors=True)
+    shutil.copytree(exported, fixed)
+    return [ os.path.join('fixed', name) for name in sorted(os.listdir(fixed)) ]
+
+def run(repos, commits, names, repeat=1, jobs=1):
+    """Time each command in 'names' on 'commits'. Return
+    {name: {'cold': seconds, 'warm': seconds}}.
+
+    How it's going is printed to stderr, so it doesn't get mixed up
+    with the results.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='patchtools-bench-') as scratch:
+        env = environment(scratch)
+        _config(scratch, repos)
+        Path(scratch, COMMIT_LIST).write_text(''.join(commit + '\n' for commit in commits))
+        exported = os.path.join(scratch, 'exported')
+        os.mkdir(exported)
+        _run_once('exportpatch', [ '-w', '-d', exported, '--from-file', COMMIT_LIST ],
+                  scratch, env)
+
+        for name in names:
+            (tool, args) = COMMANDS[name]
+            if jobs != 1:
+                args = [ '-j', str(jobs), *args ]
+            timings = {}
+            for kind in ('cold', 'warm'):
+                best = None
+                for _ in range(repeat):
+                    if kind == 'cold':
+                        shutil.rmtree(env['XDG_CACHE_HOME'], ignore_errors=True)
+                    argv = args
+                    if PATCHES in args:
+                        at = args.index(PATCHES)
+                        argv = args[:at] + _patch_copies(scratch, exported) + args[at + 1:]
+                    elapsed = _run_once(tool, argv, scratch, env)
+                    if best is None or elapsed < best:
+                        best = elapsed
+                timings[kind] = best
+                print(f'{name:<20s} {kind:<4s} {best:8.3f} s {len(commits) / best:8.1f} commits/s',
+                      file=sys.stderr)
+            results[name] = timings
+    return results
+
+def report(results, commits, repeat, jobs, shape):
+    """Return 'results' from run() as a JSON-friendly dict."""
+    samples = []
+    for (name, timings) in results.items():
+        for (kind, seconds) in timings.items():
+            samples.append({ 'command' : name, 'cache' : kind, 'seconds' : seconds,
+                             'commits' : len(commits),
+                             'commits_per_second' : len(commits) / seconds })
+    return {
+        'version' : RESULTS_VERSION,
+        'timestamp' : int(time.time()),
+        'python' : platform.python_version(),
+        'platform' : platform.platform(),
+        'repeat' : repeat,
+        'jobs' : jobs,
+        'repository' : shape,
+        'results' : samples,
+    }
+
+def main():
+    """Run the end-to-end benchmark and write the results. Return 0 for success."""
+    parser = ModifiedOptionParser(
+                usage='%prog [options] -- time exportpatch and fixpatch on a synthetic kernel repository')
+    parser.add_option('--repo', action='store', default=None,
+                      help='use the repositories patchtools.bench.kernelrepo built in this directory')
+    parser.add_option('-c', '--commits', type='int', action='store',
+                      default=kernelrepo.Options().commits,
+                      help='mainline commits to build, without --repo [default is %default]')
+    parser.add_option('-n', '--count', type='int', action='store', default=200,
+                      help='mainline commits to export [default is %default]')
+    parser.add_option('--command', action='append', default=None,
+                      help=f'only time this command ({", ".join(COMMANDS)}). '
+                           'This option can be specified multiple times.')
+    parser.add_option('-j', '--jobs', type='int', action='store', default=1,
+                      help='pass -j to the commands [default is %default]')
+    parser.add_option('-r', '--repeat', type='int', action='store', default=3,
+                      help='take the best of this many runs [default is %default]')
+    parser.add_option('--output', action='store', default=None,
+                      help='write the results to this file instead of stdout')
+
+    try:
+        (options, _args) = parser.parse_args()
+    except OptionParsingError as e:
+        print(f'Option parsing error: {e.msg}', file=sys.stderr)
+        return 1
+
+    names = options.command or list(COMMANDS)
+    for name in names:
+        if name not in COMMANDS:
+            print(f'Unknown command "{name}"', file=sys.stderr)
+            return 1
+
+    repeat = max(options.repeat, 1)
+    try:
+        with tempfile.TemporaryDirectory(prefix='patchtools-repo-') as built:
+            if options.repo:
+                repos = find_repos(options.repo)
+            else:
+                start = time.perf_counter()
+                repos = kernelrepo.build(built, kernelrepo.Options(commits=options.commits),
+                                         sys.stderr)
+                print(f'built in {time.perf_counter() - start:.1f} s', file=sys.stderr)
+            shape = { name : len(_git(repo, 'rev-list', 'refs/remotes/origin/master'))
+                      for (name, repo) in repos.items() }
+            commits = pick_commits(repos, options.count)
+            results = report(run(repos, commits, names, repeat, options.jobs),
+                             commits, repeat, options.jobs, shape)
+    except subprocess.CalledProcessError as e:
+        print(f'{" ".join(e.cmd)} failed: {(e.stderr or b"").decode(errors="replace")}',
+              file=sys.stderr)
+        return 1
+    except OSError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    if options.output:
+        try:
+            with Path(options.output).open('w') as f:
+                json.dump(results, f, indent=1)
+                f.write('\n')
+        except OSError as e:
+            print(e, file=sys.stderr)
+            return 1
+    else:
+        json.dump(results, sys.stdout, indent=1)
+        print()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
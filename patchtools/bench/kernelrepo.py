@@ -0,0 +1,382 @@
+# vim: sw=4 ts=4 et si:
+"""
+Build a synthetic repository shaped like a Linux clone
+
+Realistic exportpatch timings need a kernel tree, and a real one is
+gigabytes, changes every day and needs the network. This builds one
+locally, with 'git fast-import', that has what exportpatch and fixpatch
+care about:
+
+* a "mainline" repository, whose origin is the torvalds/linux URL, with
+  tens of thousands of commits and vX.Y-rcN / vX.Y tags at the kernel's
+  cadence (annotated, like the real ones);
+* merge commits whose result differs from both parents, so that
+  'git diff-tree --cc' gives combined diffs with '@@@' hunks;
+* now and then a treewide commit touching hundreds of files;
+* subsystem clones, sharing mainline's objects, with commits of their
+  own that are on their remote but not in mainline;
+* a few local-only commits on top of mainline, that exportpatch refuses
+  to export without '--force'.
+
+Everything is derived from the seed, so the same options always give
+the same repositories.
+"""
+
+import os
+import random
+import subprocess
+import sys
+
+from patchtools.config import MAINLINE_URLS
+from patchtools.modified_optparse import ModifiedOptionParser, OptionParsingError
+
+SUBSYSTEMS = [ 'scsi', 'net', 'block', 'usb', 'drm', 'sound', 'nfs', 'xfs' ]
+
+AUTHORS = [ ('Barney Rubbel', 'brubbel@example.com'),
+            ('Kai Mäkisara', 'kai@example.com'),
+            ('Betty Rubble', 'betty@example.org'),
+            ('Fred Flintstone', 'fred@example.net') ]
+
+SUBSYSTEM_URL = 'git://git.kernel.org/pub/scm/linux/kernel/git/bench/{name}.git'
+
+# The first commit is this many seconds after the epoch
+START_TIME = 1262304000
+
+# Release candidates per release
+RCS = 7
+
+# The last minor release before the major number goes up
+LAST_MINOR = 19
+
+# How often an edit adds lines as well as rewriting them
+ADD_LINES_ODDS = 0.2
+
+class Options:
+    """The shape of the repositories to build."""
+    def __init__(self, *, commits=20000, files=2000, cycle=1400,  # noqa: PLR0913
+                 merge_every=100, treewide_every=500, treewide_files=200,
+                 subsystems=2, subsystem_commits=50, local_commits=5, seed=0):
+        self.commits = commits
+        self.files = files
+        # commits per release, with rc1..rc7 spread across it
+        self.cycle = cycle
+        self.merge_every = merge_every
+        self.treewide_every = treewide_every
+        self.treewide_files = treewide_files
+        self.subsystems = subsystems
+        self.subsystem_commits = subsystem_commits
+        self.local_commits = local_commits
+        self.seed = seed
+
+class _Stream:
+    """Writes a 'git fast-import' stream for a single repository.
+
+    'files', {path: lines}, are the files at the tip of the branch being
+    built, and 'rng' decides what the commits change.
+    """
+    def __init__(self, repo, rng, files, first_mark=1, clock=START_TIME):
+        self.rng = rng
+        self.files = files
+        self.paths = sorted(files)
+        self.mark = first_mark - 1
+        self.clock = clock
+        self.proc = subprocess.Popen([ 'git', 'fast-import', '--quiet' ],  # noqa: S607
+                                     cwd=repo, stdin=subprocess.PIPE)
+        self.out = self.proc.stdin
+
+    def data(self, text):
+        data = text.encode()
+        self.out.write(f'data {len(data)}\n'.encode())
+        self.out.write(data)
+        self.out.write(b'\n')
+
+    def commit(self, ref, subject, changes, parents=(), body=None):
+        """Write a commit to 'ref' changing 'changes', {path: lines}, on
+        top of 'parents', or of 'ref' if there are none. Return its mark.
+        """
+        self.mark += 1
+        self.clock += 600
+        (name, email) = AUTHORS[self.mark % len(AUTHORS)]
+        ident = f'{name} <{email}> {self.clock} +0000'
+        if body is None:
+            body = f'Change the way things are done in {", ".join(sorted(changes)[:3])}.'
+        message = f'{subject}\n\n{body}\n\nSigned-off-by: {name} <{email}>\n'
+        self.out.write(f'commit {ref}\nmark :{self.mark}\nauthor {ident}\ncommitter {ident}\n'
+                       .encode())
+        self.data(message)
+        if parents:
+            self.out.write(f'from {parents[0]}\n'.encode())
+        for parent in parents[1:]:
+            self.out.write(f'merge {parent}\n'.encode())
+        for path in sorted(changes):
+            self.out.write(f'M 100644 inline {path}\n'.encode())
+            self.data('\n'.join(changes[path]) + '\n')
+        self.out.write(b'\n')
+        return self.mark
+
+    def tag(self, name, mark):
+        ident = f'{AUTHORS[0][0]} <{AUTHORS[0][1]}> {self.clock} +0000'
+        self.out.write(f'tag {name}\nfrom :{mark}\ntagger {ident}\n'.encode())
+        self.data(f'Linux {name[1:]}\n')
+
+    def reset(self, ref, mark):
+        self.out.write(f'reset {ref}\nfrom :{mark}\n\n'.encode())
+
+    def close(self):
+        self.out.close()
+        if self.proc.wait() != 0:
+            raise subprocess.CalledProcessError(self.proc.returncode, 'git fast-import')
+
+def _path(n):
+    subsystem = SUBSYSTEMS[n % len(SUBSYSTEMS)]
+    return f'drivers/{subsystem}/bench{n:04d}.c'
+
+def _initial_file(n):
+    lines = [ '// SPDX-License-Identifier: GPL-2.0', f'/* {_path(n)} */', '' ]
+    for f in range(8):
+        lines += [ f'static int bench_{n}_{f}(int ret)', '{',
+                   '\tret = setup(ret);', f'\tret = step_{f}(ret);',
+                   '\treturn ret;', '}', '' ]
+    return lines
+
+def _edit(rng, lines, tag):
+    """Return 'lines' with a line or two rewritten, and sometimes a few added."""
+    lines = list(lines)
+    for _ in range(rng.randint(1, 2)):
+        at = rng.randrange(3, len(lines))
+        lines[at] = f'\tret = {tag}_{at}(ret);'
+    if rng.random() < ADD_LINES_ODDS:
+        at = rng.randrange(3, len(lines))
+        lines[at:at] = [ f'\t/* {tag} */', f'\tret = extra_{tag}(ret);' ]
+    return lines
+
+def _versions():
+    """Yield the release names in order, from v5.0."""
+    (major, minor) = (5, 0)
+    while True:
+        yield (major, minor)
+        if minor == LAST_MINOR:
+            (major, minor) = (major + 1, 0)
+        else:
+            minor += 1
+
+def _fix_commit(stream, count):
+    """Write an ordinary commit to master, touching a few files. Return its mark."""
+    changes = {}
+    for path in stream.rng.sample(stream.paths, stream.rng.randint(1, 3)):
+        changes[path] = _edit(stream.rng, stream.files[path], f'c{count}')
+    stream.files.update(changes)
+    subsystem = min(changes).split('/')[1]
+    return stream.commit('refs/heads/master', f'{subsystem}: fix bug {count}', changes)
+
+def _treewide_commit(stream, count, size):
+    """Write a commit to master touching 'size' files. Return its mark."""
+    changes = {}
+    for path in stream.rng.sample(stream.paths, min(size, len(stream.paths))):
+        changes[path] = _edit(stream.rng, stream.files[path], f'treewide{count}')
+    stream.files.update(changes)
+    return stream.commit('refs/heads/master', f'treewide: convert to new API, part {count}',
+                         changes)
+
+def _topic_merge(stream, tip, side):
+    """Write topic branch 'side', off the commit 'tip' of master, a change
+    to master that conflicts with it, and the merge resolving the
+    conflict. That's four commits. Return the merge's mark.
+    """
+    (rng, files) = (stream.rng, stream.files)
+    ref = f'refs/heads/topic-{side}'
+    stream.reset(ref, tip)
+    conflicted = rng.choice(stream.paths)
+    side_changes = {}
+    side_tip = tip
+    for i in range(2):
+        path = conflicted if i == 0 else rng.choice(stream.paths)
+        lines = side_changes.get(path, files[path])
+        if i == 0:
+            lines = list(lines)
+            lines[4] = f'\tret = topic_{side}(ret);'
+        else:
+            lines = _edit(rng, lines, f'topic{side}')
+        side_changes[path] = lines
+        side_tip = stream.commit(ref, f'{path.split("/")[1]}: topic {side} part {i + 1}',
+                                 { path : lines })
+    mainline = list(files[conflicted])
+    mainline[4] = f'\tret = mainline_{side}(ret);'
+    files[conflicted] = mainline
+    tip = stream.commit('refs/heads/master',
+                        f'{conflicted.split("/")[1]}: mainline change {side}',
+                        { conflicted : mainline })
+    merged = dict(side_changes)
+    resolution = list(side_changes[conflicted])
+    resolution[4] = f'\tret = topic_{side}(mainline_{side}(ret));'
+    merged[conflicted] = resolution
+    files.update(merged)
+    return stream.commit('refs/heads/master', f"Merge branch 'topic-{side}'", merged,
+                         parents=(f':{tip}', f':{side_tip}'), body=f'Pull topic {side}.')
+
+def build_mainline(repo, options, rng, out):
+    """Build the mainline repository in 'repo'. Return (file contents at
+    the tip, clock at the tip, the last mark used).
+    """
+    files = { _path(n) : _initial_file(n) for n in range(options.files) }
+    stream = _Stream(repo, rng, files)
+    versions = _versions()
+    (major, minor) = next(versions)
+    (next_major, next_minor) = next(versions)
+    rc_every = max(options.cycle // 8, 1)
+    tags = 0
+
+    tip = stream.commit('refs/heads/master', f'Linux {major}.{minor}', files,
+                        body='The first release.')
+    stream.tag(f'v{major}.{minor}', tip)
+    tags += 1
+    count = 1
+    side = 0
+    treewide = 0
+    # When each is next due, rather than count % every: a merge is four
+    # commits, which can step over a multiple, and when both are due at
+    # once the merge just comes after the treewide commit
+    next_merge = options.merge_every
+    next_treewide = options.treewide_every
+    while count < options.commits:
+        if options.treewide_every and count >= next_treewide:
+            tip = _treewide_commit(stream, count, options.treewide_files)
+            count += 1
+            treewide += 1
+            next_treewide += options.treewide_every
+        elif options.merge_every and count >= next_merge and \
+           count + 4 <= options.commits:
+            # A topic branch, and a merge that has to resolve a conflict
+            side += 1
+            tip = _topic_merge(stream, tip, side)
+            count += 4
+            next_merge += options.merge_every
+        else:
+            tip = _fix_commit(stream, count)
+            count += 1
+
+        position = count % options.cycle
+        if position == 0:
+            (major, minor) = (next_major, next_minor)
+            (next_major, next_minor) = next(versions)
+            stream.tag(f'v{major}.{minor}', tip)
+            tags += 1
+        elif position % rc_every == 0 and position // rc_every <= RCS:
+            stream.tag(f'v{next_major}.{next_minor}-rc{position // rc_every}', tip)
+            tags += 1
+
+    stream.close()
+    print(f'mainline: {count} commits, {tags} tags, {side} merges, {treewide} treewide commits',
+          file=out)
+    return (files, stream.clock, stream.mark)
+
+def _git(repo, *args):
+    subprocess.run([ 'git', *args ], cwd=repo, check=True,  # noqa: S603, S607
+                   stdout=subprocess.DEVNULL)
+
+def _add_commits(stream, count, tag):
+    """Add 'count' commits on top of master with 'stream', and finish it."""
+    parent = 'refs/heads/master^0'
+    for i in range(count):
+        changes = {}
+        for path in stream.rng.sample(stream.paths, stream.rng.randint(1, 2)):
+            changes[path] = _edit(stream.rng, stream.files.get(path), f'{tag}{i}')
+        stream.commit('refs/heads/master', f'{tag}: {tag} change {i + 1}', changes,
+                      parents=(parent,) if parent else ())
+        parent = None
+    stream.close()
+
+def build(path, options=None, out=None):
+    """Build the repositories under 'path'. Return {name: repository path},
+    with 'mainline' and one entry per subsystem clone.
+    """
+    if options is None:
+        options = Options()
+    if out is None:
+        out = sys.stdout
+    # Not for anything secret, just to build the same repositories every time
+    rng = random.Random(options.seed)  # noqa: S311
+    repos = {}
+
+    mainline = os.path.join(path, 'linux')
+    os.makedirs(mainline)
+    _git(mainline, 'init', '-q')
+    _git(mainline, 'symbolic-ref', 'HEAD', 'refs/heads/master')
+    (files, clock, mark) = build_mainline(mainline, options, rng, out)
+    _git(mainline, 'remote', 'add', 'origin', MAINLINE_URLS[-2])
+    _git(mainline, 'update-ref', 'refs/remotes/origin/master', 'refs/heads/master')
+    repos['mainline'] = mainline
+
+    for name in SUBSYSTEMS[:options.subsystems]:
+        clone = os.path.join(path, name)
+        _git(path, 'clone', '-q', '--shared', '--no-checkout', mainline, clone)
+        _git(clone, 'remote', 'set-url', 'origin', SUBSYSTEM_URL.format(name=name))
+        stream = _Stream(clone, rng, dict(files), first_mark=mark + 1, clock=clock)
+        _add_commits(stream, options.subsystem_commits, name)
+        clock = stream.clock
+        _git(clone, 'update-ref', 'refs/remotes/origin/master', 'refs/heads/master')
+        print(f'{name}: {options.subsystem_commits} commits on top of mainline', file=out)
+        repos[name] = clone
+
+    if options.local_commits:
+        # On top of mainline, but not on its remote
+        stream = _Stream(mainline, rng, dict(files), first_mark=mark + 1, clock=clock)
+        _add_commits(stream, options.local_commits, 'local')
+        print(f'mainline: {options.local_commits} local-only commits', file=out)
+    return repos
+
+def main():
+    """Build the repositories. Return 0 for success."""
+    parser = ModifiedOptionParser(
+                usage='%prog [options] <DIRECTORY> -- build a synthetic kernel-like repository')
+    defaults = Options()
+    parser.add_option('-c', '--commits', type='int', action='store', default=defaults.commits,
+                      help='mainline commits [default is %default]')
+    parser.add_option('--files', type='int', action='store', default=defaults.files,
+                      help='files in the tree [default is %default]')
+    parser.add_option('--cycle', type='int', action='store', default=defaults.cycle,
+                      help=f'commits per release; there are {RCS} rcs per release [default is %default]')
+    parser.add_option('--merge-every', type='int', action='store', default=defaults.merge_every,
+                      help='commits between merges, 0 for none [default is %default]')
+    parser.add_option('--treewide-every', type='int', action='store', default=defaults.treewide_every,
+                      help='commits between treewide commits, 0 for none [default is %default]')
+    parser.add_option('--treewide-files', type='int', action='store', default=defaults.treewide_files,
+                      help='files a treewide commit touches [default is %default]')
+    parser.add_option('--subsystems', type='int', action='store', default=defaults.subsystems,
+                      help=f'subsystem clones, up to {len(SUBSYSTEMS)} [default is %default]')
+    parser.add_option('--subsystem-commits', type='int', action='store',
+                      default=defaults.subsystem_commits,
+                      help='commits in each subsystem clone [default is %default]')
+    parser.add_option('--local-commits', type='int', action='store', default=defaults.local_commits,
+                      help='local-only commits on top of mainline [default is %default]')
+    parser.add_option('--seed', type='int', action='store', default=defaults.seed,
+                      help='random seed [default is %default]')
+
+    try:
+        (options, args) = parser.parse_args()
+    except OptionParsingError as e:
+        print(f'Option parsing error: {e.msg}', file=sys.stderr)
+        return 1
+
+    if len(args) != 1:
+        print('Must supply a directory to build the repositories in', file=sys.stderr)
+        return 1
+    if os.path.exists(args[0]) and os.listdir(args[0]):
+        print(f'{args[0]} is not empty', file=sys.stderr)
+        return 1
+
+    shape = Options(commits=options.commits, files=options.files, cycle=options.cycle,
+                    merge_every=options.merge_every, treewide_every=options.treewide_every,
+                    treewide_files=options.treewide_files,
+                    subsystems=min(options.subsystems, len(SUBSYSTEMS)),
+                    subsystem_commits=options.subsystem_commits,
+                    local_commits=options.local_commits, seed=options.seed)
+    try:
+        build(args[0], shape)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
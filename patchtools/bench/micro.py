@@ -0,0 +1,221 @@
+# vim: sw=4 ts=4 et si:
+"""
+Time the Patch transformations that every exported or fixed patch goes
+through
+
+Runs Patch.from_email(), filter() with one path and with 50,
+handle_merge(), combined.to_unified(), add_signature(),
+strip_diffstat(), add_diffstat() and safe_filename() on synthetic
+input from 1 KB up to 100 MB (by default), and writes the results as
+JSON, so they can be kept and compared from one release to the next.
+Progress goes to stderr as it runs.
+
+Nothing here talks to git: the patches are parsed with no repositories
+to search, so only the transformations themselves are timed.
+"""
+
+import email.parser
+import json
+import platform
+import sys
+import time
+from pathlib import Path
+
+from patchtools import cache, combined, patchops
+from patchtools.bench import synthetic
+from patchtools.modified_optparse import ModifiedOptionParser, OptionParsingError
+from patchtools.patch import Patch
+
+# Bump when the meaning of the results changes
+RESULTS_VERSION = 2
+
+SIZES = [ 1 << 10, 10 << 10, 100 << 10, 1 << 20, 10 << 20, 100 << 20 ]
+
+def _patch(text=None):
+    """Return a Patch that won't look for the commit in any repository,
+    parsed from 'text' if it's given.
+    """
+    p = Patch()
+    p.repo_list = []
+    p.mainline_repo_list = []
+    if text is not None:
+        p.from_email(text)
+    return p
+
+def _from_email(text):
+    p = _patch()
+    start = time.perf_counter()
+    p.from_email(text)
+    return time.perf_counter() - start
+
+def _filter(text):
+    p = _patch(text)
+    start = time.perf_counter()
+    p.filter(['drivers/bench/file000000.c'], exclude=True)
+    return time.perf_counter() - start
+
+# 50 paths, as a long -x list might have: directories, files and patterns
+PATHS = ([ f'drivers/bench{n}/' for n in range(20) ] +
+         [ f'drivers/bench/file{n * 7:06d}.c' for n in range(20) ] +
+         [ '*.h', 'drivers/*/Kconfig', '**/bench/file0000[0-9]?.c', 'fs/', 'include/',
+           'arch/*/', 'Documentation/', '*.rst', 'net/**/core/', 'sound/' ])
+
+def _filter_paths(text):
+    p = _patch(text)
+    start = time.perf_counter()
+    p.filter(PATHS)
+    return time.perf_counter() - start
+
+def _handle_merge(text):
+    # from_email() would already have handled the merge
+    p = _patch()
+    p.message = email.parser.Parser().parsestr(text)
+    start = time.perf_counter()
+    p.handle_merge()
+    return time.perf_counter() - start
+
+def _to_unified(text):
+    start = time.perf_counter()
+    combined.to_unified(text)
+    return time.perf_counter() - start
+
+def _add_signature(text):
+    p = _patch(text)
+    start = time.perf_counter()
+    p.add_signature()
+    return time.perf_counter() - start
+
+def _strip_diffstat(text):
+    p = _patch(text)
+    start = time.perf_counter()
+    p.strip_diffstat()
+    return time.perf_counter() - start
+
+def _add_diffstat(text):
+    p = _patch(text)
+    start = time.perf_counter()
+    p.add_diffstat()
+    return time.perf_counter() - start
+
+def _safe_filename(subjects):
+    start = time.perf_counter()
+    for subject in subjects:
+        patchops.safe_filename(subject)
+    return time.perf_counter() - start
+
+# input name -> builds that input at a given size
+INPUTS = {
+    'patch' : synthetic.patch_text,
+    'merge' : lambda size: synthetic.patch_text(size, combined=True),
+    'bare' : lambda size: synthetic.patch_text(size, diffstat=False),
+    'hunk' : synthetic.combined_hunk_text,
+    'subjects' : synthetic.subjects,
+}
+
+# name -> (timer, input)
+OPERATIONS = {
+    'from_email' : (_from_email, 'patch'),
+    'from_email_merge' : (_from_email, 'merge'),
+    'filter' : (_filter, 'patch'),
+    'filter_paths' : (_filter_paths, 'patch'),
+    'handle_merge' : (_handle_merge, 'merge'),
+    'to_unified' : (_to_unified, 'hunk'),
+    'add_signature' : (_add_signature, 'patch'),
+    'strip_diffstat' : (_strip_diffstat, 'patch'),
+    'add_diffstat' : (_add_diffstat, 'bare'),
+    'safe_filename' : (_safe_filename, 'subjects'),
+}
+
+def input_size(data):
+    if isinstance(data, str):
+        return len(data)
+    return sum(len(s) for s in data)
+
+def run(sizes, operations, repeat=1, out=None):
+    """Time each operation at each size. Return {name: [(size, seconds)]}."""
+    if out is None:
+        out = sys.stdout
+    results = { name : [] for name in operations }
+    for size in sizes:
+        inputs = {}
+        for name in operations:
+            timer, kind = OPERATIONS[name]
+            if kind not in inputs:
+                inputs[kind] = INPUTS[kind](size)
+            data = inputs[kind]
+            length = input_size(data)
+            best = min(timer(data) for i in range(repeat))
+            results[name].append((length, best))
+            print(f'{name:<16s} {length:12d} bytes {best:10.4f} s {best * 1e9 / length:8.2f} ns/byte',
+                  file=out)
+        del inputs
+    return results
+
+def report(results, repeat):
+    """Return 'results' from run() as a JSON-friendly dict."""
+    samples = []
+    for (name, timings) in results.items():
+        for (size, seconds) in timings:
+            samples.append({ 'operation' : name, 'size' : size,
+                             'seconds' : seconds,
+                             'ns_per_byte' : seconds * 1e9 / size })
+    return {
+        'version' : RESULTS_VERSION,
+        'timestamp' : int(time.time()),
+        'python' : platform.python_version(),
+        'platform' : platform.platform(),
+        'repeat' : repeat,
+        'results' : samples,
+    }
+
+def main():
+    """Run the benchmarks and write the results. Return 0 for success."""
+    parser = ModifiedOptionParser(
+                usage='%prog [options] -- time the Patch transformations and write the results as JSON')
+    parser.add_option('--max-size', action='store', default='100M',
+                      help='largest input to build, e.g. 20M [default is %default]')
+    parser.add_option('-o', '--operation', action='append', default=None,
+                      help=f'only time this operation ({", ".join(OPERATIONS)}). '
+                           'This option can be specified multiple times.')
+    parser.add_option('-r', '--repeat', type='int', action='store', default=3,
+                      help='take the best of this many runs [default is %default]')
+    parser.add_option('--output', action='store', default=None,
+                      help='write the results to this file instead of stdout')
+
+    try:
+        (options, _args) = parser.parse_args()
+    except OptionParsingError as e:
+        print(f'Option parsing error: {e.msg}', file=sys.stderr)
+        return 1
+
+    operations = options.operation or list(OPERATIONS)
+    for name in operations:
+        if name not in OPERATIONS:
+            print(f'Unknown operation "{name}"', file=sys.stderr)
+            return 1
+
+    try:
+        max_size = cache.parse_size(options.max_size)
+    except ValueError:
+        print(f'Invalid size "{options.max_size}"', file=sys.stderr)
+        return 1
+    sizes = [ s for s in SIZES if s < max_size ] + [ max_size ]
+
+    repeat = max(options.repeat, 1)
+    results = report(run(sizes, operations, repeat, sys.stderr), repeat)
+
+    if options.output:
+        try:
+            with Path(options.output).open('w') as f:
+                json.dump(results, f, indent=1)
+                f.write('\n')
+        except OSError as e:
+            print(e, file=sys.stderr)
+            return 1
+    else:
+        json.dump(results, sys.stdout, indent=1)
+        print()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+# vim: sw=4 ts=4 et si:
+"""
+Check that payload transformations scale linearly with patch size
+
+Times Patch.filter(), Patch.handle_merge() and Patch.strip_diffstat()
+on synthetic patches from 1 KB up to 200 MB (by default) and prints the
+time per byte for each size. With linear-time code the time per byte
+stays flat; quadratic string building shows up as a time per byte that
+grows with the size.
+
+The largest patches need several GB of memory; use --max-size to stay
+below that.
+"""
+
+import sys
+
+from patchtools import cache
+from patchtools.bench import micro
+from patchtools.modified_optparse import ModifiedOptionParser, OptionParsingError
+
+SIZES = [ 1 << 10, 10 << 10, 100 << 10, 1 << 20, 10 << 20, 50 << 20, 200 << 20 ]
+
+# The time per byte at the largest size may be this many times that at
+# the smallest size that takes long enough to measure before we call it
+# nonlinear.
+MAX_GROWTH = 3.0
+
+# Sizes this small are dominated by fixed costs
+MIN_TIME = 0.001
+
+# The operations from the micro-benchmarks that have to scale
+OPERATIONS = [ 'filter', 'handle_merge', 'strip_diffstat' ]
+
+def run(sizes, operations, repeat=1, out=None):
+    """Time each operation at each size. Return {name: [(size, seconds)]}."""
+    return micro.run(sizes, operations, repeat, out)
+
+def growth(samples):
+    """How much the time per byte grew from the smallest measurable size
+    to the largest one.
+    """
+    samples = [ (size, t) for size, t in samples if t >= MIN_TIME ]
+    if len(samples) <= 1:
+        # Nothing to compare
+        return 1.0
+    (small, t_small) = samples[0]
+    (large, t_large) = samples[-1]
+    return (t_large / large) / (t_small / small)
+
+def main():
+    """Run the scaling benchmark. Return 0 if everything scales linearly."""
+    parser = ModifiedOptionParser(
+                usage='%prog [options] -- check that payload transformations scale linearly')
+    operations = ', '.join(OPERATIONS)
+    parser.add_option('--max-size', action='store', default='200M',
+                      help='largest patch to build, e.g. 20M [default is %default]')
+    parser.add_option('-o', '--operation', action='append', default=None,
+                      help=f'only time this operation ({operations}). This option can be specified multiple times.')
+    parser.add_option('-r', '--repeat', type='int', action='store', default=1,
+                      help='take the best of this many runs [default is %default]')
+
+    try:
+        (options, _args) = parser.parse_args()
+    except OptionParsingError as e:
+        print(f'Option parsing error: {e.msg}', file=sys.stderr)
+        return 1
+
+    operations = options.operation or list(OPERATIONS)
+    for name in operations:
+        if name not in OPERATIONS:
+            print(f'Unknown operation "{name}"', file=sys.stderr)
+            return 1
+
+    max_size = cache.parse_size(options.max_size)
+    sizes = [ s for s in SIZES if s < max_size ] + [ max_size ]
+
+    results = run(sizes, operations, max(options.repeat, 1))
+
+    ret = 0
+    for name in operations:
+        g = growth(results[name])
+        verdict = 'linear' if g <= MAX_GROWTH else 'NONLINEAR'
+        print(f'{name:<15} time per byte grew {g:.2f}x: {verdict}')
+        if g > MAX_GROWTH:
+            ret = 1
+    return ret
+
+if __name__ == '__main__':
+    sys.exit(main())
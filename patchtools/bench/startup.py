@@ -0,0 +1,171 @@
+# vim: sw=4 ts=4 et si:
+"""
+Check that exportpatch and fixpatch start up as quickly as they used to
+
+Runs a few typical commands under 'python -X importtime' and adds up the
+time spent importing modules, leaving out what Python imports for any
+script. Each command is run once to fill the caches a second run would
+find, then timed --repeat times, keeping the fastest run.
+
+With --save, the results become the baseline. Otherwise they're checked
+against the baseline: a command whose import time grew by more than
+MAX_GROWTH fails the check, and the modules it now imports that it
+didn't before are listed, which is usually where the time went.
+
+The commands run in a scratch directory, with their own cache directory
+and no configuration other than the system's, so they only ever talk to
+git to find out there's no repository.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from patchtools import cache
+from patchtools.bench import synthetic
+from patchtools.modified_optparse import ModifiedOptionParser, OptionParsingError
+
+# The import time may grow this much, plus MIN_REGRESSION, before we fail
+MAX_GROWTH = 1.25
+
+# Microseconds of growth too small to tell from noise
+MIN_REGRESSION = 2000
+
+PATCH_NAME = 'bench.patch'
+
+# name -> command line, run from the scratch directory
+COMMANDS = {
+    'exportpatch' : [ 'exportpatch', '0123456789abcdef' ],
+    'fixpatch' : [ 'fixpatch', '--name-only', PATCH_NAME ],
+}
+
+def default_baseline():
+    return cache.cache_dir('bench', 'startup.json')
+
+def _python(code, args, cwd, env):
+    """Run 'code' under -X importtime. Return [(depth, name, cumulative us)]."""
+    proc = subprocess.run([ sys.executable, '-X', 'importtime', '-c', code, *args ],  # noqa: S603
+                          cwd=cwd, env=env, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE, check=False)
+    imports = []
+    for line in proc.stderr.decode(errors='replace').splitlines():
+        if not line.startswith('import time:'):
+            continue
+        try:
+            (_self_us, cumulative, name) = line[len('import time:'):].split('|')
+        except ValueError:
+            continue
+        if not cumulative.strip().isdigit():
+            # the header line
+            continue
+        name = name[1:]
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((depth, name.strip(), int(cumulative)))
+    return imports
+
+def environment(scratch):
+    """Return the environment to run commands in, isolated in 'scratch'."""
+    env = dict(os.environ)
+    env.pop('PATCHTOOLS_DAEMON', None)
+    env['HOME'] = scratch
+    env['XDG_CACHE_HOME'] = os.path.join(scratch, 'cache')
+    env['XDG_CONFIG_HOME'] = os.path.join(scratch, 'config')
+    package = os.path.dirname(os.path.dirname(cache.__file__))
+    env['PYTHONPATH'] = os.pathsep.join([ package ] + [ p for p in
+                                         [ env.get('PYTHONPATH') ] if p ])
+    return env
+
+def measure(names, repeat=3):
+    """Return {name: {'import_us': fastest total, 'modules': [...]}}."""
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='patchtools-bench-') as scratch:
+        Path(scratch, PATCH_NAME).write_text(synthetic.patch_text(4 << 10))
+        env = environment(scratch)
+
+        startup = { name for (_depth, name, _us) in _python('pass', [], scratch, env) }
+        for name in names:
+            argv = COMMANDS[name]
+            code = (f'import sys; sys.argv[0] = {argv[0]!r}; from patchtools.client import run; '
+                    f'sys.exit(run({argv[0]!r}))')
+            _python(code, argv[1:], scratch, env)
+            best = None
+            for _ in range(repeat):
+                imports = [ imp for imp in _python(code, argv[1:], scratch, env)
+                            if imp[1] not in startup ]
+                total = sum(us for (depth, _module, us) in imports if depth == 0)
+                if best is None or total < best[0]:
+                    best = (total, sorted({ module for (_depth, module, _us) in imports }))
+            results[name] = { 'import_us' : best[0], 'modules' : best[1] }
+    return results
+
+def compare(results, baseline, out=None):
+    """Print how 'results' compare with 'baseline'. Return 0 if none of
+    the commands got slower, else 1.
+    """
+    if out is None:
+        out = sys.stdout
+    ret = 0
+    for (name, result) in results.items():
+        now = result['import_us']
+        base = baseline.get(name)
+        if base is None:
+            print(f'{name:<12s} {now / 1000:8.1f} ms (no baseline)', file=out)
+            continue
+        then = base['import_us']
+        slower = now > then * MAX_GROWTH + MIN_REGRESSION
+        verdict = 'SLOWER' if slower else 'ok'
+        print(f'{name:<12s} {now / 1000:8.1f} ms, baseline {then / 1000:8.1f} ms: {verdict}',
+              file=out)
+        if slower:
+            ret = 1
+            added = sorted(set(result['modules']) - set(base['modules']))
+            if added:
+                print(f'    now imports: {" ".join(added)}', file=out)
+    return ret
+
+def main():
+    """Run the startup benchmark. Return 0 unless startup got slower."""
+    parser = ModifiedOptionParser(
+                usage='%prog [options] -- check that exportpatch and fixpatch still start quickly')
+    parser.add_option('-b', '--baseline', action='store', default=None,
+                      help=f'the baseline file [default is {default_baseline()}]')
+    parser.add_option('--save', action='store_true', default=False,
+                      help='save the results as the new baseline instead of checking them')
+    parser.add_option('-c', '--command', action='append', default=None,
+                      help=f'only check this command ({", ".join(COMMANDS)}). '
+                           'This option can be specified multiple times.')
+    parser.add_option('-r', '--repeat', type='int', action='store', default=5,
+                      help='take the best of this many runs [default is %default]')
+
+    try:
+        (options, _args) = parser.parse_args()
+    except OptionParsingError as e:
+        print(f'Option parsing error: {e.msg}', file=sys.stderr)
+        return 1
+
+    names = options.command or list(COMMANDS)
+    for name in names:
+        if name not in COMMANDS:
+            print(f'Unknown command "{name}"', file=sys.stderr)
+            return 1
+
+    path = options.baseline or default_baseline()
+    results = measure(names, max(options.repeat, 1))
+
+    if options.save:
+        baseline = cache.load_json(path) or {}
+        baseline.update(results)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with Path(path).open('w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        for (name, result) in results.items():
+            print(f'{name:<12s} {result["import_us"] / 1000:8.1f} ms, saved')
+        return 0
+
+    return compare(results, cache.load_json(path) or {})
+
+if __name__ == '__main__':
+    sys.exit(main())
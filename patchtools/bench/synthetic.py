@@ -0,0 +1,93 @@
+# vim: sw=4 ts=4 et si:
+"""
+Build synthetic patches of a given size
+
+The patches look like what 'git diff-tree --pretty=email --stat -p'
+gives us for a treewide change: a commit message, a diffstat and many
+small file diffs. The combined variant looks like the '--cc' output for
+a merge commit, which is what Patch.handle_merge() has to deal with.
+"""
+
+HEADER = """From: Barney Rubbel <brubbel@example.com>
+Subject: treewide: convert to the new API
+Git-commit: 0123456789abcdef0123456789abcdef01234567
+
+Convert every user of the old API to the new one.
+
+Signed-off-by: Barney Rubbel <brubbel@example.com>
+---
+"""
+
+def _file_diff(n, combined=False):
+    name = f'drivers/bench/file{n:06d}.c'
+    lines = [ f'diff --git a/{name} b/{name}',
+              'index 1111111..2222222 100644',
+              f'--- a/{name}',
+              f'+++ b/{name}' ]
+    if combined:
+        lines[0] = f'diff --cc {name}'
+        lines[1] = 'index 1111111,3333333..2222222'
+        lines.append(f'@@@ -10,8 -10,6 +10,7 @@@ static int bench_{n}(void)')
+        prefix = ('  ', '- ', ' +', '  ')
+    else:
+        lines.append(f'@@ -10,7 +10,7 @@ static int bench_{n}(void)')
+        prefix = (' ', '-', '+', ' ')
+    lines += [ prefix[0] + '\tint ret;',
+               prefix[0] + '',
+               prefix[0] + '\tret = setup();',
+               prefix[1] + f'\tret = old_api_call(ret, {n});',
+               prefix[2] + f'\tret = new_api_call(ret, {n});',
+               prefix[3] + '\tif (ret)',
+               prefix[3] + '\t\treturn ret;',
+               prefix[3] + '\treturn 0;' ]
+    return '\n'.join(lines) + '\n'
+
+def patch_text(size, combined=False, diffstat=True):
+    """Return the text of a patch of about 'size' bytes."""
+    chunks = [ HEADER ]
+    stat = []
+    total = len(HEADER)
+    n = 0
+    while total < size:
+        diff = _file_diff(n, combined)
+        chunks.append(diff)
+        if diffstat:
+            line = f' drivers/bench/file{n:06d}.c | 2 +-\n'
+            stat.append(line)
+            total += len(line)
+        total += len(diff)
+        n += 1
+    if diffstat:
+        plural = '' if n == 1 else 's'
+        stat.append(f' {n} file{plural} changed, {n} insertion{plural}(+), {n} deletion{plural}(-)\n\n')
+        chunks[1:1] = stat
+    return ''.join(chunks)
+
+def combined_hunk_text(size):
+    """Return the body of a '--cc' diff of about 'size' bytes with all
+    of it in one combined hunk, as a large subsystem merge can give.
+    """
+    group = [ '  \tret = setup();', '  ', '- \tret = old_api_call(ret);',
+              ' -\tret = their_api_call(ret);', '++\tret = new_api_call(ret);',
+              '  ', '  \tif (ret)', '  \t\treturn ret;', '  ', '  ' ]
+    text = '\n'.join(group) + '\n'
+    n = max(1, size // len(text))
+    # Each group has 8 lines of either parent and of the result
+    header = ('diff --cc drivers/bench/merged.c\n'
+              'index 1111111,3333333..2222222\n'
+              '--- a/drivers/bench/merged.c\n'
+              '+++ b/drivers/bench/merged.c\n'
+              f'@@@ -1,{8 * n} -1,{8 * n} +1,{8 * n} @@@\n')
+    return header + text * n
+
+def subjects(size):
+    """Return subject lines adding up to about 'size' bytes."""
+    lines = []
+    total = 0
+    n = 0
+    while total < size:
+        line = f'[PATCH {n + 1:d}/{n + 1:d}] drivers/bench: Re: fix  a  bug (in file{n:06d}.c)'
+        lines.append(line)
+        total += len(line)
+        n += 1
+    return lines
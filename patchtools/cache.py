@@ -0,0 +1,69 @@
+# vim: sw=4 ts=4 et si:
+"""
+On-disk cache helpers
+"""
+
+import hashlib
+import json
+import os
+from contextlib import suppress
+from pathlib import Path
+
+
+def cache_dir(*parts):
+    """Return the path of our cache directory, or a subdirectory of it."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'patchtools', *parts)
+
+
+def key_name(*parts):
+    """Return a file-name-safe digest of 'parts'."""
+    # Only a cache key: the hash needn't be a secure one
+    return hashlib.sha1('\0'.join(str(p) for p in parts).encode()).hexdigest()  # noqa: S324
+
+
+def parse_size(text):
+    """Parse a size like "512M" or "2G" into bytes. Raises ValueError."""
+    units = { 'K' : 1 << 10, 'M' : 1 << 20, 'G' : 1 << 30 }
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def file_stamp(path):
+    """Return a JSON-friendly stamp that changes when 'path' does."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def load_json(path):
+    try:
+        with Path(path).open() as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def store_json(path, data):
+    """Atomically write 'data' to 'path'. The cache is only an optimization,
+    so failing to write it isn't an error.
+    """
+    # Only needed when something has changed, so not worth importing
+    # for every command
+    import tempfile  # noqa: PLC0415
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmpname, path)
+    except OSError:
+        with suppress(OSError):
+            os.unlink(tmpname)
@@ -0,0 +1,170 @@
+# vim: sw=4 ts=4 et si:
+"""
+Front ends for exportpatch and fixpatch that can hand the work to
+patchtools-daemon
+
+If PATCHTOOLS_DAEMON is set, the command line, the working directory and
+our stdin, stdout and stderr are passed to the daemon over its Unix
+socket, and the daemon runs the command as if it were us: its output
+goes straight to our stdout and stderr, and we exit with its exit
+status. If the daemon isn't running, or is running different code, we
+run the command ourselves, so setting PATCHTOOLS_DAEMON never changes
+what a command does, only how long it takes to start.
+
+This is imported by every command, so what's only needed to talk to
+the daemon is imported when PATCHTOOLS_DAEMON is set.
+"""
+
+import os
+import sys
+
+# Bump when the requests or replies change
+PROTOCOL_VERSION = 1
+
+# The largest request line we accept
+MAX_REQUEST = 64 << 20
+
+# stdin, stdout and stderr
+STD_FDS = [ 0, 1, 2 ]
+
+
+def socket_path(setting=None):
+    """Return the daemon's socket path.
+
+    'setting' is the value of PATCHTOOLS_DAEMON: a path, or anything
+    else without a "/" for the default path in $XDG_RUNTIME_DIR (or our
+    cache directory, if that isn't set).
+    """
+    if setting and '/' in setting:
+        return setting
+    base = os.environ.get('XDG_RUNTIME_DIR')
+    if base:
+        return os.path.join(base, 'patchtools', 'daemon.sock')
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'patchtools', 'daemon.sock')
+
+
+def code_stamp():
+    """Return a stamp of the patchtools code we're running, so a daemon
+    started before an upgrade isn't used to run the new code.
+    """
+    package = os.path.dirname(os.path.abspath(__file__))
+    stamps = [ str(PROTOCOL_VERSION), package ]
+    for name in sorted(os.listdir(package)):
+        if name.endswith('.py'):
+            st = os.stat(os.path.join(package, name))
+            stamps.append(f'{name}:{st.st_mtime_ns:d}:{st.st_size:d}')
+    return ' '.join(stamps)
+
+
+def stream_modes():
+    """Return how our stdin, stdout and stderr are set up, so that the
+    daemon can set up its copies of them the same way.
+    """
+    modes = []
+    for f in (sys.stdin, sys.stdout, sys.stderr):
+        mode = {}
+        if f is not None:
+            mode = { 'encoding' : f.encoding, 'errors' : f.errors,
+                     'line_buffering' : f.line_buffering,
+                     'write_through' : f.write_through }
+        modes.append(mode)
+    return modes
+
+
+def send_message(sock, message, fds=()):
+    """Send 'message', a JSON-friendly object, as one line, passing 'fds'
+    along with it.
+    """
+    import array  # noqa: PLC0415
+    import json  # noqa: PLC0415
+    import socket  # noqa: PLC0415
+    data = json.dumps(message).encode() + b'\n'
+    ancillary = []
+    if fds:
+        ancillary = [ (socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds)) ]
+    sent = sock.sendmsg([ data ], ancillary)
+    if sent < len(data):
+        sock.sendall(data[sent:])
+
+
+def receive_message(sock, max_fds=0):
+    """Return (message, fds) for the next line from 'sock', or (None, fds)
+    if the other end goes away first.
+    """
+    import array  # noqa: PLC0415
+    import json  # noqa: PLC0415
+    import socket  # noqa: PLC0415
+    fds = array.array('i')
+    (data, ancdata, _flags, _addr) = sock.recvmsg(
+                                    1 << 16, socket.CMSG_SPACE(max_fds * fds.itemsize))
+    for (level, kind, cdata) in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cdata[:len(cdata) - len(cdata) % fds.itemsize])
+    chunks = [ data ]
+    size = len(data)
+    while data and not data.endswith(b'\n') and size < MAX_REQUEST:
+        data = sock.recv(1 << 16)
+        chunks.append(data)
+        size += len(data)
+    data = b''.join(chunks)
+    if not data.endswith(b'\n'):
+        return (None, list(fds))
+    return (json.loads(data.decode()), list(fds))
+
+
+def forward(tool, argv, path):
+    """Have the daemon listening on 'path' run 'tool' with 'argv'.
+
+    Return its exit status, or None if it didn't run the command.
+    """
+    import socket  # noqa: PLC0415
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    except OSError:
+        return None
+    with sock:
+        try:
+            sock.connect(path)
+            request = { 'tool' : tool, 'argv' : argv, 'cwd' : os.getcwd(),
+                        'streams' : stream_modes(), 'code' : code_stamp() }
+            send_message(sock, request, STD_FDS)
+        except (OSError, ValueError):
+            return None
+
+        # From here on the daemon may have written some of the output,
+        # so it's too late to run the command ourselves
+        try:
+            (reply, _fds) = receive_message(sock)
+        except (OSError, ValueError):
+            reply = None
+        if reply is None:
+            print(f'patchtools-daemon went away while running {tool}',
+                  file=sys.stderr)
+            return 1
+        # No status means the daemon left the command to us
+        return reply.get('status')
+
+
+def run(tool):
+    """Run 'tool', in the daemon if we're asked to and it's there."""
+    setting = os.environ.get('PATCHTOOLS_DAEMON')
+    if setting:
+        status = forward(tool, sys.argv, socket_path(setting))
+        if status is not None:
+            return status
+
+    # Only the tool being run
+    if tool == 'exportpatch':
+        from patchtools.exportpatch import main  # noqa: PLC0415
+    else:
+        from patchtools.fixpatch import main  # noqa: PLC0415
+    return main()
+
+
+def exportpatch():
+    return run('exportpatch')
+
+
+def fixpatch():
+    return run('fixpatch')
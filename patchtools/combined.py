@@ -0,0 +1,146 @@
+# vim: sw=4 ts=4 et si:
+"""
+Turn the combined diff of a merge into a unified diff against its
+first parent
+
+'git diff-tree --cc' shows a merge as combined hunks: an '@@@' header
+with a range for every parent and for the result, and lines with one
+column per parent. We keep the change the merge made to the first
+parent, which is what applying the patch to the mainline side needs:
+for every line, the first column says whether it was added or removed
+relative to the first parent. Lines that are only in the other parents
+are dropped, and what's left is cut into ordinary '@@' hunks with
+CONTEXT lines of context.
+
+The line numbers come from the combined header. Those of the result
+are exact. Those of the first parent are git's own, which can be off by
+the lines git found the merge lost but didn't show.
+
+Everything outside the combined hunks is copied as it is, and only one
+combined hunk is held at a time.
+"""
+
+import re
+
+# Lines of context around each change, as git gives by default
+CONTEXT = 3
+
+_combined_re = re.compile(r'(@@@+) ((?:-\d+(?:,\d+)? )+)\+(\d+)(?:,(\d+))? \1.*\n?')
+_range_re = re.compile(r'-(\d+)(?:,(\d+))?')
+# Regular expressions for the combined hunks of a merge, by the number
+# of parents
+_patterns = {}
+
+
+def _patterns_for(parents):
+    """Return regular expressions matching a combined hunk's lines and
+    the lines that are in neither the result nor the first parent.
+    """
+    patterns = _patterns.get(parents)
+    if patterns is None:
+        patterns = _patterns[parents] = (
+            re.compile(rf'(?:[ +-]{{{parents}}}.*(?:\n|\Z)|\\.*(?:\n|\Z))*'),
+            # A '-' in another column: the line was lost, but the first
+            # parent didn't have it. "\ No newline" goes with the line.
+            re.compile(rf'^[ +](?=[ +]{{0,{parents - 2}}}-)[ +-]{{{parents - 1}}}.*\n(?:\\.*\n)?',
+                       re.MULTILINE))
+    return patterns
+
+
+def _start(start, count):
+    """Return the line number before the first line of a hunk range."""
+    # An empty range names the line before it
+    return int(start) - 1 if count != '0' else int(start)
+
+
+def _range(start, count):
+    if count == 1:
+        return f'{start}'
+    return f'{start},{count}'
+
+
+def _first_parent(hunk, parents):
+    """Return the lines of a combined hunk, each ending in "\\n", as
+    unified diff lines against the first parent.
+    """
+    lines = _patterns_for(parents)[1].sub('', hunk).split('\n')
+    del lines[-1]
+    if hunk[:1] == '\\' or '\n\\' in hunk:
+        # "\ No newline at end of file" goes with the line before
+        attached = []
+        for line in lines:
+            if line[:1] == '\\':
+                if attached:
+                    attached[-1] += '\n' + line
+            else:
+                attached.append(line)
+        lines = attached
+    return [ line[:1] + line[parents:] for line in lines ]
+
+
+def _unified_hunks(diff, old, new, out):
+    """Cut 'diff' into unified hunks and append them to 'out'. 'old' and
+    'new' are the line numbers before its first line.
+    """
+    changes = [ i for (i, line) in enumerate(diff) if line[0] != ' ' ]
+    position = 0
+    n = 0
+    while n < len(changes):
+        first = last = changes[n]
+        added = removed = 0
+        while True:
+            if diff[last][0] == '+':
+                added += 1
+            else:
+                removed += 1
+            n += 1
+            # A change with CONTEXT * 2 or fewer lines between it and
+            # the last one shares its hunk
+            if n == len(changes) or changes[n] - last > 2 * CONTEXT + 1:
+                break
+            last = changes[n]
+        start = max(first - CONTEXT, position)
+        end = min(last + CONTEXT + 1, len(diff))
+        # Only context lies between the hunks
+        old += start - position
+        new += start - position
+        old_count = end - start - added
+        new_count = end - start - removed
+        old_range = _range(old + 1 if old_count else old, old_count)
+        new_range = _range(new + 1 if new_count else new, new_count)
+        out.append(f'@@ -{old_range} +{new_range} @@\n')
+        out.append('\n'.join(diff[start:end]))
+        out.append('\n')
+        old += old_count
+        new += new_count
+        position = end
+
+
+def to_unified(body):
+    """Return the diff 'body' with every combined hunk in it turned into
+    unified hunks against the first parent. Everything else, including
+    the 'diff --cc' and 'index' lines, is kept as it is.
+    """
+    out = []
+    position = 0
+    at = body.find('@@@')
+    while at >= 0:
+        m = None
+        if at == 0 or body[at - 1] == '\n':
+            m = _combined_re.match(body, at)
+        ranges = _range_re.findall(m.group(2)) if m else []
+        if not m or len(ranges) != len(m.group(1)) - 1:
+            at = body.find('@@@', at + 1)
+            continue
+        parents = len(ranges)
+        out.append(body[position:at])
+        end = _patterns_for(parents)[0].match(body, m.end()).end()
+        hunk = body[m.end():end]
+        if hunk[-1:] != '\n':
+            hunk += '\n'
+        _unified_hunks(_first_parent(hunk, parents),
+                       _start(*ranges[0]), _start(m.group(3), m.group(4)), out)
+        position = end
+        at = body.find('@@@', end)
+    out.append(body[position:])
+    return ''.join(out)
@@ -6,3 +6,7 @@ def run_command(command, input=None, stdout=subprocess.PIPE):
                           input=input, stdout=stdout,
                           stderr=open("/dev/null", "w"))
     return proc.stdout
+
+def decode_output(data):
+    """Decode raw process output the same way run_command's text mode does."""
+    return data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
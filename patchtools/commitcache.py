@@ -0,0 +1,82 @@
+# vim: sw=4 ts=4 et si:
+"""
+What we've already found out about commits, for the rest of the run
+
+A commit name (a hash or a prefix of one) is resolved in a repository
+once, and the answer is shared by every lookup of that name, or of the
+full hash it resolved to. The patch text of the most recently used
+commits is kept too, so generating a patch and looking the commit up
+again while handling it costs a single 'git diff-tree'.
+"""
+
+import collections
+import threading
+
+from patchtools import backend
+
+# How many commits' patch text to keep
+MAX_EMAILS = 32
+
+_commits = {}
+_emails = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+class CommitInfo:
+    """A commit name as resolved in one repository. 'sha' is None if the
+    repository doesn't have the commit.
+    """
+    __slots__ = ('local', 'repo', 'sha')
+
+    def __init__(self, repo, sha):
+        self.repo = repo
+        self.sha = sha
+        # Whether the commit is only in the local branch, once we've checked
+        self.local = None
+
+    def email(self, paths=None):
+        """Return the 'git diff-tree' output for the commit. With 'paths',
+        only the files at or under those paths are in it.
+        """
+        key = (self.repo, self.sha)
+        if paths:
+            key += (tuple(paths),)
+        with _lock:
+            text = _emails.get(key)
+            if text is not None:
+                _emails.move_to_end(key)
+                return text
+
+        text = backend.get_backend(self.repo).commit_email(self.sha, paths)
+
+        with _lock:
+            _emails[key] = text
+            while len(_emails) > MAX_EMAILS:
+                _emails.popitem(last=False)
+        return text
+
+
+def forget():
+    """Forget how commit names resolved. The patch text of a full hash
+    never changes, so that is kept.
+    """
+    with _lock:
+        _commits.clear()
+
+
+def lookup(commit, repo):
+    """Return the CommitInfo for the commit name 'commit' in 'repo'."""
+    key = (repo, commit)
+    with _lock:
+        info = _commits.get(key)
+    if info is not None:
+        return info
+
+    sha = backend.get_backend(repo).resolve(commit)
+
+    with _lock:
+        info = _commits.setdefault(key, CommitInfo(repo, sha))
+        if sha is not None:
+            info = _commits.setdefault((repo, sha), info)
+            _commits[key] = info
+    return info
@@ -6,10 +6,10 @@ Represent Git Repos
 import os
 import pwd
 import site
-import configparser
-import re
+import threading
+from contextlib import suppress
 
-from patchtools.command import run_command
+from patchtools import backend, cache, gitsession
 
 MAINLINE_URLS = [ """git://git.kernel.org/pub/scm/linux/kernel/git/torvalds/linux-2.6.git""",
                   """git://git.kernel.org/pub/scm/linux/kernel/git/torvalds/linux.git""",
@@ -17,40 +17,62 @@ MAINLINE_URLS = [ """git://git.kernel.org/pub/scm/linux/kernel/git/torvalds/linu
                   """https://kernel.googlesource.com/pub/scm/linux/kernel/git/torvalds/linux.git"""
                 ]
 
-def get_git_repo_url(gitdir):
-    command = f"(cd {gitdir}; git remote show origin -n)"
-    output = run_command(command)
-    for line in output.split('\n'):
-        m = re.search(r"URL:\s+(\S+)", line)
-        if m:
-            return m.group(1)
+CONFIG_FILES = [ '/etc/patch.cfg',
+                 f'{site.USER_BASE}/etc/patch.cfg',
+                 os.path.expanduser('~/.patch.cfg'),
+                 './patch.cfg' ]
 
-    return None
+# Files outside of patch.cfg that feed into the configuration
+EXTRA_FILES = [ '/etc/passwd',
+                '/etc/gitconfig',
+                os.path.expanduser('~/.gitconfig'),
+                os.path.join(os.environ.get('XDG_CONFIG_HOME') or
+                             os.path.expanduser('~/.config'), 'git/config') ]
 
-def get_git_config(gitdir, var):
-    command = f"(cd {gitdir}; git config {var})"
-    return run_command(command).strip()
+# Bump when the snapshot layout or what goes into Config changes
+SNAPSHOT_VERSION = 4
+
+# The configuration names its backend itself, so it's passed in here
+def get_git_repo_url(gitdir, backend_name=backend.DEFAULT_BACKEND):
+    return backend.get_backend(gitdir, backend_name).remote_url()
+
+def get_git_config(gitdir, var, backend_name=backend.DEFAULT_BACKEND):
+    return backend.get_backend(gitdir, backend_name).config(var)
+
+def git_config_path(path):
+    """Return the config file of the repository containing 'path', if any."""
+    gitdir = gitsession.git_dir(path)
+    if gitdir is None:
+        return None
+    return os.path.join(gitdir, 'config')
 
 # We deliberately don't catch exceptions when the option is mandatory
 class Config:
     def __init__(self):
         # Set some sane defaults
         self.repos = [ os.getcwd() ]
-        self.mainline_repos = MAINLINE_URLS
-        self.merge_mainline_repos()
-        self.email = get_git_config(os.getcwd(), "user.email")
-        self.emails = [self.email]
+        self.mainline_repos = list(MAINLINE_URLS)
+        self.email = None
+        self.emails = []
         self.name = pwd.getpwuid(os.getuid()).pw_gecos.split(",")[0].strip()
+        self.export_cache = False
+        self.export_cache_size = cache.parse_size('1G')
+        self.large_patch_size = cache.parse_size('16M')
+        self.git_backend = backend.DEFAULT_BACKEND
 
+        default_repos = self.repos
         self.read_configs()
-        self.merge_mainline_repos()
+        if self.email is None:
+            self.email = get_git_config(os.getcwd(), 'user.email', self.git_backend)
+            self.emails = [self.email]
+        self.merge_mainline_repos(default_repos + self.repos)
 
     def read_configs(self):
+        # Most commands use the snapshot instead, so this is only
+        # imported when the files have to be read
+        import configparser  # noqa: PLC0415
         config = configparser.ConfigParser()
-        files_read = config.read([ '/etc/patch.cfg',
-                                   '%s/etc/patch.cfg' % site.USER_BASE,
-                                   os.path.expanduser('~/.patch.cfg'),
-                                   './patch.cfg'])
+        config.read(CONFIG_FILES)
         try:
             self.repos = config.get('repositories', 'search').split()
             repos = config.get('repositories', 'mainline').split()
@@ -69,9 +91,25 @@ class Config:
         except (configparser.NoOptionError, configparser.NoSectionError) as e:
             pass
 
-    def merge_mainline_repos(self):
-        for repo in self.repos:
-            url = get_git_repo_url(repo)
+        missing = (configparser.NoOptionError, configparser.NoSectionError)
+        with suppress(*missing):
+            self.git_backend = config.get('repositories', 'backend')
+
+        with suppress(*missing):
+            self.export_cache = config.getboolean('cache', 'export')
+
+        with suppress(*missing):
+            self.export_cache_size = cache.parse_size(config.get('cache', 'max-size'))
+
+        with suppress(*missing):
+            self.large_patch_size = cache.parse_size(config.get('patches', 'large-patch'))
+
+    def merge_mainline_repos(self, repos=None):
+        if repos is None:
+            repos = self.repos
+        # Each repository only needs its remote looked up once
+        for repo in dict.fromkeys(repos):
+            url = get_git_repo_url(repo, self.git_backend)
             if url in self.mainline_repos:
                 self.mainline_repos.append(repo)
 
@@ -91,3 +129,74 @@ class Config:
 
     def get_default_mainline_repo(self):
         return self._canonicalize(self.mainline_repos[0])
+
+    def snapshot_files(self):
+        """Every file whose contents went into this configuration."""
+        files = [ os.path.abspath(f) for f in CONFIG_FILES + EXTRA_FILES ]
+        for repo in [ os.getcwd(), *self.repos ]:
+            path = git_config_path(repo)
+            if path:
+                files.append(path)
+        return list(dict.fromkeys(files))
+
+def _snapshot_path():
+    return os.path.join(cache.cache_dir('config'),
+                        cache.key_name(os.getcwd()) + '.json')
+
+def _load_snapshot():
+    snapshot = cache.load_json(_snapshot_path())
+    if not snapshot or snapshot.get('version') != SNAPSHOT_VERSION or \
+       snapshot.get('cwd') != os.getcwd():
+        return None
+    for path, stamp in snapshot['stamps'].items():
+        if cache.file_stamp(path) != stamp:
+            return None
+
+    config = Config.__new__(Config)
+    config.__dict__.update(snapshot['config'])
+    return config
+
+def load_config():
+    """Return the configuration for the current directory, using the
+    on-disk snapshot when none of the files it came from have changed.
+    """
+    config = _load_snapshot()
+    if config is None:
+        # Stamp what we can before reading, so an edit made while we're
+        # loading invalidates the snapshot rather than being missed.
+        stamps = { os.path.abspath(f) : cache.file_stamp(f)
+                   for f in CONFIG_FILES + EXTRA_FILES }
+        config = Config()
+        for f in config.snapshot_files():
+            if f not in stamps:
+                stamps[f] = cache.file_stamp(f)
+        snapshot = {
+            'version' : SNAPSHOT_VERSION,
+            'cwd' : os.getcwd(),
+            'stamps' : stamps,
+            'config' : config.__dict__,
+        }
+        cache.store_json(_snapshot_path(), snapshot)
+    return config
+
+class LazyConfig:
+    """Stands in for a Config, which is only loaded when first used."""
+    def __init__(self):
+        self._config = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self._config is None:
+                self._config = load_config()
+            return self._config
+
+    def forget(self):
+        """Load the configuration again the next time it's used, in case
+        the files it came from, or the current directory, have changed.
+        """
+        with self._lock:
+            self._config = None
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
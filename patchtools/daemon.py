@@ -0,0 +1,249 @@
+# vim: sw=4 ts=4 et si:
+"""
+A long-running server for exportpatch and fixpatch
+
+Starting Python, loading the configuration and starting git for every
+command adds up when scripts run thousands of them. patchtools-daemon
+does all that once: it listens on a Unix socket, and the front ends in
+patchtools.client hand it their commands when PATCHTOOLS_DAEMON is set.
+
+Each command is run with the client's command line, working directory,
+stdin, stdout and stderr, so it behaves just as it would in the client.
+Commands run one at a time. Between them, everything found out about
+commits, branches and tags is forgotten, while the git sessions, the
+tag indexes and anything else that checks itself against the
+repository are kept.
+"""
+
+__revision__ = 'Revision: 2.5'
+
+import contextlib
+import importlib
+import io
+import os
+import signal
+import socket
+import struct
+import sys
+import traceback
+
+from patchtools import client, commitcache, config, gitsession, locator, tagindex, timings
+from patchtools.modified_optparse import ModifiedOptionParser, OptionParsingError
+
+TOOLS = [ 'exportpatch', 'fixpatch' ]
+
+
+def peer_uid(conn):
+    """Return the uid of the process at the other end of 'conn', or None
+    if we can't tell.
+    """
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                            struct.calcsize('3i'))
+    return struct.unpack('3i', creds)[1]
+
+
+def forget():
+    """Forget what the last command found out that may have changed since."""
+    config.forget()
+    gitsession.forget()
+    commitcache.forget()
+    locator.forget()
+    tagindex.forget()
+    timings.forget()
+
+
+def exit_status(e):
+    """Return the exit status Python would give for SystemExit 'e'."""
+    if e.code is None:
+        return 0
+    if isinstance(e.code, int):
+        return e.code
+    print(e.code, file=sys.stderr)
+    return 1
+
+
+def run_tool(tool, argv):
+    """Run the main() of 'tool' with 'argv'. Return its exit status."""
+    saved_argv = sys.argv
+    sys.argv = list(argv)
+    try:
+        module = importlib.import_module('patchtools.' + tool)
+        return module.main()
+    except SystemExit as e:
+        return exit_status(e)
+    except Exception as e:
+        # As Python would report it, from main() down
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        return 1
+    finally:
+        sys.argv = saved_argv
+
+
+def open_std_files(fds, modes):
+    """Return file objects for the client's stdin, stdout and stderr,
+    which take over 'fds', set up like the client's own, as 'modes'
+    from client.stream_modes() describes them.
+    """
+    binaries = []
+    try:
+        for (fd, mode, binary_mode) in zip(fds, modes, ('rb', 'wb', 'wb')):  # noqa: B905
+            unbuffered = mode.get('write_through', False)
+            # Closed along with the wrapper we return, or below
+            binaries.append(open(fd, binary_mode,  # noqa: SIM115, PTH123
+                                 buffering=0 if unbuffered else -1))
+        return [ io.TextIOWrapper(binary, encoding=mode.get('encoding'),
+                                  errors=mode.get('errors'),
+                                  line_buffering=mode.get('line_buffering', False),
+                                  write_through=mode.get('write_through', False))
+                 for (binary, mode) in zip(binaries, modes) ]  # noqa: B905
+    except (OSError, LookupError, ValueError):
+        for binary in binaries:
+            close_quietly(binary)
+        for fd in fds[len(binaries):]:
+            with contextlib.suppress(OSError):
+                os.close(fd)
+        raise
+
+
+def close_quietly(f):
+    # The client may be gone, or not reading any more
+    with contextlib.suppress(OSError):
+        f.close()
+
+
+def run_request(request, fds):
+    """Run the command in 'request' with the client's files. Return its
+    exit status.
+    """
+    modes = request.get('streams') or [ {} ] * len(fds)
+    (stdin, stdout, stderr) = open_std_files(fds, modes)
+    saved_stdin = sys.stdin
+    try:
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            sys.stdin = stdin
+            try:
+                os.chdir(request['cwd'])
+            except OSError as e:
+                print(e, file=sys.stderr)
+                return 1
+            forget()
+            return run_tool(request['tool'], request['argv'])
+    finally:
+        sys.stdin = saved_stdin
+        for f in (stdout, stderr, stdin):
+            close_quietly(f)
+
+
+def handle(conn, code):
+    """Answer a single client on 'conn'."""
+    (request, fds) = client.receive_message(conn, len(client.STD_FDS))
+    try:
+        if request is None or len(fds) != len(client.STD_FDS):
+            return
+        uid = peer_uid(conn)
+        if (uid is not None and uid != os.getuid()) or \
+           request.get('code') != code or request.get('tool') not in TOOLS:
+            # Let the client run the command itself
+            client.send_message(conn, { 'status' : None })
+            return
+        (fds, client_fds) = ([], fds)
+        status = run_request(request, client_fds)
+        client.send_message(conn, { 'status' : status })
+    finally:
+        for fd in fds:
+            os.close(fd)
+
+
+def listen(path):
+    """Return a socket listening on 'path', or raise OSError."""
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(path)
+        except OSError:
+            pass
+        else:
+            raise OSError(f'patchtools-daemon is already listening on {path}')
+        sock.close()
+
+        # Whatever is at 'path' isn't listening
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            sock.bind(path)
+        finally:
+            os.umask(old_umask)
+        sock.listen(16)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def serve(path, idle_timeout=0):
+    """Answer clients on 'path' until we're stopped, or until no client
+    has come along for 'idle_timeout' seconds, if it's set.
+    """
+    sock = listen(path)
+    code = client.code_stamp()
+    if idle_timeout:
+        sock.settimeout(idle_timeout)
+    try:
+        while True:
+            # socket.timeout is only TimeoutError from Python 3.10
+            try:
+                (conn, _addr) = sock.accept()
+            except socket.timeout:  # noqa: UP041
+                break
+            with conn:
+                conn.settimeout(None)
+                try:
+                    handle(conn, code)
+                except (OSError, ValueError) as e:
+                    print(f'patchtools-daemon: {e}', file=sys.stderr)
+    finally:
+        sock.close()
+        with contextlib.suppress(OSError):
+            os.unlink(path)
+        gitsession.close_sessions()
+
+
+def main():
+    """The main entry point for this module. Return 0 for success."""
+    parser = ModifiedOptionParser(
+                version='%prog ' + __revision__,
+                usage='%prog [options] -- run exportpatch and fixpatch commands for PATCHTOOLS_DAEMON clients')
+    parser.add_option('-s', '--socket', action='store', default=None,
+                      help='listen on this socket [default is $XDG_RUNTIME_DIR/patchtools/daemon.sock]')
+    parser.add_option('-t', '--idle-timeout', type='int', action='store', default=0,
+                      help='exit after this many seconds without a command; 0 means never [default is %default]')
+
+    try:
+        (options, args) = parser.parse_args()
+    except OptionParsingError as e:
+        print(f'Option paring error: {e.msg}', file=sys.stderr)
+        return 1
+
+    if args:
+        parser.print_help(file=sys.stderr)
+        return 1
+
+    # Stop cleanly, removing the socket, when we're told to
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    # We change directory for every command
+    path = os.path.abspath(options.socket or
+                           client.socket_path(os.environ.get('PATCHTOOLS_DAEMON')))
+    try:
+        serve(path, max(options.idle_timeout, 0))
+    except OSError as e:
+        print(e, file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
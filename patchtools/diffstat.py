@@ -0,0 +1,168 @@
+# vim: sw=4 ts=4 et si:
+"""
+Generate diffstat output without running diffstat
+
+The output matches what 'diffstat -p1' prints for unified diffs:
+
+ * one line per file, sorted by name, with the name padded to the
+   longest name, the total number of changed lines in a five-column
+   field and a histogram of '+' and '-',
+ * the histogram is scaled down so that lines fit in 80 columns (but
+   is never narrower than 10 columns), with the remainder of each
+   scaled column carried over into the next one as diffstat does,
+ * binary files show "binary" instead of counts,
+ * a summary line that leaves out zero insertion and deletion counts.
+"""
+
+import re
+
+MAX_WIDTH = 80
+MIN_PLOT_WIDTH = 10
+
+_hunk_re = re.compile(r'^@@ -\d+(?:,(\d+))? \+\d+(?:,(\d+))? @@')
+_git_re = re.compile(r'^diff --git (\S+) (\S+)$')
+_binary_re = re.compile(r'^Binary files (\S+) and (\S+) differ$')
+
+class FileStat:
+    __slots__ = ('adds', 'binary', 'dels', 'name')
+
+    def __init__(self, name):
+        self.name = name
+        self.adds = 0
+        self.dels = 0
+        self.binary = False
+
+    @property
+    def total(self):
+        return self.adds + self.dels
+
+def strip_path(path, strip=1):
+    """Strip 'strip' leading components from 'path', as 'diffstat -p' does."""
+    path = path.split('\t', 1)[0].rstrip()
+    parts = path.split('/', strip)
+    if len(parts) > strip:
+        return parts[strip]
+    return path
+
+def parse(text, strip=1):
+    """Return the list of FileStat for the diff 'text', in the order the
+    files first appear.
+    """
+    return parse_lines(text.split('\n'), strip)
+
+# A single loop, as it's run on every line of the largest patches
+def parse_lines(lines, strip=1):  # noqa: PLR0912, PLR0915
+    """Return the list of FileStat for the diff whose lines, without
+    their "\\n", 'lines' yields.
+    """
+    files = {}
+    current = None
+    old_name = None
+    old_left = new_left = 0
+
+    def get(name):
+        nonlocal current
+        current = files.get(name)
+        if current is None:
+            current = files[name] = FileStat(name)
+        return current
+
+    for line in lines:
+        if old_left > 0 or new_left > 0:
+            c = line[:1]
+            if c == '+':
+                current.adds += 1
+                new_left -= 1
+            elif c == '-':
+                current.dels += 1
+                old_left -= 1
+            elif c == '\\':
+                pass
+            else:
+                old_left -= 1
+                new_left -= 1
+            continue
+
+        if line.startswith('--- '):
+            old_name = line[4:]
+        elif line.startswith('+++ ') and old_name is not None:
+            name = line[4:]
+            if name.split('\t', 1)[0].rstrip() == '/dev/null':
+                name = old_name
+            get(strip_path(name, strip))
+            old_name = None
+        elif line.startswith('@@ ') and current is not None:
+            m = _hunk_re.match(line)
+            if m:
+                old_left = int(m.group(1)) if m.group(1) is not None else 1
+                new_left = int(m.group(2)) if m.group(2) is not None else 1
+        elif line.startswith('diff --git '):
+            m = _git_re.match(line)
+            if m:
+                get(strip_path(m.group(2), strip))
+            old_name = None
+        elif line.startswith('GIT binary patch'):
+            if current is not None:
+                current.binary = True
+        elif line.startswith('Binary files '):
+            m = _binary_re.match(line)
+            if m:
+                name = m.group(2)
+                if name == '/dev/null':
+                    name = m.group(1)
+                get(strip_path(name, strip)).binary = True
+
+    return list(files.values())
+
+def _histogram(stat, plot_width, scale):
+    if scale <= plot_width:
+        return '+' * stat.adds + '-' * stat.dels
+
+    graph = []
+    extra = 0
+    for count, mark in ((stat.adds, '+'), (stat.dels, '-')):
+        if count:
+            product = count * plot_width + extra
+            n = product // scale
+            extra = product - n * scale
+            graph.append(mark * n)
+    return ''.join(graph)
+
+def _count(n, what):
+    """Return 'n what', with an 's' on the end unless 'n' is 1."""
+    suffix = '' if n == 1 else 's'
+    return f'{n} {what}{suffix}'
+
+def format_stats(stats):
+    """Format a list of FileStat the way diffstat does."""
+    stats = sorted(stats, key=lambda s: s.name)
+    out = []
+    adds = dels = 0
+
+    if stats:
+        name_wide = max(len(s.name) for s in stats)
+        plot_width = max(MIN_PLOT_WIDTH, MAX_WIDTH - name_wide - 8)
+        scale = max(s.total for s in stats if not s.binary) if \
+                not all(s.binary for s in stats) else 0
+
+        for s in stats:
+            line = f' {s.name:<{name_wide}} |'
+            if s.binary:
+                line += 'binary'
+            else:
+                line += f'{s.total:5d} {_histogram(s, plot_width, scale)}'
+                adds += s.adds
+                dels += s.dels
+            out.append(line)
+
+    summary = f' {_count(len(stats), "file")} changed'
+    if adds:
+        summary += f', {_count(adds, "insertion")}(+)'
+    if dels:
+        summary += f', {_count(dels, "deletion")}(-)'
+    out.append(summary)
+    return '\n'.join(out) + '\n'
+
+def diffstat(text, strip=1):
+    """Return the 'diffstat -p<strip>' output for the diff 'text'."""
+    return format_stats(parse(text, strip))
@@ -0,0 +1,94 @@
+# vim: sw=4 ts=4 et si:
+"""
+On-disk cache of exported patches
+
+Each entry holds the finished text exportpatch writes for one commit,
+keyed by the commit's full hash and everything else that goes into that
+text: the options that change the output, who we sign as, where the
+commit came from and the tags that its Patch-mainline header is worked
+out from. Entries are never updated in place; anything that changes
+gives a different key, and old entries are evicted, least recently
+used first, once the cache grows past its size limit.
+"""
+
+import json
+import os
+from contextlib import suppress
+
+from patchtools import cache, config, gitsession, patchops
+
+# Bump when the entry layout or the patch text we produce changes
+CACHE_VERSION = 3
+
+
+def cache_path(*parts):
+    return cache.cache_dir('exports', *parts)
+
+
+def tags_fingerprint(repo):
+    """A digest of the release tags in 'repo', which changes whenever the
+    tag index would give a different answer for some commit.
+    """
+    def fingerprint():
+        return cache.key_name(*patchops.get_release_tags(repo))
+    return gitsession.get_pool(repo).cached('tags_fingerprint', fingerprint)
+
+
+def entry_key(sha, repo, options):
+    """Return the cache key for exporting the full hash 'sha' from 'repo'."""
+    identity = [ config.name, config.email, config.emails,
+                 config.get_mainline_repos() ]
+    output = [ options.extract, options.exclude, options.reference,
+               options.signed_off_by ]
+    return cache.key_name(CACHE_VERSION, sha, os.path.realpath(repo),
+                          patchops.get_git_repo_url(repo),
+                          tags_fingerprint(repo),
+                          json.dumps(identity), json.dumps(output))
+
+
+def load(key):
+    """Return the entry stored under 'key', or None."""
+    path = cache_path(key + '.json')
+    entry = cache.load_json(path)
+    if entry is None:
+        return None
+    with suppress(OSError):
+        # Mark it as recently used
+        os.utime(path)
+    return entry
+
+
+def store(key, entry):
+    cache.store_json(cache_path(key + '.json'), entry)
+
+
+def trim(max_size):
+    """Remove the least recently used entries until the cache takes up
+    no more than 'max_size' bytes.
+    """
+    try:
+        names = os.listdir(cache_path())
+    except OSError:
+        return
+    entries = []
+    total = 0
+    for name in names:
+        if not name.endswith('.json'):
+            continue
+        path = cache_path(name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime_ns, st.st_size, path))
+        total += st.st_size
+
+    entries.sort()
+    for (_, size, path) in entries:
+        if total <= max_size:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        total -= size
@@ -6,12 +6,15 @@ From Jeff Mahoney, updated by Lee Duncan.
 __revision__ = 'Revision: 2.5'
 __author__ = 'Jeff Mahoney'
 
-import sys
-from patchtools import PatchException
-from patchtools.modified_optparse import ModifiedOptionParser, OptionParsingError
-from patchtools.patch import Patch, EmptyCommitException
+import contextlib
+import itertools
 import os
+import sys
+from pathlib import Path
 
+from patchtools import PatchException, config, exportcache, gitsession, largepatch, parallel, patchops, timings
+from patchtools.modified_optparse import ModifiedOptionParser, OptionParsingError
+from patchtools.patch import EmptyCommitException, Patch
 
 # default: do not write out a patch file
 WRITE=False
@@ -19,58 +22,212 @@ WRITE=False
 # default directory where patch gets written
 DIR="."
 
+# patch files are numbered below this
+MAX_NUMBER = 9999
 
-def export_patch(commit, options, prefix, suffix):
-    """Export a single commit/patch. Return 0 for success, else 1."""
+NO_RANGE_MESSAGE = 'Paths after "--" only limit revision ranges, and no range was given'
+
+
+class ExportedPatch:
+    """The finished text of an exported patch, and the subject its file
+    is named after. The diff of a large patch is 'body', a
+    largepatch.LargeBody, instead of being in the text.
+    """
+    def __init__(self, subject, text, body=None):
+        self.subject = subject
+        self.text = text
+        self.body = body
+
+    def write(self, f):
+        """Write the patch, and a newline, to the text file 'f'."""
+        largepatch.print_patch(self.text, self.body, f)
+
+    def get_pathname(self, dirname=None, prefix='', suffix=''):
+        return Patch.pathname_for(self.subject, dirname, prefix, suffix)
+
+
+@timings.timed('export cache')
+def cached_patch(commit, options, repos):
+    """Look 'commit' up in the export cache.
+
+    Return (key, entry): entry is None on a miss, and key is where to
+    store the patch once it's built, or None if we couldn't find the
+    commit and so have nothing to store.
+    """
+    repo = patchops.find_commit_repo(commit, repos, options.force)
+    if repo is None:
+        return (None, None)
+    key = exportcache.entry_key(patchops.canonicalize_commit(commit, repo),
+                                repo, options)
+    return (key, exportcache.load(key))
+
+
+def prepare_patch(commit, options, err=None):
+    """Find a single commit and build its patch, without writing it.
+
+    Return (status, patch): status is 0 for success, else 1, and patch
+    is an ExportedPatch, or None if there's nothing to write.
+    """
+    if err is None:
+        err = sys.stderr
     try:
         p = Patch(commit, debug=options.debug, force=options.force)
     except PatchException as e:
-        print(e, file=sys.stderr)
-        return 1
-    if p.find_commit():
-        if options.reference:
-            p.add_references(options.reference)
-        if options.extract:
-            try:
-                p.filter(options.extract)
-            except EmptyCommitException:
-                print("Commit %s is now empty. Skipping." % commit, file=sys.stderr)
-                return 0
-        if options.exclude:
-            try:
-                p.filter(options.exclude, True)
-            except EmptyCommitException:
-                print("Commit %s is now empty. Skipping." % commit, file=sys.stderr)
-                return 0
-        p.add_signature(options.signed_off_by)
-        if options.write:
-            fn = p.get_pathname(options.dir, prefix, suffix)
-            if os.path.exists(fn) and not options.force:
-                f = fn
-                fn += "-%s" % commit[0:8]
-                print("%s already exists. Using %s" % (f, fn), file=sys.stderr)
-            print(os.path.basename(fn))
-            try:
-                f = open(fn, "w")
-            except OSError as e:
-                print(e, file=sys.stderr)
-                return 1
+        print(e, file=err)
+        return (1, None)
+
+    key = None
+    if options.cache:
+        (key, entry) = cached_patch(commit, options, p.repo_list)
+        if entry is not None:
+            if entry.get('empty'):
+                print(f'Commit {commit} is now empty. Skipping.', file=err)
+                return (0, None)
+            return (0, ExportedPatch(entry['subject'], entry['text']))
+
+    if not p.find_commit(options.extract):
+        print(f"Couldn't locate commit \"{commit}\"; Skipping.", file=err)
+        return (1, None)
+
+    if options.reference:
+        p.add_references(options.reference)
+    for (paths, exclude) in ((options.extract, False), (options.exclude, True)):
+        if not paths:
+            continue
+        try:
+            p.filter(paths, exclude)
+        except EmptyCommitException:
+            print(f'Commit {commit} is now empty. Skipping.', file=err)
+            if key:
+                with timings.phase('export cache'):
+                    exportcache.store(key, { 'empty' : True })
+            return (0, None)
+    p.add_signature(options.signed_off_by)
+
+    with timings.phase('serialize'):
+        exported = ExportedPatch(p.message['Subject'], p.as_string(), p.large)
+    if key and exported.body is None:
+        # Large patches would only fill the cache
+        with timings.phase('export cache'):
+            exportcache.store(key, { 'subject' : exported.subject,
+                                     'text' : exported.text })
+    return (0, exported)
+
+
+@timings.timed('write')
+def write_patch(p, commit, options, prefix, suffix):
+    """Write out a patch built by prepare_patch(). Return 0 for success, else 1."""
+    if options.write:
+        fn = p.get_pathname(options.dir, prefix, suffix)
+        if os.path.exists(fn) and not options.force:
+            f = fn
+            fn += f'-{commit[0:8]}'
+            print(f'{f} already exists. Using {fn}', file=sys.stderr)
+        print(os.path.basename(fn))
+        try:
+            with Path(fn).open('w') as f:
+                p.write(f)
+        except OSError as e:
+            print(e, file=sys.stderr)
+            return 1
+    else:
+        p.write(sys.stdout)
+    return 0
 
-            print(p.message.as_string(False), file=f)
-            f.close()
+
+def export_patch(commit, options, prefix, suffix):
+    """Export a single commit/patch. Return 0 for success, else 1."""
+    (ret, p) = prepare_patch(commit, options)
+    if p is None:
+        return ret
+    return write_patch(p, commit, options, prefix, suffix)
+
+
+def read_commits(f):
+    """Yield the commits listed in 'f', one per line.
+
+    Only the first word of a line is used, so 'git log --oneline' output
+    works. Blank lines and '#' comments are skipped.
+    """
+    for line in f:
+        fields = line.split('#', 1)[0].split()
+        if fields:
+            yield fields[0]
+
+
+def commit_list(names, pathspecs, repos):
+    """Yield the commits to export for 'names', expanding revision ranges
+    as we go so that long ranges are never held in memory. Warn if
+    there are 'pathspecs' but no range for them to limit.
+    """
+    ranges = False
+    for name in names:
+        if patchops.is_range(name):
+            ranges = True
+            yield from patchops.expand_range(name, pathspecs, repos)
         else:
-            print(p.message.as_string(False))
-        return 0
+            yield name
+    if pathspecs and not ranges:
+        print(NO_RANGE_MESSAGE, file=sys.stderr)
+
+
+def argument_error(options, args, pathspecs, known):
+    """Return what's wrong with the commits and paths asked for, or None.
+    'known' is whether 'args' are all the commits there are.
+    """
+    if not args and not options.stdin and not options.from_file:
+        return 'Must supply patch hash(es)'
+    if (known and options.first_number + len(args) > MAX_NUMBER) or \
+       options.first_number < 0:
+        return 'The starting number + commits needs to be in the range 0 - 9999'
+    if known and pathspecs:
+        return NO_RANGE_MESSAGE
+    return None
+
+
+def export_patches(commits, options, suffix, num_width, jobs=1):
+    """Export every commit in the iterable 'commits'. Return 0 for success.
+
+    With more than one job, the commits are looked up and their patches
+    built in worker threads, which spend most of their time waiting on
+    git. Everything is written out here, in the order of 'commits', so
+    the numbering, the names printed and any messages come out just as
+    they would one at a time. Either way, we stop at the first failure.
+    """
+    if jobs > 1:
+        gitsession.set_max_sessions(jobs)
+
+        def prepare(commit):
+            return (commit, *parallel.buffered(prepare_patch, commit, options))
+
+        results = parallel.ordered_map(prepare, commits, jobs)
+    else:
+        results = ((commit, prepare_patch(commit, options), '') for commit in commits)
 
-    print("Couldn't locate commit \"%s\"; Skipping." % commit, file=sys.stderr)
-    return 1
+    n = options.first_number
+    with contextlib.closing(results):
+        for (commit, (prepared, p), errors) in results:
+            if n >= MAX_NUMBER:
+                print('The starting number + commits needs to be in the range 0 - 9999',
+                      file=sys.stderr)
+                return 1
+            prefix = ''
+            if options.numeric:
+                prefix = '{0:0{1}}-'.format(n, num_width)
+
+            sys.stderr.write(errors)
+            ret = write_patch(p, commit, options, prefix, suffix) if p is not None else prepared
+            if ret:
+                return ret
+            n += 1
+    return 0
 
 
 def main():
     """The main entry point for this module. Return 0 for success."""
     parser = ModifiedOptionParser(
                 version='%prog ' + __revision__,
-                usage='%prog [options] <LIST OF COMMIT HASHES> --  export patch with proper patch headers')
+                usage='%prog [options] <COMMITS OR RANGES> [-- <PATHS>] --  export patch with proper patch headers')
     parser.add_option("-w", "--write", action="store_true",
                       help="write patch file(s) instead of stdout [default is %default]",
                       default=WRITE)
@@ -95,27 +252,54 @@ def main():
     parser.add_option("-F", "--reference", action="append",
                       help="add reference tag. This option can be specified multiple times.", default=None)
     parser.add_option("-x", "--extract", action="append",
-                      help="extract specific parts of the commit; using a path that ends with / includes all files under that hierarchy. This option can be specified multiple times.", default=None)
+                      help='extract specific parts of the commit; using a path that ends with / '
+                           'includes all files under that hierarchy, and gitignore-style patterns '
+                           'like *.h can be used. This option can be specified multiple times.',
+                      default=None)
     parser.add_option("-X", "--exclude", action="append",
-                      help="exclude specific parts of the commit; using a path that ends with / excludes all files under that hierarchy. This option can be specified multiple times.", default=None)
+                      help='exclude specific parts of the commit; using a path that ends with / '
+                           'excludes all files under that hierarchy, and gitignore-style patterns '
+                           'like *.h can be used. This option can be specified multiple times.',
+                      default=None)
     parser.add_option("-S", "--signed-off-by", action="store_true",
                       default=False,
                       help="Use Signed-off-by instead of Acked-by")
+    parser.add_option('-j', '--jobs', type='int', action='store',
+                      help='export up to this many commits at once; 0 means one per CPU [default is %default]',
+                      default=1)
+    parser.add_option('--stdin', action='store_true', default=False,
+                      help='also read commits or ranges from stdin, one per line')
+    parser.add_option('--from-file', action='store', default=None,
+                      help='also read commits or ranges from this file, one per line')
+    parser.add_option('--cache', action='store_true', dest='cache', default=None,
+                      help='reuse patches exported before, and keep the ones exported now [default from patch.cfg]')
+    parser.add_option('--no-cache', action='store_false', dest='cache',
+                      help="don't use the export cache")
+    parser.add_option('--timings', action='store_true', default=False,
+                      help='print where the time went, by phase and by git command, to stderr')
+    parser.add_option('--timings-json', action='store', default=None,
+                      help='write where the time went to this file, as JSON')
+
+    # Anything after "--" is a path limiting the commits in ranges
+    argv = sys.argv[1:]
+    pathspecs = []
+    if '--' in argv:
+        i = argv.index('--')
+        (argv, pathspecs) = (argv[:i], argv[i + 1:])
 
     try:
-        (options, args) = parser.parse_args()
+        (options, args) = parser.parse_args(argv)
 
     except OptionParsingError as e:
         print(f'Option paring error: {e.msg}', file=sys.stderr)
         return 1
 
-    if not args:
-        print("Must supply patch hash(es)", file=sys.stderr)
-        return 1
-
-    if options.first_number + len(args) > 9999 or options.first_number < 0:
-        print("The starting number + commits needs to be in the range 0 - 9999",
-              file=sys.stderr)
+    # We only know how many commits there are up front for a plain list
+    known = not options.stdin and not options.from_file and \
+            not any(patchops.is_range(arg) for arg in args)
+    error = argument_error(options, args, pathspecs, known)
+    if error:
+        print(error, file=sys.stderr)
         return 1
 
     suffix = ""
@@ -128,18 +312,38 @@ def main():
         if _n > 0 and _n < 5:
             num_width = _n
 
-    n = options.first_number
-    for commit in args:
-        prefix = ""
-        if options.numeric:
-            prefix = "{0:0{1}}-".format(n, num_width)
+    if options.jobs < 0:
+        print("The number of jobs can't be negative", file=sys.stderr)
+        return 1
+    jobs = parallel.job_count(options.jobs)
 
-        res = export_patch(commit, options, prefix, suffix)
-        if res:
-            return res
+    if options.cache is None:
+        options.cache = config.export_cache
 
-        n += 1
+    names = [ args ]
+    with contextlib.ExitStack() as stack:
+        if options.from_file:
+            try:
+                f = stack.enter_context(Path(options.from_file).open())
+            except OSError as e:
+                print(e, file=sys.stderr)
+                return 1
+            names.append(read_commits(f))
+        if options.stdin:
+            names.append(read_commits(sys.stdin))
 
-    return 0
+        if known and len(args) == 1:
+            jobs = 1
+        if options.timings or options.timings_json:
+            timings.enable()
+        commits = commit_list(itertools.chain.from_iterable(names), pathspecs,
+                              config.get_repos())
+        try:
+            return export_patches(commits, options, suffix, num_width, jobs)
+        finally:
+            if options.cache:
+                exportcache.trim(config.export_cache_size)
+            if options.timings or options.timings_json:
+                timings.finish(options.timings, options.timings_json)
 
 # vim: sw=4 ts=4 et si:
@@ -9,38 +9,50 @@ __revision__ = 'Revision: 2.5'
 __author__ = 'Jeff Mahoney'
 
 
-from patchtools import PatchException
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+from patchtools import PatchException, gitsession, largepatch, manifest, parallel, timings
 from patchtools.modified_optparse import ModifiedOptionParser, OptionParsingError
 from patchtools.patch import Patch
-import sys
-import os
 
 
-def process_file(pathname, options):
-    """Fix one patchfile. Return 0 for success."""
+def fix_options(options, err=None):
+    """Turn on the options that --update-only and --header-only imply."""
+    if err is None:
+        err = sys.stderr
+    if options.update_only:
+        options.header_only = True
+        options.no_rename = True
+
+    if options.header_only:
+        options.no_ack = True
+        options.no_diffstat = True
+        if options.reference:
+            print("References won't be updated in header-only mode.", file=err)
+            options.reference = None
+
+
+def fix_patch(pathname, options, err=None):
+    """Read one patchfile and fix it in memory, without writing anything.
+
+    Return (status, patch): status is 0 for success, else 1, and patch
+    is None on failure.
+    """
+    if err is None:
+        err = sys.stderr
     try:
         p = Patch()
-        f = open(pathname, "r")
-        p.from_email(f.read())
+        p.from_file(pathname)
 
         if options.name_only:
-            suffix=""
-            if options.suffix:
-                suffix = ".patch"
-            fn = p.get_pathname()
-            print("{}{}".format(fn, suffix))
-            return 0
-
-        if options.update_only:
-            options.header_only = True
-            options.no_rename = True
+            return (0, p)
 
-        if options.header_only:
-            options.no_ack = True
-            options.no_diffstat = True
-            if options.reference:
-                print("References won't be updated in header-only mode.", file=sys.stderr)
-                options.reference = None
+        fix_options(options, err)
 
         if not options.no_diffstat:
             p.add_diffstat()
@@ -53,8 +65,104 @@ def process_file(pathname, options):
         if options.mainline:
             p.add_mainline(options.mainline)
 
+    except (FileNotFoundError, PermissionError, PatchException) as e:
+        print(e, file=err)
+        return (1, None)
+
+    return (0, p)
+
+
+# Writing a patch out adds a newline to the one its text already ends
+# with, so a patch fixed again would grow a blank line every time. The
+# file is left alone if that's all that would change.
+
+def is_unchanged(pathname, text):
+    """Return True if the file 'pathname' holds 'text', with or without
+    the newline that writing it would add.
+    """
+    with Path(pathname).open(newline='') as f:
+        return f.read() in (text, text + '\n')
+
+
+def is_unchanged_file(pathname, newname):
+    """Return True if the file 'pathname' holds what the file 'newname'
+    does, with or without a newline at the end.
+    """
+    old_size = os.path.getsize(pathname)
+    new_size = os.path.getsize(newname)
+    if new_size not in (old_size, old_size + 1):
+        return False
+    with Path(pathname).open('rb') as old, Path(newname).open('rb') as new:
+        if new_size > old_size:
+            new.seek(old_size)
+            if new.read() != b'\n':
+                return False
+            new.seek(0)
+        while True:
+            block = old.read(largepatch.COPY_SIZE)
+            if block != new.read(len(block)):
+                return False
+            if not block:
+                return True
+
+
+def write_text_patch(pathname, fn, text):
+    """Write the patch 'text', read from the file 'pathname', to the
+    file 'fn', which replaces it.
+    """
+    if is_unchanged(pathname, text):
+        if fn != pathname:
+            os.replace(pathname, fn)
+        return
+    with Path(fn).open('w') as f:
+        print(text, file=f)
+    if fn != pathname:
+        os.unlink(pathname)
+
+
+def write_large_patch(pathname, fn, text, body):
+    """Write 'text' and the LargeBody 'body', read from the file
+    'pathname', to the file 'fn', which replaces it.
+    """
+    # The diff is still read from the file it came from, which may be
+    # the one we're writing
+    with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(fn) or '.',
+                                     prefix='.patchtools-', delete=False) as f:
+        try:
+            largepatch.print_patch(text, body, f)
+        except OSError:
+            os.unlink(f.name)
+            raise
+    if is_unchanged_file(pathname, f.name):
+        os.unlink(f.name)
+        if fn != pathname:
+            os.replace(pathname, fn)
+    else:
+        shutil.copymode(pathname, f.name)
+        os.replace(f.name, fn)
+        if fn != pathname:
+            os.unlink(pathname)
+
+
+@timings.timed('write')
+def write_patch(pathname, p, options, manifests=None):
+    """Print or write out a patch fixed by fix_patch(). Return 0 for success.
+
+    A file that would be written with what it already holds is left
+    alone, or only renamed. If 'manifests' is given, the file is
+    recorded in its directory's manifest.
+    """
+    try:
+        if options.name_only:
+            suffix=''
+            if options.suffix:
+                suffix = '.patch'
+            fn = p.get_pathname()
+            print(f'{fn}{suffix}')
+            return 0
+
         if options.dry_run:
-            print(p.message.as_string(unixfrom=False))
+            p.write(sys.stdout)
             return 0
 
         suffix=""
@@ -72,12 +180,17 @@ def process_file(pathname, options):
                 print("%s already exists." % fn, file=sys.stderr)
                 return 1
 
-        f = open(fn, "w")
+        with timings.phase('serialize'):
+            text = p.as_string()
+        if p.large is not None:
+            write_large_patch(pathname, fn, text, p.large)
+        else:
+            write_text_patch(pathname, fn, text)
+        # Only once the patch is in place
         print(fn)
-        print(p.message.as_string(unixfrom=False), file=f)
-        f.close()
-        if fn != pathname:
-            os.unlink(pathname)
+
+        if manifests is not None:
+            manifests.record(fn, p.commit, pathname)
 
     except (FileNotFoundError, PermissionError, PatchException) as e:
         print(e, file=sys.stderr)
@@ -86,6 +199,59 @@ def process_file(pathname, options):
     return 0
 
 
+def process_file(pathname, options, manifests=None):
+    """Fix one patchfile, unless 'manifests' has it as fixed already.
+    Return 0 for success.
+    """
+    if manifests is not None and manifests.is_fixed(pathname):
+        return 0
+    (ret, p) = fix_patch(pathname, options)
+    if p is None:
+        return ret
+    return write_patch(pathname, p, options, manifests)
+
+
+def process_files(pathnames, options, jobs, manifests=None):
+    """Fix 'pathnames' using 'jobs' worker threads. Return 0 if they
+    were all fixed.
+
+    Unlike a serial run, we don't stop at the first failure: every file
+    is processed and a summary is printed at the end.
+
+    The workers only read the patches and fix them up in memory. Every
+    patch is written, renamed or printed here, in the order the files
+    were given. Two inputs that end up with the same name can't race:
+    the second one finds the first one's output already there, just as
+    it would in a serial run.
+    """
+    if not options.name_only:
+        # Rather than have every worker adjust them
+        fix_options(options)
+    gitsession.set_max_sessions(jobs)
+
+    def fix(pathname):
+        if manifests is not None and manifests.is_fixed(pathname):
+            return ((0, None), '')
+        return parallel.buffered(fix_patch, pathname, options)
+
+    failed = []
+    with contextlib.closing(parallel.ordered_map(fix, pathnames, jobs)) as results:
+        for (pathname, ((fixed, p), errors)) in zip(pathnames, results):  # noqa: B905
+            sys.stderr.write(errors)
+            ret = write_patch(pathname, p, options, manifests) if p is not None else fixed
+            if ret:
+                failed.append(pathname)
+
+    print(f'{len(pathnames) - len(failed)} of {len(pathnames)} patch files processed successfully.',
+          file=sys.stderr)
+    if failed:
+        print('Failed:', file=sys.stderr)
+        for pathname in failed:
+            print(f'  {pathname}', file=sys.stderr)
+        return 1
+    return 0
+
+
 def main():
     """The main entry point for this module. Return 0 for success."""
     parser = ModifiedOptionParser(
@@ -116,6 +282,16 @@ def main():
     parser.add_option("-s", "--suffix", action="store_true",
                       help='When generating the patch name, append ".patch"',
                       default=False)
+    parser.add_option('-j', '--jobs', type='int', action='store', default=1,
+                      help="Fix up to this many patches at once; 0 means one per CPU. "
+                           "Doesn't stop at the first failure.")
+    parser.add_option('--manifest', action='store_true', default=False,
+                      help='Skip patches that the manifest in their directory has as fixed already, '
+                           'and record the ones fixed')
+    parser.add_option('--timings', action='store_true', default=False,
+                      help='Print where the time went, by phase and by git command, to stderr')
+    parser.add_option('--timings-json', action='store', default=None,
+                      help='Write where the time went to this file, as JSON')
 
     try:
         (options, args) = parser.parse_args()
@@ -128,11 +304,33 @@ def main():
         print("Must supply patch filename(s)", file=sys.stderr)
         return 1
 
-    for pathname in args:
-        res = process_file(pathname, options)
-        if res:
-            return res
+    if options.jobs < 0:
+        print("The number of jobs can't be negative", file=sys.stderr)
+        return 1
+    jobs = parallel.job_count(options.jobs)
+
+    manifests = None
+    if options.manifest and not (options.name_only or options.dry_run):
+        # The options are part of the state a patch was fixed with
+        fix_options(options)
+        manifests = manifest.Manifests(options)
 
-    return 0
+    if options.timings or options.timings_json:
+        timings.enable()
+    try:
+        if jobs > 1:
+            return process_files(args, options, jobs, manifests)
+
+        for pathname in args:
+            res = process_file(pathname, options, manifests)
+            if res:
+                return res
+
+        return 0
+    finally:
+        if manifests is not None:
+            manifests.save()
+        if options.timings or options.timings_json:
+            timings.finish(options.timings, options.timings_json)
 
 # vim: sw=4 ts=4 et si:
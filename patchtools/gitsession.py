@@ -0,0 +1,319 @@
+# vim: sw=4 ts=4 et si:
+"""
+Long-running git processes, shared by every lookup made against a repository
+"""
+
+import atexit
+import os
+import subprocess
+import threading
+import types
+from contextlib import contextmanager, suppress
+from pathlib import Path
+
+from patchtools import largepatch, timings
+from patchtools.command import decode_output
+
+DIFF_TREE_OPTIONS = ['--no-renames', '--pretty=email', '-r', '-p', '--cc', '--stat']
+RAW_OPTIONS = ['--no-renames', '-r', '--raw']
+
+# How many sessions a repository may have running at once, and a
+# semaphore with as many slots for one-off git commands
+_limits = types.SimpleNamespace(sessions=1, run_slots=threading.Semaphore(1))
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class GitSession:
+    """A 'git cat-file --batch-check' process and 'git diff-tree --stdin'
+    processes for a single repository.
+
+    The processes are started on first use and answer any number of
+    queries, so looking up a commit costs a pipe round-trip instead of
+    a shell and a fresh git process.
+    """
+    def __init__(self, repo):
+        self.repo = repo
+        self._check = None
+        # The 'git diff-tree --stdin' processes, by their arguments
+        self._diffs = {}
+        # diff-tree echoes any stdin line that isn't an object name, which
+        # tells us where the output for a commit ends.
+        self._sentinel = f'patchtools-{os.urandom(16).hex()}\n'.encode()
+
+    def _start(self, *args):
+        return subprocess.Popen(['git', *args], cwd=self.repo,  # noqa: S603, S607
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL)
+
+    @staticmethod
+    def _stop(proc):
+        if proc is None:
+            return
+        with suppress(OSError):
+            proc.stdin.close()
+        proc.wait()
+
+    def resolve(self, rev):
+        """Return the full hash of the commit 'rev' names, or None."""
+        if not rev or '\n' in rev:
+            return None
+        started = timings.start()
+        query = f'{rev}^{{commit}}\n'.encode()
+        try:
+            if self._check is None:
+                self._check = self._start('cat-file', '--batch-check')
+            self._check.stdin.write(query)
+            self._check.stdin.flush()
+            line = self._check.stdout.readline().decode()
+        except OSError:
+            line = ''
+        timings.command('git cat-file --batch-check', started, len(query), len(line))
+        if not line:
+            self._stop(self._check)
+            self._check = None
+            return None
+
+        # '<hash> commit <size>', or '<rev> missing' and the like
+        fields = line.split()
+        if fields[1:2] == ['commit']:
+            return fields[0]
+        return None
+
+    def _diff_tree(self, args, sha, limit=None):
+        """Return the output of 'git diff-tree --stdin' with 'args' for
+        the full hash 'sha': as text, or as a largepatch.LargePatch if
+        it's bigger than 'limit' bytes.
+        """
+        started = timings.start()
+        query = sha.encode() + b'\n' + self._sentinel
+        output = largepatch.Spill(limit)
+        proc = self._diffs.get(args)
+        try:
+            if proc is None:
+                if '--' in args:
+                    # Only keep a process for the latest paths asked for
+                    for key in [ key for key in self._diffs if '--' in key ]:
+                        self._stop(self._diffs.pop(key))
+                proc = self._diffs[args] = self._start('diff-tree', '--stdin', *args)
+            proc.stdin.write(query)
+            proc.stdin.flush()
+            first = True
+            for line in iter(proc.stdout.readline, b''):
+                if line == self._sentinel:
+                    break
+                # diff-tree separates each commit from the one before it
+                # with a blank line, which a one-off run would not print
+                if not first or line != b'\n':
+                    output.append(line)
+                first = False
+            else:
+                raise OSError('git diff-tree exited')
+        except OSError:
+            self._stop(self._diffs.pop(args, None))
+            output.close()
+            output = largepatch.Spill(limit)
+        timings.command('git diff-tree --stdin', started, len(query), output.size)
+        return output.result()
+
+    def diff_tree(self, sha, paths=None, limit=None):
+        """Return 'git diff-tree' output for the full hash 'sha', as a
+        largepatch.LargePatch if it's bigger than 'limit' bytes. With
+        'paths', only the files at or under those paths, from the top of
+        the tree, are diffed.
+        """
+        args = tuple(DIFF_TREE_OPTIONS)
+        if paths:
+            args += ('--', *(':(top,literal)' + path for path in paths))
+        return self._diff_tree(args, sha, limit)
+
+    def changed_files(self, sha):
+        """Return 'git diff-tree --raw' output, which lists the files the
+        commit with the full hash 'sha' changes. Merges list none.
+        """
+        return self._diff_tree(tuple(RAW_OPTIONS), sha)
+
+    def close(self):
+        self._stop(self._check)
+        for proc in self._diffs.values():
+            self._stop(proc)
+        self._check = None
+        self._diffs = {}
+
+
+class SessionPool:
+    """The sessions for one repository, plus answers that don't change
+    while we run.
+    """
+    def __init__(self, repo):
+        self.repo = repo
+        self._idle = []
+        self._count = 0
+        self._cond = threading.Condition()
+        self._answers = {}
+        self._answers_lock = threading.Lock()
+
+    def cached(self, key, compute):
+        """Return the answer stored under 'key', calling compute() for it
+        the first time. Other threads asking meanwhile wait for it.
+        """
+        with self._answers_lock:
+            if key not in self._answers:
+                self._answers[key] = compute()
+            return self._answers[key]
+
+    def forget(self):
+        """Drop the stored answers, which may be out of date by now."""
+        with self._answers_lock:
+            self._answers = {}
+
+    @contextmanager
+    def session(self):
+        with self._cond:
+            while not self._idle and self._count >= _limits.sessions:
+                self._cond.wait()
+            if self._idle:
+                git = self._idle.pop()
+            else:
+                git = GitSession(self.repo)
+                self._count += 1
+        try:
+            yield git
+        finally:
+            with self._cond:
+                self._idle.append(git)
+                self._cond.notify()
+
+    def run(self, *args, input=None, check=False):  # noqa: A002
+        """Run a one-off git command in this repository and return its output.
+
+        'input', if given, is written to the command's stdin. Failures
+        give empty output, unless 'check' is set, in which case they
+        raise OSError or subprocess.CalledProcessError.
+        """
+        data = input.encode() if input is not None else None
+        try:
+            with _limits.run_slots:
+                started = timings.start()
+                proc = subprocess.run(['git', *args], cwd=self.repo, check=False,  # noqa: S603, S607
+                                      input=data, stdout=subprocess.PIPE,
+                                      stderr=subprocess.DEVNULL)
+                timings.command('git ' + args[0], started, len(data or b''),
+                                len(proc.stdout))
+            if check:
+                proc.check_returncode()
+        except OSError:
+            if check:
+                raise
+            return ''
+        return decode_output(proc.stdout)
+
+    def stream(self, *args):
+        """Run a git command in this repository and yield its output a line
+        at a time, as git produces it.
+        """
+        started = timings.start()
+        try:
+            proc = subprocess.Popen(['git', *args], cwd=self.repo,  # noqa: S603, S607
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL)
+        except OSError:
+            return
+        received = 0
+        try:
+            for line in proc.stdout:
+                received += len(line)
+                yield decode_output(line)
+        finally:
+            # If we stopped early, git gets SIGPIPE on its next write
+            proc.stdout.close()
+            proc.wait()
+            timings.command('git ' + args[0], started, 0, received)
+
+    def close(self):
+        with self._cond:
+            for git in self._idle:
+                git.close()
+            self._count -= len(self._idle)
+            self._idle = []
+
+
+def git_dir(path):
+    """Return the git directory of the repository containing 'path', if any.
+
+    For worktrees this is the main repository's git directory, which is
+    where the config and the shared refs live.
+    """
+    path = os.path.abspath(path)
+    while True:
+        dotgit = os.path.join(path, '.git')
+        if os.path.isdir(dotgit):
+            return dotgit
+        if os.path.isfile(dotgit):
+            # worktrees and submodules: "gitdir: <path>"
+            try:
+                gitdir = Path(dotgit).read_text().split(':', 1)[1].strip()
+            except (OSError, IndexError):
+                return None
+            gitdir = os.path.join(path, gitdir)
+            try:
+                commondir = Path(gitdir, 'commondir').read_text()
+                gitdir = os.path.join(gitdir, commondir.strip())
+            except OSError:
+                pass
+            return gitdir
+        if os.path.isfile(os.path.join(path, 'HEAD')) and \
+           os.path.isfile(os.path.join(path, 'config')):
+            return path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def get_pool(repo):
+    """Return the session pool for 'repo', creating it if needed."""
+    with _pools_lock:
+        pool = _pools.get(repo)
+        if pool is None:
+            pool = _pools[repo] = SessionPool(repo)
+        return pool
+
+
+def session(repo):
+    """Context manager handing out an idle GitSession for 'repo'."""
+    return get_pool(repo).session()
+
+
+def set_max_sessions(count):
+    """Allow up to 'count' concurrent sessions per repository, and up to
+    'count' one-off git commands at once.
+
+    Call this before starting any threads that use git.
+    """
+    _limits.sessions = max(1, count)
+    _limits.run_slots = threading.Semaphore(_limits.sessions)
+
+
+def forget():
+    """Forget the answers every pool has stored, but keep the sessions.
+
+    A long-running process calls this between commands, since branches,
+    remotes and tags may have changed in the meantime.
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.forget()
+
+
+def close_sessions():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+atexit.register(close_sessions)
@@ -0,0 +1,240 @@
+# vim: sw=4 ts=4 et si:
+"""
+Patches too large to keep in memory
+
+A patch bigger than 'large-patch' in patch.cfg is handled in large-patch
+mode. Its email header and commit message are parsed as those of any
+other patch are, but the diff after them stays as bytes in a file:
+git's output, spilled to a temporary file as it arrives, or the patch
+file being fixed. The file is mapped with mmap, so its pages are only
+read when they're needed, and can be dropped again.
+
+A LargeBody is the diff, as a list of pieces: ranges of the mapped
+file, and short runs of bytes of our own. Filtering it keeps ranges
+instead of copying them, its diffstat is counted a line at a time, the
+combined diff of a merge is converted one file at a time, and writing
+it copies the pieces straight to the output file. What's held in memory
+depends on the size of the commit message, and of the largest file
+diff of a merge, not on the size of the patch.
+
+The diff is copied byte for byte, with its line endings as they are,
+and it's left alone when the patch is signed: only the commit message
+gets the Acked-by or Signed-off-by.
+"""
+
+import mmap
+import os
+import re
+import tempfile
+from pathlib import Path
+
+from patchtools import combined, diffstat
+from patchtools.command import decode_output
+
+# The same as patchtools.payload's, for bytes
+_patch_start_re = re.compile(rb'^(?:(?:---|\*\*\*|Index:)[ \t][^ \t\n]|diff -|index [0-9a-f]{7})',
+                             re.MULTILINE)
+_filename_re = re.compile(rb'^\+\+\+ [^/\n]+/(\S+)', re.MULTILINE)
+_separator_re = re.compile(rb'^---$', re.MULTILINE)
+_file_start_re = re.compile(rb'^diff ', re.MULTILINE)
+_combined_start_re = re.compile(rb'^@@@', re.MULTILINE)
+
+# How much to copy from the mapped file at a time
+COPY_SIZE = 1 << 20
+
+
+class LargePatch:
+    """The text of a large patch, mapped from the file 'f', which must
+    be open for reading bytes and is closed.
+    """
+    def __init__(self, f):
+        with f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.map)
+
+    def split(self):
+        """Return (text, body): the text up to the first line that starts
+        a diff, decoded, and a LargeBody of the rest.
+        """
+        headers_end = self.map.find(b'\n\n')
+        m = _patch_start_re.search(self.map, max(headers_end, 0))
+        start = m.start() if m else len(self.map)
+        return (decode_output(self.map[:start]),
+                LargeBody([ (self.map, start, len(self.map)) ]))
+
+
+class LargeSegment:
+    """Like a payload.Segment: the pieces of a LargeBody from one
+    patch-start line to the next, and the file name from the last '+++'
+    line among them.
+    """
+    __slots__ = ('filename', 'pieces')
+
+    def __init__(self):
+        self.pieces = []
+        self.filename = None
+
+
+class LargeBody:
+    """The diff of a large patch, as a list of (buffer, start, end)
+    pieces. Every piece but the last ends with a whole line.
+    """
+    def __init__(self, pieces):
+        self.pieces = [ piece for piece in pieces if piece[2] > piece[1] ]
+
+    def __len__(self):
+        return sum(end - start for (buf, start, end) in self.pieces)
+
+    def _has_line(self, regex):
+        # Every piece starts a line, which '^' sees in a buffer of ours
+        # and after the "\n" before it in the mapped file
+        return any(regex.search(buf, start, end) for (buf, start, end) in self.pieces)
+
+    def has_combined_hunks(self):
+        return self._has_line(_combined_start_re)
+
+    def has_separator(self):
+        return self._has_line(_separator_re)
+
+    def segments(self):
+        """Return the LargeSegments of the body, in order."""
+        segments = []
+        current = None
+        for (buf, start, end) in self.pieces:
+            starts = [ m.start() for m in _patch_start_re.finditer(buf, start, end) ]
+            names = [ (m.start(), m.group(1)) for m in _filename_re.finditer(buf, start, end) ]
+            position = start
+            for at in [ *starts, end ]:
+                if at > position and current is not None:
+                    current.pieces.append((buf, position, at))
+                    for (name_at, name) in names:
+                        if position <= name_at < at:
+                            current.filename = name.decode('utf-8', 'replace')
+                if at < end:
+                    current = LargeSegment()
+                    segments.append(current)
+                position = at
+        return segments
+
+    @staticmethod
+    def joined(segments):
+        """Return a LargeBody of 'segments', each followed by a blank
+        line, as Patch.filter() joins them.
+        """
+        pieces = []
+        for segment in segments:
+            pieces += segment.pieces
+            pieces.append((b'\n', 0, 1))
+        return LargeBody(pieces)
+
+    def to_unified(self):
+        """Return the body with the combined diff of every file in it
+        turned into unified hunks against the first parent.
+        """
+        pieces = []
+        for (buf, start, end) in self.pieces:
+            starts = [ m.start() for m in _file_start_re.finditer(buf, start, end) ]
+            for (first, last) in zip([ start, *starts ], [ *starts, end ]):  # noqa: B905
+                if first == last:
+                    continue
+                if _combined_start_re.search(buf, first, last):
+                    text = bytes(buf[first:last]).decode('utf-8', 'surrogateescape')
+                    text = combined.to_unified(text).encode('utf-8', 'surrogateescape')
+                    pieces.append((text, 0, len(text)))
+                else:
+                    pieces.append((buf, first, last))
+        return LargeBody(pieces)
+
+    def lines(self):
+        """Yield the lines of the body, decoded, as str.split('\\n') would."""
+        partial = b''
+        for (buf, start, end) in self.pieces:
+            position = start
+            while True:
+                newline = buf.find(b'\n', position, end)
+                if newline < 0:
+                    partial += buf[position:end]
+                    break
+                yield (partial + buf[position:newline]).decode('utf-8', 'replace')
+                partial = b''
+                position = newline + 1
+        yield partial.decode('utf-8', 'replace')
+
+    def diffstat(self):
+        """Return the diffstat of the body, as patchops.get_diffstat() would."""
+        return diffstat.format_stats(diffstat.parse_lines(self.lines()))
+
+    def write(self, f):
+        """Write the body to the binary file 'f'."""
+        for (buf, start, end) in self.pieces:
+            for position in range(start, end, COPY_SIZE):
+                f.write(buf[position:min(position + COPY_SIZE, end)])
+
+
+def read_file(pathname, limit):
+    """Return the text of the file 'pathname', or a LargePatch of it if
+    it's bigger than 'limit' bytes.
+    """
+    with Path(pathname).open('rb') as f:
+        if os.fstat(f.fileno()).st_size > max(limit, 0):
+            return LargePatch(f)
+    return Path(pathname).read_text()
+
+
+class Spill:
+    """Collects output a line at a time, in memory until there's more
+    than 'limit' bytes of it, and then in a temporary file.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.size = 0
+        self._buffer = bytearray()
+        self._file = None
+
+    def append(self, line):
+        self.size += len(line)
+        if self._file is not None:
+            self._file.write(line)
+            return
+        self._buffer += line
+        if self.limit is not None and self.size > self.limit:
+            # Closed by close(), or by the LargePatch result() returns
+            self._file = tempfile.TemporaryFile(prefix='patchtools-')  # noqa: SIM115
+            self._file.write(self._buffer)
+            self._buffer = bytearray()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def result(self):
+        """Return what was collected, decoded, or as a LargePatch if it
+        was spilled.
+        """
+        if self._file is None:
+            return decode_output(self._buffer)
+        self._file.flush()
+        return LargePatch(self._file)
+
+
+def print_patch(text, body, f):
+    """Write 'text', then the LargeBody 'body' if it isn't None, to the
+    text file 'f', followed by a newline, as print() would.
+    """
+    if body is None:
+        print(text, file=f)
+        return
+    f.write(text)
+    f.flush()
+    out = getattr(f, 'buffer', None)
+    if out is not None:
+        body.write(out)
+        out.flush()
+    else:
+        for (buf, start, end) in body.pieces:
+            for position in range(start, end, COPY_SIZE):
+                f.write(bytes(buf[position:min(position + COPY_SIZE, end)])
+                        .decode('utf-8', 'surrogateescape'))
+    f.write('\n')
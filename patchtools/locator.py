@@ -0,0 +1,111 @@
+# vim: sw=4 ts=4 et si:
+"""
+Find which of the search repositories holds a commit
+
+Every repository is asked at once, with the 'git cat-file --batch-check'
+of its session, which is far cheaper than producing the diff. Clones
+that see exactly the same objects, such as worktrees of one repository
+or clones sharing everything through alternates, are only asked once.
+"""
+
+import os
+import threading
+import types
+from pathlib import Path
+
+from patchtools import commitcache, gitsession
+
+# The thread pool the probes run in, once there's been a need for one
+_shared = types.SimpleNamespace(executor=None)
+_lock = threading.Lock()
+
+# (commit, repos) -> (repo, sha)
+_owners = {}
+# repo -> the object directories it can see
+_stores = {}
+
+
+def object_store(repo):
+    """Return the object directories 'repo' can read from, including
+    those it borrows through alternates, as a frozenset.
+    """
+    with _lock:
+        if repo in _stores:
+            return _stores[repo]
+
+    gitdir = gitsession.git_dir(repo)
+    dirs = []
+    if gitdir is not None:
+        todo = [ os.path.join(gitdir, 'objects') ]
+        while todo:
+            path = os.path.realpath(todo.pop())
+            if path in dirs:
+                continue
+            dirs.append(path)
+            try:
+                alternates = Path(path, 'info', 'alternates').read_text()
+                todo.extend(os.path.join(path, line) for line in alternates.splitlines()
+                            if line and not line.startswith('#'))
+            except OSError:
+                pass
+    # Without a git directory we can't tell, so it's its own store
+    store = frozenset(dirs) or frozenset([ repo ])
+
+    with _lock:
+        _stores[repo] = store
+    return store
+
+
+def _probe(repo, commit):
+    return commitcache.lookup(commit, repo).sha
+
+
+def _get_executor():
+    # Only needed with more than one distinct repository to search
+    import concurrent.futures  # noqa: PLC0415
+    with _lock:
+        if _shared.executor is None:
+            _shared.executor = concurrent.futures.ThreadPoolExecutor(
+                                thread_name_prefix='patchtools-locator')
+        return _shared.executor
+
+
+def locate(commit, repos):
+    """Return (repo, full hash) for the first of 'repos' that has the
+    commit 'commit', or (None, None) if none of them do.
+    """
+    key = (commit, tuple(repos))
+    with _lock:
+        if key in _owners:
+            return _owners[key]
+
+    # One probe per distinct object store, made by its first repository
+    probes = {}
+    for repo in repos:
+        probes.setdefault(object_store(repo), repo)
+
+    if len(probes) > 1:
+        executor = _get_executor()
+        futures = { store : executor.submit(_probe, repo, commit)
+                    for (store, repo) in probes.items() }
+        found = { store : future.result() for (store, future) in futures.items() }
+    else:
+        found = { store : _probe(repo, commit) for (store, repo) in probes.items() }
+
+    owner = (None, None)
+    for repo in repos:
+        sha = found[object_store(repo)]
+        if sha:
+            owner = (repo, sha)
+            break
+
+    with _lock:
+        _owners[key] = owner
+    return owner
+
+
+def forget():
+    """Forget which repositories had which commits, and what they share."""
+    with _lock:
+        _owners.clear()
+        _stores.clear()
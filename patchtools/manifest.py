@@ -0,0 +1,150 @@
+# vim: sw=4 ts=4 et si:
+"""
+The manifests fixpatch --manifest keeps in patch directories
+
+A directory's '.fixpatch-manifest' has an entry for every patch in it
+that fixpatch has written, or found already fixed, under the name it
+ended up with: the hash of its contents, and the state its headers were
+worked out from. That is the options and the configuration that change
+the output, and, for a patch with a commit, the repository that has the
+commit, its remote URL and its release tags. A patch whose contents and
+state haven't changed is as fixpatch would leave it, so it's skipped
+without being read as a patch.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from contextlib import suppress
+from pathlib import Path
+
+from patchtools import cache, config, exportcache, patchops
+
+MANIFEST_NAME = '.fixpatch-manifest'
+
+# Bump when the manifest layout or the patch text we produce changes
+MANIFEST_VERSION = 1
+
+# How much of a patch file to hash at a time
+READ_SIZE = 1 << 20
+
+
+def file_hash(pathname):
+    """Return the SHA-256 of the contents of the file 'pathname'."""
+    digest = hashlib.sha256()
+    with Path(pathname).open('rb') as f:
+        for block in iter(lambda: f.read(READ_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def options_state(options):
+    """Return a digest of everything but the patch and its repository
+    that goes into what fixpatch writes, with 'options'.
+    """
+    identity = [ config.name, config.email, config.emails, config.get_repos(),
+                 config.get_mainline_repos(), config.large_patch_size ]
+    output = [ options.no_ack, options.no_diffstat, options.no_rename,
+               options.header_only, options.reference, options.signed_off_by,
+               options.mainline, options.suffix ]
+    return cache.key_name(MANIFEST_VERSION, json.dumps(identity), json.dumps(output))
+
+
+def commit_state(commit):
+    """Return what the headers of a patch of 'commit' are worked out from
+    in the repository that has it, or None if none of them do.
+    """
+    if not commit:
+        return None
+    repo = patchops.find_commit_repo(commit, config.get_repos(), True)
+    if repo is None:
+        return None
+    return [ os.path.realpath(repo), patchops.get_git_repo_url(repo),
+             exportcache.tags_fingerprint(repo) ]
+
+
+class Manifest:
+    """The manifest of the patch directory 'dirname'."""
+    def __init__(self, dirname):
+        self.path = os.path.join(dirname or '.', MANIFEST_NAME)
+        data = cache.load_json(self.path)
+        if data and data.get('version') == MANIFEST_VERSION:
+            self.patches = data.get('patches', {})
+        else:
+            self.patches = {}
+        self.changed = False
+
+    def is_fixed(self, pathname, state):
+        """Return True if the file 'pathname' is as fixpatch, with the
+        options 'state' stands for, last left it.
+        """
+        entry = self.patches.get(os.path.basename(pathname))
+        if entry is None or entry.get('state') != state:
+            return False
+        try:
+            if entry.get('hash') != file_hash(pathname):
+                return False
+        except OSError:
+            return False
+        return entry.get('repo') == commit_state(entry.get('commit'))
+
+    def record(self, pathname, state, commit, old_pathname=None):
+        """Record the file 'pathname' as fixed, for a patch of 'commit'
+        (or None). 'old_pathname' is the file it was fixed from.
+        """
+        if old_pathname is not None and old_pathname != pathname:
+            self.patches.pop(os.path.basename(old_pathname), None)
+        self.patches[os.path.basename(pathname)] = {
+            'hash' : file_hash(pathname),
+            'state' : state,
+            'commit' : commit,
+            'repo' : commit_state(commit),
+        }
+        self.changed = True
+
+    def save(self):
+        """Write the manifest out if it has changed, dropping the entries
+        of patches that are gone.
+        """
+        dirname = os.path.dirname(self.path)
+        for name in [ name for name in self.patches
+                      if not os.path.exists(os.path.join(dirname, name)) ]:
+            del self.patches[name]
+            self.changed = True
+        if self.changed:
+            cache.store_json(self.path, { 'version' : MANIFEST_VERSION,
+                                          'patches' : self.patches })
+            # It lives with the patches, not in a private cache
+            with suppress(OSError):
+                os.chmod(self.path, 0o644)
+            self.changed = False
+
+
+class Manifests:
+    """The manifests of the directories of the patches one fixpatch run
+    fixes, read as they're first needed.
+    """
+    def __init__(self, options):
+        self.state = options_state(options)
+        self._manifests = {}
+        self._lock = threading.Lock()
+
+    def get(self, pathname):
+        """Return the Manifest of the directory of 'pathname'."""
+        dirname = os.path.dirname(pathname)
+        with self._lock:
+            manifest = self._manifests.get(dirname)
+            if manifest is None:
+                manifest = self._manifests[dirname] = Manifest(dirname)
+            return manifest
+
+    def is_fixed(self, pathname):
+        return self.get(pathname).is_fixed(pathname, self.state)
+
+    def record(self, pathname, commit, old_pathname=None):
+        self.get(pathname).record(pathname, self.state, commit, old_pathname)
+
+    def save(self):
+        for manifest in self._manifests.values():
+            manifest.save()
@@ -0,0 +1,56 @@
+# vim: sw=4 ts=4 et si:
+"""
+Run work on a pool of threads, handing back the results in order
+"""
+
+import collections
+import io
+import itertools
+import os
+
+
+def job_count(jobs):
+    """Turn a --jobs value into a number of threads; 0 means one per CPU."""
+    if jobs > 0:
+        return jobs
+    return os.cpu_count() or 1
+
+
+def ordered_map(func, items, jobs):
+    """Call func(item) for each of 'items' on up to 'jobs' threads and
+    yield the results in the order of 'items'.
+
+    Only a few items per thread are started ahead of the result being
+    yielded, so finished results don't pile up behind a slow one.
+    Closing the generator early cancels everything not yet started.
+    """
+    # Imported here, so that commands run with a single job don't pay for it
+    import concurrent.futures  # noqa: PLC0415
+    window = jobs * 4
+    items = iter(items)
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        def submit(count):
+            for item in itertools.islice(items, count):
+                pending.append(pool.submit(func, item))
+
+        try:
+            submit(window)
+            while pending:
+                future = pending.popleft()
+                submit(1)
+                yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def buffered(func, *args):
+    """Call func(*args, err) with a buffer for 'err'.
+
+    Return (result, text written to err), so that messages from a job
+    can be printed when its result is used rather than when it ran.
+    """
+    err = io.StringIO()
+    result = func(*args, err)
+    return (result, err.getvalue())
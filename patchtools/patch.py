@@ -4,16 +4,14 @@ Support package for doing SUSE Patch operations
 """
 
 import patchtools.patchops as patchops
-from patchtools import config, PatchException
+from patchtools import combined, config, largepatch, pathmatch, timings, PatchException
+from patchtools.payload import Payload, Segment, join_lines
 import re
 import os
 import os.path
 import email.parser
-import urllib.request, urllib.parse, urllib.error
+import urllib.parse
 from urllib.parse import urlparse
-import string
-
-_patch_start_re = re.compile(r"^(---|\*\*\*|Index:)[ \t][^ \t]|^diff -|^index [0-9a-f]{7}")
 
 class InvalidCommitIDException(PatchException):
     pass
@@ -35,6 +33,12 @@ class Patch:
         self.force = force
         self.repourl = None
         self.message = None
+        self._payload = None
+        # The diff of a large patch, a largepatch.LargeBody, which
+        # isn't in the message
+        self.large = None
+        # (paths, partial) when git only diffed the files under paths
+        self._limited = None
         self.repo_list = config.get_repos()
         self.mainline_repo_list = config.get_mainline_repos()
         self.in_mainline = False
@@ -46,20 +50,26 @@ class Patch:
         if commit and (re.search(r"\^", commit) or re.search(r"HEAD", commit)):
             raise InvalidCommitIDException("Commit IDs must be hashes, not relative references. HEAD and ^ are not allowed.")
 
-    def add_diffstat(self):
-        for line in self.message.get_payload().splitlines():
-            if re.search(r"[0-9]+ files? changed, [0-9]+ insertion", line):
-                return
+    def payload(self):
+        """Return the parsed payload, parsing it only if it has changed."""
+        text = self.message.get_payload()
+        if self._payload is None or self._payload[0] is not text:
+            self._payload = (text, Payload.parse(text))
+        return self._payload[1]
 
-        diffstat = patchops.get_diffstat(self.body())
-        text = ""
-        switched = False
-        need_sep = True
-        body = ""
+    def set_payload(self, payload):
+        text = payload.text
+        self.message.set_payload(text)
+        self._payload = (text, payload)
+
+    @timings.timed('diffstat')
+    def add_diffstat(self):
+        payload = self.payload()
+        if payload.has_diffstat():
+            return
 
-        for line in self.header().splitlines():
-            if re.match(r"^---$", line) and not switched:
-                need_sep = False
+        diffstat = self.large.diffstat() if self.large is not None else patchops.get_diffstat(payload.body)
+        need_sep = '---' not in payload.header_lines()
 
         if need_sep:
             diffstat = "---\n" + diffstat
@@ -67,23 +77,26 @@ class Patch:
             diffstat = "\n" + diffstat
         diffstat += "\n"
 
-        header = self.header().rstrip() + "\n"
-        self.message.set_payload(header + diffstat + self.body())
+        header = payload.header.rstrip() + '\n'
+        self.set_payload(payload.with_header(header + diffstat))
 
     def strip_diffstat(self):
-        text = ""
-        eat = ""
-        for line in self.header().splitlines():
+        payload = self.payload()
+        lines = []
+        eat = []
+        for line in payload.header_lines():
             if re.search(r"#? .* \| ", line):
-                eat = eat + line + "\n"
+                eat.append(line)
                 continue
             if re.match(r"#? .* files? changed(, .* insertions?\(\+\))?(, .* deletions?\(-\))?", line):
-                eat = ""
+                eat = []
                 continue
-            text += eat + line + "\n"
-            eat = ""
+            lines += eat
+            lines.append(line)
+            eat = []
 
-        self.message.set_payload(text + "\n" + self.body())
+        lines.append('')
+        self.set_payload(payload.with_header(join_lines(lines)))
 
     def update_diffstat(self):
         self.strip_diffstat()
@@ -103,31 +116,47 @@ class Patch:
             newrefs.sort()
             self.message.add_header('References', ' '.join(newrefs))
 
-    def add_signature(self, sob=False):
-        for line in self.message.get_payload().splitlines():
-            for email in config.emails:
-                if re.search(r"Acked-by.*%s" % email, line) or \
-                   re.search(r"Signed-off-by.*%s" % email, line):
-                    return
-
-        text = ""
+    @staticmethod
+    def _sign_lines(lines, signature):
+        """Insert 'signature' before every '---' line in 'lines'."""
+        text = []
         last = ""
-        for line in self.message.get_payload().splitlines():
-            if re.match(r"^---$", line):
-                text = text.rstrip() + "\n"
+        for line in lines:
+            if line == '---':
+                # Same as rstrip()ing everything we have so far
+                while text and not text[-1].strip():
+                    text.pop()
+                if text:
+                    text[-1] = text[-1].rstrip()
+                else:
+                    text.append('')
 
                 # If this is the first *-by tag, separate it
                 if not re.search(r"-by: ", last):
-                    text += "\n"
-                if sob:
-                    tag = "Signed-off-by"
-                else:
-                    tag = "Acked-by"
-                text += "%s: %s <%s>\n" % (tag, config.name, config.email)
-            text += line + "\n"
+                    text.append('')
+                text.append(signature)
+            text.append(line)
             last = line
+        return text
 
-        self.message.set_payload(text)
+    @timings.timed('signature')
+    def add_signature(self, sob=False):
+        payload = self.payload()
+        for address in config.emails:
+            if re.search(f'Acked-by.*{address}', payload.text) or \
+               re.search(f'Signed-off-by.*{address}', payload.text):
+                return
+
+        tag = 'Signed-off-by' if sob else 'Acked-by'
+        signature = f'{tag}: {config.name} <{config.email}>'
+
+        if payload.has_separator_in_body():
+            # Rare enough that we don't bother keeping the body intact
+            lines = Patch._sign_lines(payload.text.splitlines(), signature)
+            self.set_payload(Payload.parse(join_lines(lines)))
+        else:
+            lines = Patch._sign_lines(payload.header_lines(), signature)
+            self.set_payload(payload.with_header(join_lines(lines)))
 
     def add_mainline(self, tag):
         """Add or create a 'Patch-mainline' header, with 'tag'."""
@@ -137,8 +166,14 @@ class Patch:
             self.message.add_header('Patch-mainline', ' '.join(tag))
 
     def from_email(self, msg):
-        p = email.parser.Parser()
-        self.message = p.parsestr(msg)
+        """Load the patch from the text 'msg', or a largepatch.LargePatch."""
+        self.large = None
+        if isinstance(msg, largepatch.LargePatch):
+            (msg, self.large) = msg.split()
+        with timings.phase('parse'):
+            p = email.parser.Parser()
+            self.message = p.parsestr(msg)
+        self._payload = None
 
         if 'Git-commit' in self.message:
             self.commit = self.message['Git-commit']
@@ -189,9 +224,19 @@ class Patch:
         self.handle_merge()
 
     def from_file(self, pathname):
-        f = open(pathname, "r")
-        self.from_email(f.read())
-        f.close()
+        with timings.phase('read'):
+            msg = largepatch.read_file(pathname, config.large_patch_size)
+        self.from_email(msg)
+
+    def as_string(self):
+        """Return the patch as text. A large patch's diff isn't in it:
+        write() is the way to get all of it.
+        """
+        return self.message.as_string(unixfrom=False)
+
+    def write(self, f):
+        """Write the patch, and a newline, to the text file 'f'."""
+        largepatch.print_patch(self.as_string(), self.large, f)
 
     def files(self):
         diffstat = patchops.get_diffstat(self.body())
@@ -204,15 +249,36 @@ class Patch:
                 return None
             return f
 
-    def find_commit(self):
-        for repo in self.repo_list:
+    def find_commit(self, extract=None):
+        """Find the commit and load its patch. If 'extract' is given, the
+        patch is about to be filtered with it, and git may be asked for
+        only the files it keeps.
+        """
+        repo = patchops.find_commit_repo(self.commit, self.repo_list, self.force)
+        if repo is None:
+            return False
+
+        limited = None
+        if extract:
+            limited = patchops.get_limited_commit(self.commit, repo, extract, self.force)
+        if limited is not None:
+            (commit, partial) = limited
+        else:
             commit = patchops.get_commit(self.commit, repo, self.force)
-            if commit is not None:
-                self.commit = patchops.canonicalize_commit(self.commit, repo)
-                self.repo = repo
-                self.from_email(commit)
-                return True
-        return False
+            if commit is None:
+                return False
+
+        self.commit = patchops.canonicalize_commit(self.commit, repo)
+        self.repo = repo
+        self.from_email(commit)
+        if self.message['Git-commit'] == self.commit:
+            # The header has always ended with the newline of
+            # 'git show --pretty=%H', which puts the " (partial)" that
+            # filter() adds on a line of its own
+            self.message.replace_header('Git-commit', self.commit + '\n')
+        if limited is not None:
+            self._limited = (list(extract), partial)
+        return True
 
     def parse_commitdiff_header(self):
         url = self.message['X-Git-Url']
@@ -238,9 +304,10 @@ class Patch:
             self.commit = args['h']
         del self.message['X-Git-Url']
 
-    def get_pathname(self, dirname=None, prefix="", suffix="", truncate=64):
-        if self.message and self.message['Subject']:
-            filename = patchops.safe_filename(self.message['Subject'])
+    @staticmethod
+    def pathname_for(subject, dirname=None, prefix='', suffix='', truncate=64):
+        if subject:
+            filename = patchops.safe_filename(subject)
             truncate_chars = truncate - len(filename) - len(prefix + suffix)
             if truncate_chars < 0:
                 filename = filename[0:truncate_chars]
@@ -251,6 +318,10 @@ class Patch:
         else:
             raise InvalidPatchException("Patch contains no Subject line")
 
+    def get_pathname(self, dirname=None, prefix='', suffix='', truncate=64):
+        subject = self.message['Subject'] if self.message else None
+        return Patch.pathname_for(subject, dirname, prefix, suffix, truncate)
+
     def find_repo(self):
         if self.message['Git-repo'] or self.in_mainline:
             return True
@@ -260,199 +331,89 @@ class Patch:
             return True
 
         if self.commit:
-            commit = None
-            for repo in self.repo_list:
-                commit = patchops.get_commit(self.commit, repo, self.force)
-                if commit:
-                    r = self.repourl
-                    if not r:
-                            r = patchops.get_git_repo_url(self.repo)
-                    if r and r in self.mainline_repo_list:
-                        self.in_mainline = True
-                    else:
-                        self.repo = repo
-                    return True
+            repo = patchops.find_commit_repo(self.commit, self.repo_list, self.force)
+            if repo is not None:
+                r = self.repourl
+                if not r:
+                        r = patchops.get_git_repo_url(self.repo)
+                if r and r in self.mainline_repo_list:
+                    self.in_mainline = True
+                else:
+                    self.repo = repo
+                return True
 
         return False
 
     def extract(self, paths):
-        text = ""
-        chunk = ""
-        for line in self.message.get_payload().splitlines():
-            if _patch_start_re.match(line):
-                text += chunk
-                chunk = ""
-            chunk += line + "\n"
-
-        text += chunk
-        return text
+        return self.payload().text
 
     def header(self):
-        in_body = False
-        ret = ""
-        for line in self.message.get_payload().splitlines():
-            if not in_body:
-                if _patch_start_re.match(line):
-                    in_body = True
-                    continue
-                ret += line + "\n"
-            else:
-                break
-        return ret
+        return self.payload().header
 
     def body(self):
-        in_body = False
-        ret = ""
-        for line in self.message.get_payload().splitlines():
-            if not in_body:
-                if _patch_start_re.match(line):
-                    in_body = True
-                    ret += line + "\n"
-            else:
-                ret += line + "\n"
-        return ret
+        return self.payload().body
 
     @staticmethod
     def file_in_path(filename, paths):
-        if filename in paths:
-            return True
-        for f in paths:
-            if f[-1:] == '/' and f in filename:
-                return True
-        return False
-
-    @staticmethod
-    def shrink_chunk(chunk):
-        n = -1
-        text = ""
-        start = -1
-        end = -1
-        lines = []
-        added = 0
-        removed = 0
-        count = 0
-        lines = chunk.splitlines()
-        debug = False
-        for line in lines:
-            n += 1
-            if re.match(r"^-", line):
-                if start < 0:
-                    start = n - 3 # count this line
-                    if start < 0:
-                        if debug:
-                            print("resetting start(1) (%d, %d)" % (start, n))
-                            print("----")
-                            print(chunk)
-                            print("----")
-                        start = 0
-
-                removed += 1
-                count = 0
-            elif re.match(r"^\+", line):
-                if start < 0:
-                    start = n - 3 # count this line
-                    if start < 0:
-                        if debug:
-                            print("resetting start(2) (%d, %d)" % (start, n))
-                            print("----")
-                            print(chunk)
-                            print("----")
-                        start = 0
-
-                added += 1
-                count = 0
-            else:
-                count += 1
-                if start >= 0 and end < 0 and (count > 3 or n +1 == len(lines)):
-                    end = n # count this line
-                    if end >= len(lines):
-                        if debug:
-                            print("Truncating end")
-                            print("----")
-                            print(chunk)
-                            print("----")
-                        end = len(lines) - 1
-
-            if start >= 0 and end >= 0:
-                diff = end - start
-                text +=  "@@ -%d,%d +%d,%d @@\n" % \
-                    (start + 1, diff - added, start + 1, diff - removed)
-                text += "\n".join(lines[start:end])
-                text += '\n'
-                end = -1
-                start = -1
-                added = 0
-                removed = 0
-
-        return text
+        return pathmatch.get_matcher(paths).match(filename)
 
+    @timings.timed('merge')
     def handle_merge(self):
-        body = ""
-        chunk = ""
-        text = ""
-        
-        in_chunk = False
-        in_patch = False
-        lines = self.body().splitlines()
-        for line in lines:
-            if _patch_start_re.match(line):
-                if in_chunk:
-                    text += Patch.shrink_chunk(chunk)
-                    chunk = ""
-                else:
-                    chunk += line + "\n"
-                in_patch = True
-                in_chunk = False
-            elif re.match(r"^@@@", line):
-                if in_chunk:
-                    text += Patch.shrink_chunk(chunk)
-                else:
-                    text += chunk
-                chunk = ""
-                in_chunk = True
-            else:
-                if in_chunk:
-                    if line[1] == ' ' or line[1] == '+':
-                        chunk += line[0:1] + line[2:] + "\n"
-                else:
-                    chunk += line + "\n"
-
-        if in_chunk:
-            text += Patch.shrink_chunk(chunk)
-        else:
-            text += chunk
-
-        self.message.set_payload(self.header() + text)
-
+        """Turn the combined diff of a merge commit into a unified diff
+        against its first parent. Other patches are left alone.
+        """
+        if self.large is not None and self.large.has_combined_hunks():
+            self.large = self.large.to_unified()
+        payload = self.payload()
+        if payload.has_combined_hunks():
+            payload = Payload(payload.header, combined.to_unified(payload.body))
+        if payload.text is not self.message.get_payload():
+            # Store the payload as parsed, with its lines ending in "\n"
+            self.set_payload(payload)
+
+    @timings.timed('filter')
     def filter(self, files, exclude=False):
         is_empty = False
-        body = ""
-        chunk = ""
-        filename = None
+        payload = self.payload()
+        chunks = []
+        segments = []
+        offset = 0
         partial = False
-
-        for line in self.body().splitlines():
-            if _patch_start_re.match(line):
-                if filename:
-                    if exclude ^ Patch.file_in_path(filename, files):
-                        body += chunk + "\n"
-                    else:
-                        partial = True
-                    filename = None
-                chunk = ""
-            chunk += line + "\n"
-
-            m = re.match(r"^\+\+\+ [^/]+/(\S+)", line)
-            if m:
-                filename = m.group(1)
-
-        if filename and exclude ^ Patch.file_in_path(filename, files):
-            body += chunk + "\n"
-
-        self.message.set_payload(self.header() + body)
-
-        if body == "":
-            is_empty = True
+        if not exclude and self._limited is not None and self._limited[0] == list(files):
+            # The files git left out aren't here to be dropped
+            partial = self._limited[1]
+        self._limited = None
+        matcher = pathmatch.get_matcher(files)
+
+        all_segments = self.large.segments() if self.large is not None else payload.segments
+        kept = []
+        last = len(all_segments) - 1
+        for i, segment in enumerate(all_segments):
+            if not segment.filename:
+                continue
+            if exclude ^ matcher.match(segment.filename):
+                kept.append(segment)
+            elif i != last:
+                # The last file being dropped has never marked the
+                # patch as partial.
+                partial = True
+
+        if self.large is not None:
+            self.large = largepatch.LargeBody.joined(kept)
+            is_empty = len(self.large) == 0
+        else:
+            for segment in kept:
+                chunk = payload.segment_text(segment) + '\n'
+                chunks.append(chunk)
+                segments.append(Segment(offset, offset + len(chunk),
+                                        segment.filename))
+                offset += len(chunk)
+
+            body = ''.join(chunks)
+            self.set_payload(Payload(payload.header, body, segments))
+
+            if body == '':
+                is_empty = True
 
         if partial:
             commit = self.message['Git-commit']
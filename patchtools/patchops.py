@@ -4,11 +4,26 @@ Support package for doing SUSE Patch operations
 """
 
 from patchtools import PatchException
-from patchtools.command import run_command
+from patchtools import backend, cache, commitcache, diffstat, gitsession, locator
+from patchtools import pathmatch, tagindex, timings
+import os
 import re
+import threading
+
+_v2_version_re = re.compile(r'v2\.(\d+)\.(\d+)(\.(\d+)|-rc(\d+)|)')
+_version_re = re.compile(r'v(\d+)\.(\d+)(-rc(\d+)|)')
+_last_tag_re = re.compile(r'v([0-9]+)\.([0-9]+)(|-rc([0-9]+))$')
+
+# How many of the files left out of a limited diff to count the lines
+# of at a time, until one of them shows the patch is partial
+LINE_COUNT_BATCH = 8
+
+# repo -> (ref stamps, sorted tags, next release)
+_release_tags = {}
+_release_tags_lock = threading.Lock()
 
 def key_version(tag):
-    m = re.match(r"v2\.(\d+)\.(\d+)(\.(\d+)|-rc(\d+)|)", tag)
+    m = _v2_version_re.match(tag)
     if m:
         major = 2
         minor = int(m.group(1))
@@ -21,7 +36,7 @@ def key_version(tag):
 
     # We purposely ignore x.y.z tags since those are from -stable and
     # will never be used in a mainline tag.
-    m = re.fullmatch(r"v(\d+)\.(\d+)(-rc(\d+)|)", tag)
+    m = _version_re.fullmatch(tag)
     if m:
         major = int(m.group(1))
         minor = int(m.group(2))
@@ -34,9 +49,18 @@ def key_version(tag):
 class LocalCommitException(PatchException):
     pass
 
+@timings.timed('tag lookup')
 def get_tag(commit, repo):
-    command = f"(cd {repo};git name-rev --refs=refs/tags/v[0-9]* {commit})"
-    tag = run_command(command)
+    index = tagindex.get_index(repo, key_version)
+    if index is not None:
+        sha = commitcache.lookup(commit, repo).sha
+        if sha is None:
+            return None
+        tag = index.lookup(sha)
+        if tag is not None:
+            return tag
+
+    tag = backend.get_backend(repo).name_rev(commit)
     if tag == "":
         return None
 
@@ -48,17 +72,59 @@ def get_tag(commit, repo):
         return m.group(1)
     return None
 
+def _tag_stamps(repo):
+    """Stamps that change whenever a tag in 'repo' is added, moved or removed."""
+    gitdir = gitsession.git_dir(repo)
+    if gitdir is None:
+        return None
+    return [ cache.file_stamp(os.path.join(gitdir, 'packed-refs')),
+             cache.file_stamp(os.path.join(gitdir, 'refs', 'tags')) ]
+
+def _tags_path(repo):
+    return os.path.join(cache.cache_dir('tags'),
+                        cache.key_name(os.path.realpath(repo)) + '.json')
+
+def _load_release_tags(repo):
+    stamps = _tag_stamps(repo)
+    if stamps is not None:
+        cached = cache.load_json(_tags_path(repo))
+        if cached and cached.get('stamps') == stamps:
+            return (stamps, cached['tags'])
+
+    tags = backend.get_backend(repo).tag_names()
+    tags.sort(key=key_version)
+    if stamps is not None:
+        cache.store_json(_tags_path(repo), { 'stamps' : stamps, 'tags' : tags })
+    return (stamps, tags)
+
+def _release_info(repo):
+    stamps = _tag_stamps(repo)
+    with _release_tags_lock:
+        cached = _release_tags.get(repo)
+        if cached is None or (stamps is not None and cached[0] != stamps):
+            (stamps, tags) = _load_release_tags(repo)
+            cached = _release_tags[repo] = (stamps, tags, _next_tag(tags))
+    return cached
+
+def get_release_tags(repo):
+    """Return the v[0-9]* tags in 'repo', sorted by key_version().
+
+    The sorted list is cached, on disk and in memory, until the
+    repository's tags change.
+    """
+    return _release_info(repo)[1]
+
+@timings.timed('tag lookup')
 def get_next_tag(repo):
-    command = f"(cd {repo} ; git tag -l 'v[0-9]*')"
-    tag = run_command(command)
-    if tag == "":
+    return _release_info(repo)[2]
+
+def _next_tag(tags):
+    if not tags:
         return None
 
-    lines = tag.split()
-    lines.sort(key=key_version)
-    lasttag = lines[len(lines) - 1]
+    lasttag = tags[len(tags) - 1]
 
-    m = re.search(r"v([0-9]+)\.([0-9]+)(|-rc([0-9]+))$", lasttag)
+    m = _last_tag_re.search(lasttag)
     if m:
         # Post-release commit with no rc, it'll be rc1
         if m.group(3) == "":
@@ -72,35 +138,37 @@ def get_next_tag(repo):
     return None
 
 def get_diffstat(message):
-    return run_command("diffstat -p1", input=message)
+    return diffstat.diffstat(message)
 
+@timings.timed('remote url')
 def get_git_repo_url(dir):
-    command = f"(cd {dir}; git remote show origin -n)"
-    output = run_command(command)
-    for line in output.split('\n'):
-        m = re.search(r"URL:\s+(\S+)", line)
-        if m:
-            return m.group(1)
+    return gitsession.get_pool(dir).cached('remote_url',
+                                           backend.get_backend(dir).remote_url)
 
-    return None
+def get_local_commits(repo):
+    """Return the set of commits on the current branch of 'repo' that
+    aren't on any remote (or only those of the branch's remote, if it has
+    one). Worked out once per repository, however many commits we check.
+    """
+    return gitsession.get_pool(repo).cached('local_commits',
+                                            backend.get_backend(repo).local_commits)
 
 def confirm_commit(commit, repo):
-    command = f"cd {repo} ; git rev-list HEAD --not --remotes $(git config --get branch.$(git symbolic-ref --short HEAD).remote)"
-    out = run_command(command)
-    if out == "":
-        return True
+    info = commitcache.lookup(commit, repo)
+    if info.sha is None:
+        return commit not in get_local_commits(repo)
 
-    commits = out.split()
-    if commit in commits:
-        return False
-    return True
+    if info.local is None:
+        info.local = info.sha in get_local_commits(repo)
+    return not info.local
 
 def canonicalize_commit(commit, repo):
-    return run_command(f"cd {repo} ; git show -s {commit}^{{}} --pretty=%H")
+    return commitcache.lookup(commit, repo).sha
 
+@timings.timed('fetch')
 def get_commit(commit, repo, force=False):
-    command = f"cd {repo}; git diff-tree --no-renames --pretty=email -r -p --cc --stat {commit}"
-    data = run_command(command)
+    info = commitcache.lookup(commit, repo)
+    data = info.email() if info.sha else ''
     if data == "":
         return None
 
@@ -109,6 +177,108 @@ def get_commit(commit, repo, force=False):
 
     return data
 
+def _has_file_name(status, counts):
+    """Return whether git's diff of a file has a "+++ b/" line, given its
+    status and its (added, deleted) line counts.
+    """
+    if counts is None:
+        # "Binary files ... differ"
+        return False
+    (added, deleted) = counts
+    if status == 'M':
+        return added + deleted > 0
+    # Deleted files are diffed against /dev/null, and a type change is
+    # a deletion followed by an addition
+    return status in ('A', 'T') and added > 0
+
+@timings.timed('fetch')
+def get_limited_commit(commit, repo, paths, force=False):
+    """Return (data, partial) for 'commit', where data is its patch text
+    with only the file diffs Patch.filter(paths) could keep, and partial
+    is whether dropping one of the files git left out would have marked
+    the patch partial. Return None if git can't be asked for just those
+    files, in which case get_commit() has to be used.
+    """
+    matcher = pathmatch.get_matcher(paths)
+    literal = matcher.literal_paths()
+    if literal is None:
+        return None
+    info = commitcache.lookup(commit, repo)
+    if info.sha is None:
+        return None
+    b = backend.get_backend(repo)
+    files = b.changed_files(info.sha)
+    # Patch.filter() goes by the names on the "+++" lines, which are
+    # these only if git didn't quote them and they have no spaces
+    if not files or any(path[:1] == '"' or any(c.isspace() for c in path)
+                        for (status, path) in files):
+        return None
+
+    # The last file is always diffed: Patch.filter() has to see it to
+    # tell that it is the last, whose dropping doesn't mark the patch
+    # partial. Dropping any other file with a name does.
+    left_out = [ (status, path) for (status, path) in files[:-1]
+                 if status != 'D' and not matcher.match(path) ]
+    partial = False
+    for i in range(0, len(left_out), LINE_COUNT_BATCH):
+        batch = left_out[i:i + LINE_COUNT_BATCH]
+        counts = b.line_counts(info.sha, [ path for (status, path) in batch ])
+        if any(_has_file_name(status, counts.get(path)) for (status, path) in batch):
+            partial = True
+            break
+
+    data = info.email([ *literal, files[-1][1] ])
+    if data == '':
+        return None
+
+    if not force and not confirm_commit(commit, repo):
+        raise LocalCommitException('Commit is not in the remote repository. Use -f to override.')
+
+    return (data, partial)
+
+@timings.timed('search')
+def find_commit_repo(commit, repos, force=False):
+    """Return the first of 'repos' that has 'commit', or None.
+
+    This only checks that the commit exists, it doesn't generate the
+    patch, so it's cheap to call for every search repository.
+    """
+    (repo, _sha) = locator.locate(commit, repos)
+    if repo is None:
+        return None
+
+    if not force and not confirm_commit(commit, repo):
+        raise LocalCommitException('Commit is not in the remote repository. Use -f to override.')
+
+    return repo
+
+def is_range(rev):
+    return '..' in rev
+
+def range_repo(rev_range, repos):
+    """Return the first of 'repos' that has both ends of 'rev_range'."""
+    ends = re.split(r'\.\.\.?', rev_range, maxsplit=1)
+    for repo in repos:
+        if all(commitcache.lookup(end or 'HEAD', repo).sha for end in ends):
+            return repo
+    return None
+
+def expand_range(rev_range, pathspecs, repos):
+    """Yield the commits in 'rev_range', oldest first, as git lists them.
+
+    With 'pathspecs', only commits that touch those paths are listed.
+    If no repository has the range, 'rev_range' itself is yielded so it
+    gets reported like any other commit we can't find.
+    """
+    repo = range_repo(rev_range, repos)
+    if repo is None:
+        yield rev_range
+        return
+
+    pool = gitsession.get_pool(repo)
+    for line in pool.stream('rev-list', '--reverse', rev_range, '--', *pathspecs):
+        yield line.strip()
+
 def safe_filename(name, keep_non_patch_brackets = True):
     if name is None:
         return name
@@ -0,0 +1,171 @@
+# vim: sw=4 ts=4 et si:
+"""
+Match file names against the paths given to exportpatch -x and -X
+
+A path without any glob characters names a file, or, if it ends with
+'/', everything under a directory. Either way it's from the top of the
+tree: "drivers/scsi/" matches drivers/scsi/st.c but not
+arch/drivers/scsi/st.c.
+
+A path with '*', '?', '[' or '\\' in it is a pattern, with the rules of
+gitignore:
+
+* '*' and '?' don't match a '/', and '[...]' is a character class;
+* a pattern with no '/' in it, other than at the end, matches a name
+  at any depth ("*.h"); otherwise it's from the top of the tree
+  ("drivers/*/Kconfig"), and a leading '/' only says so;
+* "**/" matches any number of directories, and a trailing "/**"
+  everything under one;
+* if the pattern matches a directory, it matches everything under it,
+  and one that ends with '/' only matches directories.
+
+The paths are compiled once into sets of file names and directory
+prefixes, which are looked up by hashing, and one regular expression for
+all of the patterns, so checking a file costs the same however many
+paths were given. When there are no patterns, the paths can also be
+given to git, to leave the other files out of a diff altogether.
+"""
+
+import re
+import threading
+
+_GLOB_CHARS = frozenset('*?[\\')
+
+# patchtools-daemon sees a new set of paths with every command; keep at
+# most this many compiled
+MAX_MATCHERS = 64
+
+_matchers = {}
+_matchers_lock = threading.Lock()
+
+
+def _class(text):
+    """Return a regular expression character class for the inside of a
+    glob's '[...]'.
+    """
+    negate = text[:1] in ('!', '^')
+    if negate:
+        text = text[1:]
+    inside = ''.join('\\' + c if c in '\\[]^&~|' else c for c in text)
+    if negate:
+        return f'[^/{inside}]'
+    return f'(?!/)[{inside}]'
+
+
+def _stars(pattern, i):
+    """Return a regular expression for the run of '*' at pattern[i],
+    and the index just past it.
+    """
+    n = len(pattern)
+    j = i
+    while j < n and pattern[j] == '*':
+        j += 1
+    if pattern[i:j] != '**' or (i > 0 and pattern[i - 1] != '/'):
+        return ('[^/]*', j)
+    if j == n:
+        # "dir/**": everything under dir
+        return ('.*', j)
+    if pattern[j] == '/':
+        # "**/": any number of directories
+        return ('(?:[^/]*/)*', j + 1)
+    return ('[^/]*', j)
+
+
+def _bracket(pattern, i):
+    """Return a regular expression for the '[' at pattern[i], and the
+    index just past what it covers.
+    """
+    n = len(pattern)
+    j = i + 1
+    if j < n and pattern[j] in '!^':
+        j += 1
+    if j < n and pattern[j] == ']':
+        j += 1
+    while j < n and pattern[j] != ']':
+        j += 1
+    if j >= n:
+        # No closing ']': it's just a '['
+        return ('\\[', i + 1)
+    return (_class(pattern[i + 1:j]), j + 1)
+
+
+def translate(pattern):
+    """Return a regular expression for the glob 'pattern', matching
+    whole path components.
+    """
+    out = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            (regex, i) = _stars(pattern, i)
+        elif c == '?':
+            (regex, i) = ('[^/]', i + 1)
+        elif c == '[':
+            (regex, i) = _bracket(pattern, i)
+        elif c == '\\' and i + 1 < n:
+            (regex, i) = (re.escape(pattern[i + 1]), i + 2)
+        else:
+            (regex, i) = (re.escape(c), i + 1)
+        out.append(regex)
+    return ''.join(out)
+
+
+class PathMatcher:
+    """Tells whether a file name is one of, or under one of, the paths."""
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self.files = set()
+        self.dirs = set()
+        globs = []
+        for path in self.paths:
+            directory = path.endswith('/')
+            name = path.rstrip('/') if directory else path
+            if _GLOB_CHARS.isdisjoint(name):
+                name = name.lstrip('/')
+                if directory:
+                    self.dirs.add(name)
+                else:
+                    self.files.add(name)
+                continue
+            regex = translate(name.lstrip('/')) if '/' in name else '(?:.*/)?' + translate(name)
+            globs.append(regex + ('/' if directory else r'(?:/|\Z)'))
+        self._glob = re.compile('|'.join(globs), re.DOTALL) if globs else None
+
+    def match(self, filename):
+        """Return True if 'filename' is one of the paths or under one."""
+        if filename in self.files:
+            return True
+        if self.dirs:
+            end = filename.find('/')
+            while end >= 0:
+                if filename[:end] in self.dirs:
+                    return True
+                end = filename.find('/', end + 1)
+        return self._glob is not None and self._glob.match(filename) is not None
+
+    def literal_paths(self):
+        """Return the paths, from the top of the tree and with directories
+        ending in '/', or None if any of them is a pattern. As literal git
+        pathspecs they select every file that matches, and maybe more.
+        """
+        if self._glob is not None:
+            return None
+        return sorted(name for name in self.files if name) + \
+               sorted(name + '/' for name in self.dirs if name)
+
+
+def get_matcher(paths):
+    """Return the PathMatcher for 'paths', compiling them only the first
+    time they're asked for.
+    """
+    key = tuple(paths)
+    with _matchers_lock:
+        matcher = _matchers.get(key)
+        if matcher is None:
+            if len(_matchers) >= MAX_MATCHERS:
+                _matchers.clear()
+            matcher = _matchers[key] = PathMatcher(key)
+        return matcher
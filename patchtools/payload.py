@@ -0,0 +1,99 @@
+# vim: sw=4 ts=4 et si:
+"""
+A parsed patch payload: the commit message part (header) and the diff
+part (body), split into per-file segments
+
+The payload is scanned once when it's parsed. Every line in the text we
+keep ends with a single "\\n", so the regular expressions below run over
+the whole text in one go, with re.MULTILINE, instead of line by line.
+"""
+
+import bisect
+import re
+
+# The same as matching r"^(---|\*\*\*|Index:)[ \t][^ \t]|^diff -|^index [0-9a-f]{7}"
+# against each line on its own
+_patch_start_re = re.compile(r'^(?:(?:---|\*\*\*|Index:)[ \t][^ \t\n]|diff -|index [0-9a-f]{7})',
+                             re.MULTILINE)
+_filename_re = re.compile(r'^\+\+\+ [^/\n]+/(\S+)', re.MULTILINE)
+_separator_re = re.compile(r'^---$', re.MULTILINE)
+_diffstat_summary_re = re.compile(r'[0-9]+ files? changed, [0-9]+ insertion')
+
+def join_lines(lines):
+    """Join lines the way the rest of Patch expects: each ending in "\\n"."""
+    if not lines:
+        return ''
+    return '\n'.join(lines) + '\n'
+
+class Segment:
+    """A run of body lines that starts at a patch-start line.
+
+    For git output this is usually the 'diff --git', 'index' or '---'
+    line of a file diff plus whatever follows it, up to the next such
+    line. 'filename' is set from the last '+++' line in the segment.
+    """
+    __slots__ = ('end', 'filename', 'start')
+
+    def __init__(self, start, end, filename=None):
+        self.start = start
+        self.end = end
+        self.filename = filename
+
+class Payload:
+    def __init__(self, header, body, segments=None):
+        self.header = header
+        self.body = body
+        self._segments = segments
+        self._text = None
+
+    @classmethod
+    def parse(cls, text):
+        lines = join_lines(text.splitlines())
+        if lines != text:
+            # else keep the caller's string, so they can tell it's unchanged
+            text = lines
+        m = _patch_start_re.search(text)
+        payload = cls(text[:m.start()], text[m.start():]) if m else cls(text, '')
+        payload._text = text
+        return payload
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = self.header + self.body
+        return self._text
+
+    @property
+    def segments(self):
+        if self._segments is None:
+            body = self.body
+            starts = [ m.start() for m in _patch_start_re.finditer(body) ]
+            segments = [ Segment(start, end) for start, end in
+                         zip(starts, [*starts[1:], len(body)]) ]  # noqa: B905
+            for m in _filename_re.finditer(body):
+                # the last +++ line in a segment wins
+                i = bisect.bisect_right(starts, m.start()) - 1
+                if i >= 0:
+                    segments[i].filename = m.group(1)
+            self._segments = segments
+        return self._segments
+
+    def segment_text(self, segment):
+        return self.body[segment.start:segment.end]
+
+    def header_lines(self):
+        return self.header.splitlines()
+
+    def has_diffstat(self):
+        return _diffstat_summary_re.search(self.text) is not None
+
+    def has_separator_in_body(self):
+        return _separator_re.search(self.body) is not None
+
+    def has_combined_hunks(self):
+        # The body starts with a patch start line, so a hunk follows a "\n"
+        return '\n@@@' in self.body
+
+    def with_header(self, header):
+        """Return a payload with a new header and this body."""
+        return Payload(header, self.body, self._segments)
@@ -0,0 +1,154 @@
+# vim: sw=4 ts=4 et si:
+"""
+An on-disk index of the first release tag that contains each commit
+
+The index for a repository lives in an SQLite database in our cache
+directory. It's built by walking the release tags in version order and
+recording, for each tag, the commits that no earlier tag contains. When
+new tags show up after a fetch, only those are walked. If a tag we've
+already indexed moves or goes away, or a new tag sorts before one
+we've indexed, the index is rebuilt.
+
+Lookups are a single primary key lookup. If SQLite isn't available or
+the database can't be used, get_index() returns None and callers fall
+back to 'git name-rev'.
+"""
+
+import os
+import subprocess
+import threading
+
+from patchtools import backend, cache
+
+# Imported by get_index(), the first time an index is wanted
+sqlite3 = None
+
+# Bump when the database layout changes
+SCHEMA_VERSION = 1
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+class TagIndex:
+    def __init__(self, repo, version_key, path=None):
+        """'version_key' sorts tag names into release order and returns
+        an empty key for tags that aren't releases.
+        """
+        self.repo = repo
+        self.version_key = version_key
+        if path is None:
+            path = os.path.join(cache.cache_dir('tags'),
+                                cache.key_name(os.path.realpath(repo)) + '.sqlite')
+        self.path = path
+        self._db = None
+        self._names = {}
+        self._stale = False
+        self._lock = threading.Lock()
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        db = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        try:
+            if db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                with db:
+                    db.execute('DROP TABLE IF EXISTS tags')
+                    db.execute('DROP TABLE IF EXISTS commits')
+                    db.execute('CREATE TABLE tags (id INTEGER PRIMARY KEY, '
+                               'name TEXT NOT NULL, sha TEXT NOT NULL)')
+                    db.execute('CREATE TABLE commits (sha BLOB PRIMARY KEY, '
+                               'tag INTEGER NOT NULL) WITHOUT ROWID')
+                    db.execute(f'PRAGMA user_version = {SCHEMA_VERSION:d}')
+        except sqlite3.Error:
+            db.close()
+            raise
+        return db
+
+    def release_tags(self):
+        """Return [(name, commit)] for the release tags, in version order."""
+        tags = [ (name, sha) for (name, sha) in backend.get_backend(self.repo).release_tags()
+                 if self.version_key(name) ]
+        tags.sort(key=lambda tag: self.version_key(tag[0]))
+        return tags
+
+    def _add_tag(self, db, tag_id, sha, previous):
+        """Record the commits in 'sha' that none of 'previous' contain."""
+        commits = backend.get_backend(self.repo).new_commits(sha, previous)
+        db.executemany('INSERT OR REPLACE INTO commits VALUES (?, ?)',
+                       ((bytes.fromhex(c), tag_id) for c in commits))
+
+    def update(self, db):
+        """Bring the index up to date with the repository's tags."""
+        tags = self.release_tags()
+        indexed = [ (name, sha) for (name, sha) in
+                    db.execute('SELECT name, sha FROM tags ORDER BY id') ]
+        with db:
+            if tags[:len(indexed)] != indexed:
+                db.execute('DELETE FROM tags')
+                db.execute('DELETE FROM commits')
+                indexed = []
+            previous = [ sha for (name, sha) in indexed ]
+            for (tag_id, (name, sha)) in enumerate(tags[len(indexed):], len(indexed)):
+                self._add_tag(db, tag_id, sha, previous)
+                db.execute('INSERT INTO tags VALUES (?, ?, ?)', (tag_id, name, sha))
+                previous.append(sha)
+        self._names = dict(db.execute('SELECT id, name FROM tags'))
+
+    def lookup(self, sha):
+        """Return the first release tag containing the full hash 'sha',
+        "undefined" if there's none, or None if the index can't be used.
+        """
+        with self._lock:
+            try:
+                if self._db is None:
+                    db = self._open()
+                    try:
+                        self.update(db)
+                    except (OSError, sqlite3.Error, subprocess.CalledProcessError):
+                        db.close()
+                        raise
+                    self._db = db
+                elif self._stale:
+                    self.update(self._db)
+                self._stale = False
+                row = self._db.execute('SELECT tag FROM commits WHERE sha = ?',
+                                       (bytes.fromhex(sha),)).fetchone()
+            except (OSError, ValueError, sqlite3.Error, subprocess.CalledProcessError):
+                return None
+        if row is None:
+            return 'undefined'
+        return self._names.get(row[0])
+
+    def forget(self):
+        """Check for new tags again before the next lookup."""
+        with self._lock:
+            self._stale = True
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def get_index(repo, version_key):
+    """Return the tag index for 'repo', or None if we can't keep one."""
+    global sqlite3  # noqa: PLW0603
+    if sqlite3 is None:
+        try:
+            import sqlite3  # noqa: PLC0415
+        except ImportError:
+            return None
+    with _indexes_lock:
+        index = _indexes.get(repo)
+        if index is None:
+            index = _indexes[repo] = TagIndex(repo, version_key)
+        return index
+
+
+def forget():
+    """Have every index check for new tags before its next lookup."""
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+    for index in indexes:
+        index.forget()
@@ -0,0 +1,174 @@
+# vim: sw=4 ts=4 et si:
+"""
+Where the time goes: the phases of building a patch, and git commands
+
+With --timings, exportpatch and fixpatch count how often each phase
+(finding the repository, fetching the commit, looking up the tag, ...)
+and each git command ran, how long they took and, for git, how many
+bytes went through its pipes, and print the breakdown when they're done.
+Until enable() is called, nothing is recorded and the only cost is a
+check of a flag.
+
+Times are wall-clock and add up across threads, so with -j they can
+total more than the run took. A phase includes the git commands it
+waits for: the time of "fetch" is mostly that of 'git diff-tree'.
+"""
+
+import contextlib
+import functools
+import json
+import sys
+import threading
+import time
+import types
+from pathlib import Path
+
+# Bump when the JSON report changes
+REPORT_VERSION = 1
+
+# Whether we're recording, and since when
+_state = types.SimpleNamespace(active=False, started=None)
+_lock = threading.Lock()
+
+# name -> [calls, seconds]
+_phases = {}
+
+# name -> [calls, seconds, bytes sent, bytes received]
+_commands = {}
+
+
+def enable():
+    """Start recording, from nothing."""
+    with _lock:
+        _phases.clear()
+        _commands.clear()
+        _state.started = time.perf_counter()
+        _state.active = True
+
+
+def forget():
+    """Stop recording and drop what was recorded."""
+    with _lock:
+        _state.active = False
+        _state.started = None
+        _phases.clear()
+        _commands.clear()
+
+
+def start():
+    """Return the time to pass to command() later, or None if we're not
+    recording.
+    """
+    if not _state.active:
+        return None
+    return time.perf_counter()
+
+
+def _add(table, name, values):
+    with _lock:
+        totals = table.get(name)
+        if totals is None:
+            table[name] = list(values)
+        else:
+            for (i, value) in enumerate(values):
+                totals[i] += value
+
+
+def command(name, started, sent=0, received=0):
+    """Record a git command that started at 'started', from start(),
+    and has just finished.
+    """
+    if started is None:
+        return
+    _add(_commands, name, (1, time.perf_counter() - started, sent, received))
+
+
+class _Untimed:
+    """What phase() hands out when we're not recording."""
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+_untimed = _Untimed()
+
+
+@contextlib.contextmanager
+def _timed_block(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add(_phases, name, (1, time.perf_counter() - started))
+
+
+def phase(name):
+    """Return a context manager that records the block it runs as 'name'."""
+    if not _state.active:
+        return _untimed
+    return _timed_block(name)
+
+
+def timed(name):
+    """Decorator recording every call of the function as the phase 'name'."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _state.active:
+                return func(*args, **kwargs)
+            with _timed_block(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def report():
+    """Return what was recorded as a JSON-friendly dict."""
+    with _lock:
+        total = time.perf_counter() - _state.started if _state.started is not None else 0.0
+        phases = [ { 'phase' : name, 'calls' : calls, 'seconds' : seconds }
+                   for (name, (calls, seconds)) in sorted(_phases.items()) ]
+        commands = [ { 'command' : name, 'calls' : calls, 'seconds' : seconds,
+                       'bytes_sent' : sent, 'bytes_received' : received }
+                     for (name, (calls, seconds, sent, received))
+                     in sorted(_commands.items()) ]
+    return {
+        'version' : REPORT_VERSION,
+        'seconds' : total,
+        'phases' : phases,
+        'commands' : commands,
+    }
+
+
+def print_report(results, out=None):
+    """Print 'results' from report() as tables."""
+    if out is None:
+        out = sys.stderr
+    print(f'{"phase":<28s} {"calls":>8s} {"seconds":>10s}', file=out)
+    for p in results['phases']:
+        print(f'{p["phase"]:<28s} {p["calls"]:8d} {p["seconds"]:10.4f}', file=out)
+    print(f'{"git command":<28s} {"calls":>8s} {"seconds":>10s} {"sent":>12s} {"received":>12s}',
+          file=out)
+    for c in results['commands']:
+        print(f'{c["command"]:<28s} {c["calls"]:8d} {c["seconds"]:10.4f} '
+              f'{c["bytes_sent"]:12d} {c["bytes_received"]:12d}', file=out)
+    print(f'{"total":<28s} {"":>8s} {results["seconds"]:10.4f}', file=out)
+
+
+def finish(show, json_path):
+    """Stop recording, and print the report if 'show' is set and write it
+    as JSON to 'json_path' if that's set.
+    """
+    results = report()
+    forget()
+    if show:
+        print_report(results)
+    if json_path:
+        try:
+            with Path(json_path).open('w') as f:
+                json.dump(results, f, indent=1)
+                f.write('\n')
+        except OSError as e:
+            print(e, file=sys.stderr)
@@ -43,10 +43,14 @@ setup(
     author='Jeff Mahoney',
     author_email='jeffm@suse.com',
     name='patchtools',
-    packages=['patchtools'],
+    packages=['patchtools', 'patchtools.bench'],
     entry_points={
-        'console_scripts': [f'{m} = patchtools.{m}:main' for m in SCRIPT_MODULES],
+        # the front ends hand commands to patchtools-daemon, if it's wanted
+        'console_scripts': [f'{m} = patchtools.client:{m}' for m in SCRIPT_MODULES] +
+                           ['patchtools-daemon = patchtools.daemon:main',
+                            'patchtools-bench = patchtools.bench.micro:main'],
         },
+    extras_require={'pygit2': ['pygit2']},
     version='2.5')
 
 # vim: sw=4 ts=4 et si:
@@ -1,16 +1,32 @@
 """The 'test' class for patchtools."""
 
+from .test_combined import TestCombined
+from .test_diffstat import TestDiffstat
 from .test_exportpatch import TestExportpatchExclude, TestExportpatchExtract, TestExportpatchNormalFunctionality
 from .test_fixpatch import TestFixpatchErrorCases, TestFixpatchNormalFunctionality
+from .test_kernelrepo import TestKernelRepo
+from .test_largepatch import TestLargePatch
+from .test_manifest import TestManifest
 from .test_patch import TestPatchModuleNormalFunctionality
+from .test_pathmatch import TestPathMatch
+from .test_payload import TestPayload
+from .test_timings import TestTimings
 
 __all__ = [
+    'TestCombined',
+    'TestDiffstat',
     'TestExportpatchExclude',
     'TestExportpatchExtract',
     'TestExportpatchNormalFunctionality',
     'TestFixpatchErrorCases',
     'TestFixpatchNormalFunctionality',
+    'TestKernelRepo',
+    'TestLargePatch',
+    'TestManifest',
     'TestPatchModuleNormalFunctionality',
+    'TestPathMatch',
+    'TestPayload',
+    'TestTimings',
     ]
 
 # vim: sw=4 ts=4 et si:
@@ -0,0 +1,98 @@
+"""The test suite for the patchtools combined module.
+
+Check that the combined diff of a merge is turned into unified hunks
+against the first parent, with their line numbers.
+"""
+
+import unittest
+
+from patchtools.combined import to_unified
+
+
+def text(lines):
+    """Return 'lines' joined into the text of a diff."""
+    return '\n'.join(lines) + '\n'
+
+
+FILE_HEADER = '''diff --cc drivers/sound/bench.c
+index 2b03091,8630d35..3617a31
+--- a/drivers/sound/bench.c
++++ b/drivers/sound/bench.c
+'''
+
+# The conflict git gives for a merge that resolves it by hand
+CONFLICT = FILE_HEADER + text([
+    '@@@ -2,7 -2,7 +2,7 @@@ static int bench(void)',
+    '  /* drivers/sound/bench.c */',
+    '  ',
+    '  static int bench_0(int ret)',
+    '- \tret = mainline(ret);',
+    ' -\tret = topic(ret);',
+    '++\tret = topic(mainline(ret));',
+    '  \tret = one(ret);',
+    '  \tret = two(ret);',
+    '  \treturn ret;'])
+
+
+class TestCombined(unittest.TestCase):
+    """Test turning combined diffs into unified ones."""
+
+    def test_conflict(self):
+        """Test that only the first parent's side is kept, at its line numbers."""
+        self.assertEqual(to_unified(CONFLICT), FILE_HEADER + text([
+            '@@ -2,7 +2,7 @@',
+            ' /* drivers/sound/bench.c */',
+            ' ',
+            ' static int bench_0(int ret)',
+            '-\tret = mainline(ret);',
+            '+\tret = topic(mainline(ret));',
+            ' \tret = one(ret);',
+            ' \tret = two(ret);',
+            ' \treturn ret;']))
+
+    def test_split(self):
+        """Test that changes far apart go into hunks of their own."""
+        lines = ['@@@ -10,12 -10,11 +10,12 @@@']
+        lines += [f'  line {n}' for n in range(10, 13)]
+        lines += ['- old 13', ' -theirs', '++new 13']
+        lines += [f'  line {n}' for n in range(14, 21)]
+        lines += ['--lost 21', '+ added']
+        unified = to_unified(FILE_HEADER + text(lines))
+        hunks = [line for line in unified.splitlines() if line.startswith('@@')]
+        self.assertEqual(hunks, ['@@ -10,7 +10,7 @@', '@@ -18,4 +18,4 @@'])
+        self.assertIn('\n-lost 21\n+added\n', unified)
+        self.assertNotIn('theirs', unified)
+
+    def test_octopus(self):
+        """Test a combined diff with three parents."""
+        unified = to_unified(FILE_HEADER + '''@@@@ -1,2 -1,2 -1,2 +1,2 @@@@
+   one
+-  two
+ - deux
+  -zwei
++++2
+''')
+        self.assertTrue(unified.endswith('@@ -1,2 +1,2 @@\n one\n-two\n+2\n'))
+
+    def test_no_newline(self):
+        """Test that a missing newline marker stays with its line."""
+        unified = to_unified(FILE_HEADER + '''@@@ -1,1 -1,1 +1,1 @@@
+- old
+ -theirs
+\\ No newline at end of file
+++new
+\\ No newline at end of file
+''')
+        self.assertTrue(unified.endswith(
+            '@@ -1 +1 @@\n-old\n+new\n\\ No newline at end of file\n'))
+
+    def test_unchanged(self):
+        """Test that a diff without combined hunks is left as it is."""
+        text = FILE_HEADER.replace('--cc', '--git') + '@@ -1 +1 @@\n-a\n+b\n'
+        self.assertEqual(to_unified(text), text)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: sw=4 ts=4 et si:
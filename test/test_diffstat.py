@@ -0,0 +1,98 @@
+"""The test suite for the patchtools diffstat module.
+
+Check the in-process diffstat against the output of the real
+'diffstat -p1' command, as saved in our known-good patch files.
+"""
+
+import re
+import shutil
+import subprocess
+import unittest
+from pathlib import Path
+
+from patchtools.diffstat import diffstat
+
+from .util import DATA_PATH
+
+# patch files whose diffstat was generated by 'diffstat -p1'
+DIFFSTAT_FILES = [
+    'scsi-libsas-Add-rollback-handling-when-an-error-occurs.2f_of_2',
+    'scsi-libsas-Add-rollback-handling-when-an-error-occurs.excluded_first_and_last',
+    'scsi-libsas-Add-rollback-handling-when-an-error-occurs.extracted',
+    'scsi-libsas-Add-rollback-handling-when-an-error-occurs.extracted_file2_of_3',
+    'scsi-st-Tighten-the-page-format-heuristics-with-MODE-SELECT.extracted',
+    ]
+
+SAMPLE_DIFF = '''diff --git a/drivers/scsi/big.c b/drivers/scsi/big.c
+index 1111111..2222222 100644
+--- a/drivers/scsi/big.c
++++ b/drivers/scsi/big.c
+@@ -1,4 +1,202 @@
+ context
+-removed
+--- a removed line that looks like a header
+{added}
+ context
+diff --git a/a.c b/a.c
+deleted file mode 100644
+index 3333333..0000000
+--- a/a.c
++++ /dev/null
+@@ -1,2 +0,0 @@
+-one
+-two
+diff --git a/fw/blob.bin b/fw/blob.bin
+new file mode 100644
+index 0000000..4444444
+Binary files /dev/null and b/fw/blob.bin differ
+'''.format(added='\n'.join(f'+added {n}' for n in range(200)))
+
+
+def split_patch(text):
+    """Return the diffstat block and the diff body of a patch file."""
+    lines = text.splitlines(keepends=True)
+    end = next(i for i, line in enumerate(lines) if re.search(r'files? changed', line))
+    start = end
+    while start > 0 and ' | ' in lines[start - 1]:
+        start -= 1
+    body_start = next(i for i, line in enumerate(lines) if line.startswith('--- '))
+    return (''.join(lines[start:end + 1]), ''.join(lines[body_start:]))
+
+
+class TestDiffstat(unittest.TestCase):
+    """Test the diffstat generator."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Set up the test class for this class. Done once per class."""
+        cls.assertTrue(DATA_PATH, 'cannot find "data" subdirectory')
+
+    def test_known_good_diffstats(self):
+        """Test that we match diffstat output saved in known good patches."""
+        for fname in DIFFSTAT_FILES:
+            with Path(DATA_PATH, fname).open(encoding='utf-8') as pfile:
+                (stat, body) = split_patch(pfile.read())
+            self.assertEqual(diffstat(body), stat, f'diffstat differs for {fname}')
+
+    def test_sample(self):
+        """Test scaling, deleted, binary and header-like lines.
+
+        The histogram is scaled to fit, so the two deletions in a.c
+        round down to nothing.
+        """
+        lines = diffstat(SAMPLE_DIFF).splitlines()
+        self.assertEqual(lines[0], ' a.c                |    2 ')
+        self.assertEqual(lines[1], ' drivers/scsi/big.c |  202 ' + '+' * 53 + '-')
+        self.assertEqual(lines[2], ' fw/blob.bin        |binary')
+        self.assertEqual(lines[3], ' 3 files changed, 200 insertions(+), 4 deletions(-)')
+
+    def test_empty(self):
+        """Test a diff with no files in it."""
+        self.assertEqual(diffstat(''), ' 0 files changed\n')
+
+    @unittest.skipUnless(shutil.which('diffstat'), 'diffstat is not installed')
+    def test_against_diffstat(self):
+        """Test that we match the installed diffstat command."""
+        expected = subprocess.run(['diffstat', '-p1'], input=SAMPLE_DIFF, encoding='utf-8',  # noqa: S607
+                                  stdout=subprocess.PIPE, check=True).stdout
+        self.assertEqual(diffstat(SAMPLE_DIFF), expected)
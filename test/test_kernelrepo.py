@@ -0,0 +1,45 @@
+"""The test suite for the synthetic kernel repository of the benchmarks.
+
+Check that the repository patchtools.bench.kernelrepo builds has the
+merges and the treewide commits its options ask for.
+"""
+
+import io
+import subprocess
+import tempfile
+import unittest
+
+from patchtools.bench import kernelrepo
+
+
+def subjects(repo, *args):
+    return subprocess.run(['git', 'log', '--format=%s', *args], cwd=repo, check=True,  # noqa: S603, S607
+                          encoding='utf-8', stdout=subprocess.PIPE).stdout.splitlines()
+
+
+class TestKernelRepo(unittest.TestCase):
+    """Test the shape of the synthetic kernel repository."""
+
+    def build(self, **kwargs):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        options = kernelrepo.Options(files=40, treewide_files=20, subsystems=0,
+                                     local_commits=0, **kwargs)
+        return kernelrepo.build(scratch.name, options, io.StringIO())['mainline']
+
+    def test_shared_multiple(self):
+        """Test that treewide commits due with a merge aren't crowded out by it."""
+        mainline = self.build(commits=240, merge_every=20, treewide_every=100)
+        self.assertEqual(len(subjects(mainline, '--grep=^treewide:')), 2)
+        self.assertEqual(len(subjects(mainline, '--merges')), 11)
+
+    def test_stepped_over(self):
+        """Test that a treewide commit due in the middle of a merge still comes."""
+        mainline = self.build(commits=240, merge_every=20, treewide_every=42)
+        self.assertEqual(len(subjects(mainline, '--grep=^treewide:')), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: sw=4 ts=4 et si:
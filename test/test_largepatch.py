@@ -0,0 +1,118 @@
+"""The test suite for the patchtools largepatch module.
+
+Check that the diff of a large patch, kept as bytes in a mapped file,
+is split, filtered, counted and written as the text of other patches is.
+"""
+
+import io
+import tempfile
+import unittest
+
+from patchtools import combined, diffstat
+from patchtools.largepatch import LargeBody, LargePatch, Spill, print_patch
+
+HEADER = '''From 0123456789abcdef0123456789abcdef01234567 Mon Sep 17 00:00:00 2001
+From: Barney Rubbel <brubbel@suse.com>
+Subject: scsi: st: change things
+
+Change things.
+---
+'''
+
+BODY = '''diff --git a/drivers/scsi/st.c b/drivers/scsi/st.c
+index 2b03091..3617a31 100644
+--- a/drivers/scsi/st.c
++++ b/drivers/scsi/st.c
+@@ -1,2 +1,2 @@
+ one
+-two
++deux
+diff --git a/fs/file.c b/fs/file.c
+index 8630d35..3617a31 100644
+--- a/fs/file.c
++++ b/fs/file.c
+@@ -1 +1,2 @@
+ one
++\x0ctwo
+'''
+
+
+def large_patch(text):
+    # LargePatch closes it
+    f = tempfile.TemporaryFile()  # noqa: SIM115
+    f.write(text.encode())
+    f.flush()
+    return LargePatch(f)
+
+
+def body_text(body):
+    out = io.BytesIO()
+    body.write(out)
+    return out.getvalue().decode()
+
+
+class TestLargePatch(unittest.TestCase):
+    """Test handling the diff of a large patch."""
+
+    def test_split(self):
+        """Test that the text before the first diff is decoded and the diff kept as it is."""
+        (text, body) = large_patch(HEADER + BODY).split()
+        self.assertEqual(text, HEADER)
+        self.assertEqual(len(body), len(BODY.encode()))
+        self.assertEqual(body_text(body), BODY)
+
+    def test_segments(self):
+        """Test that the segments are those of the payload, with their file names."""
+        (_text, body) = large_patch(HEADER + BODY).split()
+        segments = body.segments()
+        self.assertEqual([ s.filename for s in segments ],
+                         [ None, None, 'drivers/scsi/st.c', None, None, 'fs/file.c' ])
+        kept = LargeBody.joined([ segments[5] ])
+        self.assertEqual(body_text(kept), '--- a/fs/file.c\n+++ b/fs/file.c\n'
+                                          '@@ -1 +1,2 @@\n one\n+\x0ctwo\n\n')
+        self.assertEqual([ s.filename for s in kept.segments() ], [ 'fs/file.c' ])
+        self.assertEqual(len(LargeBody.joined([])), 0)
+
+    def test_diffstat(self):
+        """Test that the diffstat is the one of the text."""
+        (_text, body) = large_patch(HEADER + BODY).split()
+        self.assertEqual(body.diffstat(), diffstat.diffstat(BODY))
+        self.assertFalse(body.has_separator())
+        self.assertFalse(body.has_combined_hunks())
+
+    def test_combined(self):
+        """Test that a merge's combined diff is converted one file at a time."""
+        merge = BODY.replace('@@ -1,2 +1,2 @@\n one\n-two\n+deux\n',
+                             '@@@ -1,2 -1,2 +1,2 @@@\n  one\n- two\n -zwei\n++deux\n')
+        (_text, body) = large_patch(HEADER + merge).split()
+        self.assertTrue(body.has_combined_hunks())
+        self.assertEqual(body_text(body.to_unified()), combined.to_unified(merge))
+
+    def test_spill(self):
+        """Test that output goes to a file only past the limit."""
+        spill = Spill(10)
+        spill.append(b'short\n')
+        self.assertEqual(spill.result(), 'short\n')
+        spill = Spill(10)
+        for line in (b'one line\n', b'two lines\n'):
+            spill.append(line)
+        result = spill.result()
+        self.assertIsInstance(result, LargePatch)
+        self.assertEqual(result.map[:], b'one line\ntwo lines\n')
+
+    def test_print(self):
+        """Test that the text and the diff are written as print() would write them."""
+        (text, body) = large_patch(HEADER + BODY).split()
+        out = io.TextIOWrapper(io.BytesIO(), newline='')
+        print_patch(text, body, out)
+        out.flush()
+        self.assertEqual(out.buffer.getvalue().decode(), HEADER + BODY + '\n')
+        out = io.StringIO()
+        print_patch(text, body, out)
+        self.assertEqual(out.getvalue(), HEADER + BODY + '\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: sw=4 ts=4 et si:
@@ -0,0 +1,84 @@
+"""The test suite for the patchtools manifest module.
+
+Check that fixpatch --manifest only has a patch as fixed while its
+contents and the options it was fixed with are the same.
+"""
+
+import optparse
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from patchtools.manifest import MANIFEST_NAME, Manifest, Manifests, options_state
+
+PATCH = '''From: Barney Rubbel <brubbel@suse.com>
+Subject: scsi: st: change things
+
+Change things.
+'''
+
+
+def fix_options(**kwargs):
+    options = { 'no_ack' : False, 'no_diffstat' : False, 'no_rename' : False,
+                'header_only' : False, 'reference' : None, 'signed_off_by' : False,
+                'mainline' : None, 'suffix' : False }
+    options.update(kwargs)
+    return optparse.Values(options)
+
+
+class TestManifest(unittest.TestCase):
+    """Test recording and checking fixed patches."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.pathname = os.path.join(self.dir.name, 'scsi-st-change-things')
+        Path(self.pathname).write_text(PATCH)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_record(self):
+        """Test that a recorded patch is fixed, and stays so once saved."""
+        manifests = Manifests(fix_options())
+        self.assertFalse(manifests.is_fixed(self.pathname))
+        manifests.record(self.pathname, None)
+        self.assertTrue(manifests.is_fixed(self.pathname))
+        manifests.save()
+        self.assertTrue(os.path.exists(os.path.join(self.dir.name, MANIFEST_NAME)))
+        self.assertTrue(Manifests(fix_options()).is_fixed(self.pathname))
+
+    def test_changed(self):
+        """Test that a patch isn't fixed once it or the options change."""
+        manifests = Manifests(fix_options())
+        manifests.record(self.pathname, None)
+        manifests.save()
+        self.assertFalse(Manifests(fix_options(no_diffstat=True)).is_fixed(self.pathname))
+        with Path(self.pathname).open('a') as f:
+            f.write('More.\n')
+        self.assertFalse(Manifests(fix_options()).is_fixed(self.pathname))
+
+    def test_renamed(self):
+        """Test that a renamed patch is recorded under its new name only."""
+        state = options_state(fix_options())
+        manifest = Manifest(self.dir.name)
+        manifest.record(self.pathname, state, None)
+        new = os.path.join(self.dir.name, 'scsi-st-change-more-things')
+        os.rename(self.pathname, new)
+        manifest.record(new, state, None, self.pathname)
+        self.assertEqual(list(manifest.patches), [ os.path.basename(new) ])
+        self.assertTrue(manifest.is_fixed(new, state))
+
+    def test_prune(self):
+        """Test that saving drops the entries of patches that are gone."""
+        manifests = Manifests(fix_options())
+        manifests.record(self.pathname, None)
+        os.unlink(self.pathname)
+        manifests.save()
+        self.assertEqual(Manifest(self.dir.name).patches, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: sw=4 ts=4 et si:
@@ -0,0 +1,86 @@
+"""The test suite for the patchtools pathmatch module.
+
+Check which file names the paths given to exportpatch -x and -X match.
+"""
+
+import unittest
+
+from patchtools.pathmatch import get_matcher
+
+
+class TestPathMatch(unittest.TestCase):
+    """Test matching file names against paths and patterns."""
+
+    def assertMatches(self, path, filenames, expected=True):  # noqa: N802
+        matcher = get_matcher([path])
+        for filename in filenames:
+            self.assertEqual(matcher.match(filename), expected,
+                             f'{filename} against {path}')
+
+    def test_file(self):
+        """Test that a plain path matches only that file."""
+        self.assertMatches('drivers/scsi/st.c', ['drivers/scsi/st.c'])
+        self.assertMatches('drivers/scsi/st.c', ['drivers/scsi/st.cc', 'arch/drivers/scsi/st.c',
+                                                 'drivers/scsi/st.c.orig'], False)
+        self.assertMatches('/drivers/scsi/st.c', ['drivers/scsi/st.c'])
+
+    def test_directory(self):
+        """Test that a path ending in '/' matches everything under it, from the top."""
+        self.assertMatches('drivers/scsi/', ['drivers/scsi/st.c', 'drivers/scsi/libsas/sas_ata.c'])
+        self.assertMatches('drivers/scsi/', ['drivers/scsi', 'arch/drivers/scsi/st.c',
+                                             'drivers/scsiX/st.c'], False)
+        self.assertMatches('fs/', ['fs/file.c'])
+        self.assertMatches('fs/', ['xfs/file.c', 'drivers/fs/file.c'], False)
+
+    def test_glob_any_depth(self):
+        """Test that a pattern without a '/' matches at any depth."""
+        self.assertMatches('*.h', ['a.h', 'include/linux/a.h'])
+        self.assertMatches('*.h', ['a.c', 'a.h.c'], False)
+        self.assertMatches('Kconfig*', ['drivers/Kconfig', 'drivers/Kconfig.debug'])
+        self.assertMatches('libs?s/', ['drivers/scsi/libsas/sas_ata.c'])
+        self.assertMatches('libs?s/', ['drivers/libsas'], False)
+
+    def test_glob_anchored(self):
+        """Test that a pattern with a '/' is matched from the top."""
+        self.assertMatches('drivers/*/Kconfig', ['drivers/scsi/Kconfig'])
+        self.assertMatches('drivers/*/Kconfig', ['drivers/scsi/libsas/Kconfig',
+                                                 'arch/drivers/scsi/Kconfig'], False)
+        self.assertMatches('drivers/s*', ['drivers/scsi/st.c', 'drivers/sound/a.c'])
+        self.assertMatches('drivers/[!s]*/', ['drivers/net/a.c'])
+        self.assertMatches('drivers/[!s]*/', ['drivers/scsi/st.c', 'drivers/net'], False)
+
+    def test_double_star(self):
+        """Test '**' in patterns."""
+        self.assertMatches('**/libsas/*.h', ['drivers/scsi/libsas/sas_internal.h',
+                                             'libsas/a.h'])
+        self.assertMatches('**/libsas/*.h', ['drivers/scsi/libsas/sas_ata.c'], False)
+        self.assertMatches('drivers/**', ['drivers/a.c', 'drivers/scsi/st.c'])
+        self.assertMatches('drivers/**/st.c', ['drivers/st.c', 'drivers/scsi/st.c'])
+        self.assertMatches('drivers/**/st.c', ['fs/st.c'], False)
+
+    def test_escape(self):
+        """Test that a backslash takes the next character literally."""
+        self.assertMatches('a\\*b', ['a*b'])
+        self.assertMatches('a\\*b', ['axb'], False)
+        self.assertMatches('a[b', ['a[b'])
+
+    def test_many(self):
+        """Test several paths at once."""
+        matcher = get_matcher(['fs/', 'drivers/scsi/st.c', '*.rst'])
+        self.assertTrue(matcher.match('fs/file.c'))
+        self.assertTrue(matcher.match('drivers/scsi/st.c'))
+        self.assertTrue(matcher.match('Documentation/scsi/st.rst'))
+        self.assertFalse(matcher.match('drivers/scsi/sg.c'))
+        self.assertIs(get_matcher(('fs/', 'drivers/scsi/st.c', '*.rst')), matcher)
+
+    def test_literal_paths(self):
+        """Test the paths handed to git when there are no patterns."""
+        self.assertEqual(get_matcher(['fs/', '/drivers/scsi/st.c', 'fs/file.c']).literal_paths(),
+                         ['drivers/scsi/st.c', 'fs/file.c', 'fs/'])
+        self.assertIsNone(get_matcher(['fs/', '*.h']).literal_paths())
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: sw=4 ts=4 et si:
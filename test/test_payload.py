@@ -0,0 +1,63 @@
+"""The test suite for the patchtools payload module.
+
+Check that a payload is split into header, body and per-file segments
+the same way Patch used to split it line by line.
+"""
+
+import unittest
+
+from patchtools.payload import Payload
+
+PAYLOAD = '''Subject line
+
+Some text.
+Signed-off-by: Someone <someone@example.com>
+---
+ a.c | 1 +
+ 1 file changed, 1 insertion(+)
+
+diff --git a/a.c b/a.c
+index 1111111..2222222 100644
+--- a/a.c
++++ b/a.c
+@@ -1 +1,2 @@
+ one
++two
+diff --git a/b.c b/b.c
+deleted file mode 100644
+index 3333333..0000000
+--- a/b.c
++++ /dev/null
+@@ -1 +0,0 @@
+-gone
+'''
+
+
+class TestPayload(unittest.TestCase):
+    """Test the parsed payload model."""
+
+    def test_split(self):
+        """Test the header/body split at the first patch start line."""
+        payload = Payload.parse(PAYLOAD)
+        self.assertTrue(payload.header.endswith(' 1 file changed, 1 insertion(+)\n\n'))
+        self.assertTrue(payload.body.startswith('diff --git a/a.c b/a.c\n'))
+        self.assertEqual(payload.text, PAYLOAD)
+        self.assertTrue(payload.has_diffstat())
+        self.assertFalse(payload.has_separator_in_body())
+        self.assertFalse(payload.has_combined_hunks())
+
+    def test_segments(self):
+        """Test that every patch start line begins a segment."""
+        payload = Payload.parse(PAYLOAD)
+        segments = payload.segments
+        self.assertEqual(len(segments), 6)
+        self.assertEqual(''.join(payload.segment_text(s) for s in segments), payload.body)
+        self.assertEqual([s.filename for s in segments],
+                         [None, None, 'a.c', None, None, None])
+
+    def test_no_body(self):
+        """Test a payload without any diff in it."""
+        payload = Payload.parse('just text\r\nand more')
+        self.assertEqual(payload.header, 'just text\nand more\n')
+        self.assertEqual(payload.body, '')
+        self.assertEqual(payload.segments, [])
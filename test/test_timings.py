@@ -0,0 +1,105 @@
+"""The test suite for the patchtools timings module.
+
+Check that phases and git commands are only recorded while timing is
+on, and that the report adds them up.
+"""
+
+import io
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from patchtools import timings
+
+
+@timings.timed('double')
+def double(n):
+    """Something to time."""
+    return n * 2
+
+
+class TestTimings(unittest.TestCase):
+    """Test recording and reporting timings."""
+
+    def tearDown(self):
+        timings.forget()
+
+    def test_off_by_default(self):
+        """Test that nothing is recorded until timing is enabled."""
+        self.assertEqual(double(2), 4)
+        with timings.phase('block'):
+            pass
+        timings.command('git log', timings.start(), 10, 20)
+        results = timings.report()
+        self.assertEqual(results['phases'], [])
+        self.assertEqual(results['commands'], [])
+
+    def test_phases(self):
+        """Test that every call of a phase is counted."""
+        timings.enable()
+        for i in range(3):
+            self.assertEqual(double(i), i * 2)
+        with timings.phase('block'):
+            pass
+        phases = { p['phase'] : p for p in timings.report()['phases'] }
+        self.assertEqual(phases['double']['calls'], 3)
+        self.assertEqual(phases['block']['calls'], 1)
+        self.assertGreaterEqual(phases['double']['seconds'], 0)
+
+    def test_phase_exception(self):
+        """Test that a phase that raises is still recorded."""
+        timings.enable()
+        with self.assertRaises(ValueError), timings.phase('failing'):
+            raise ValueError('failed')
+        self.assertEqual(timings.report()['phases'][0]['calls'], 1)
+
+    def test_commands(self):
+        """Test that git commands add up their calls and bytes."""
+        timings.enable()
+        timings.command('git log', timings.start(), 10, 20)
+        timings.command('git log', timings.start(), 1, 2)
+        (log,) = timings.report()['commands']
+        self.assertEqual(log['command'], 'git log')
+        self.assertEqual(log['calls'], 2)
+        self.assertEqual(log['bytes_sent'], 11)
+        self.assertEqual(log['bytes_received'], 22)
+
+    def test_enable_resets(self):
+        """Test that enabling timing again starts from nothing."""
+        timings.enable()
+        double(1)
+        timings.enable()
+        self.assertEqual(timings.report()['phases'], [])
+
+    def test_print_report(self):
+        """Test the printed report."""
+        timings.enable()
+        double(1)
+        timings.command('git log', timings.start(), 10, 20)
+        out = io.StringIO()
+        timings.print_report(timings.report(), out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('phase'))
+        self.assertTrue(any(line.split()[:2] == ['double', '1'] for line in lines))
+        self.assertTrue(any(line.split()[:3] == ['git', 'log', '1'] for line in lines))
+        self.assertTrue(lines[-1].startswith('total'))
+
+    def test_finish_json(self):
+        """Test that finish() writes the report as JSON and stops timing."""
+        timings.enable()
+        double(1)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'timings.json')
+            timings.finish(False, path)
+            results = json.loads(Path(path).read_text())
+        self.assertEqual(results['version'], timings.REPORT_VERSION)
+        self.assertEqual(results['phases'][0]['phase'], 'double')
+        self.assertIsNone(timings.start())
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: sw=4 ts=4 et si:
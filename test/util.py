@@ -9,6 +9,8 @@ import tempfile
 from contextlib import redirect_stderr, redirect_stdout
 from pathlib import Path
 
+import patchtools
+
 # template for the patch.cfg file we create
 PATCH_CFG_TEMPLATE = [
     '[repositories]',
@@ -61,6 +63,9 @@ def import_mut(modname):
         configp = create_config_file()
         dynamic_mod = importlib.import_module(f'patchtools.{modname}')
         main_under_test = dynamic_mod.main
+        # the configuration is loaded on first use, so load it while our
+        # config file exists
+        patchtools.config.load()
         configp.unlink()
     finally:
         pass